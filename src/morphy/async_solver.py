@@ -0,0 +1,123 @@
+import asyncio
+import functools
+import time
+
+from chess import Board
+
+from morphy.line import Line
+from morphy.solver import Solver
+from morphy.utils import (
+    flatten,
+    move,
+)
+
+
+class AsyncSolver(Solver):
+    """
+    Solver driving engines through ``chess.engine``'s asyncio protocol.
+
+    ``engine`` is an ``AsyncEnginePool``. All open lines of a depth are searched
+    concurrently (as many at once as the pool has engines), so many puzzles and
+    engines can share one event loop. ``solve`` is a coroutine, results are
+    read with the same ``to_dict()``. Lookups and writes of the (SQLite)
+    analysis cache run in the default executor of the loop.
+    """
+
+    async def analyse_root(self, fen):
+        return await self.search_best_moves(Line(Board(fen)))
+
+    async def solve(self, fen, root_infos=None):
+        self._start(fen, root_infos)
+
+        while self._open_lines:
+            # Calculate new lines
+            lines = await self._go_deeper()
+            self._update_lines(lines)
+
+    async def _go_deeper(self):
+        with self._measure('go_deeper'), self._measure_ply():
+            return await self._go_deeper_concurrent()
+
+    async def _go_deeper_concurrent(self):
+        lines = [None] * len(self._open_lines)
+        tasks = {asyncio.ensure_future(self._expand_line(l)): i for i, l in enumerate(self._open_lines)}
+        pending = set(tasks)
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for t in done:
+                    lines[tasks[t]] = t.result()
+
+                expanded_lines = [l for l in lines if l is not None]
+                self._evaluate_lines(flatten(expanded_lines))
+                self.should_terminate(expanded_lines)
+        finally:
+            # Cancelling a task stops its engine search, one broken line is enough
+            for t in pending:
+                t.cancel()
+
+            if pending:
+                await asyncio.wait(pending)
+
+        self._depth += 1
+        return lines
+
+    async def _expand_line(self, line):
+        if line.is_player_move():
+            return await self.get_next_player_lines(line)
+
+        return await self.get_next_comp_line(line)
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        # The transposition table alone never blocks the loop
+        if self.analysis_cache is None:
+            return func(*args, **kwargs)
+
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def analyse(self, line, **kwargs):
+        ts = time.perf_counter()
+        infos = await self._run_blocking(self._cached_analysis, line, **kwargs)
+
+        if infos is not None:
+            self._record_analysis(kwargs, infos, ts, cached=True)
+            return infos
+
+        infos = await self.engine.analyse(line.board, **kwargs)
+        await self._run_blocking(self._cache_analysis, line, infos, **kwargs)
+        self._record_analysis(kwargs, infos, ts, cached=False)
+        return infos
+
+    async def get_next_player_lines(self, line):
+        return self._make_player_lines(line, await self.search_best_moves(line))
+
+    async def get_next_comp_line(self, line):
+        return self._make_comp_line(line, await self.search_best_move(line))
+
+    async def search_best_move(self, line, **kwargs):
+        return await self._search(line, self._best_move_search_kwargs(**kwargs), move)
+
+    async def search_best_moves(self, line, **kwargs):
+        return await self._search(
+            line,
+            self._best_moves_search_kwargs(**kwargs),
+            self._winning_moves_key(line),
+            widen=True,
+        )
+
+    async def _search(self, line, kwargs, result_key, widen=False):
+        steps = self._search_steps(line, kwargs, result_key, widen=widen)
+        result = None
+
+        try:
+            while True:
+                peek, step_kwargs = steps.send(result)
+
+                if peek:
+                    result = await self._run_blocking(self._peek_cached_analysis, line, **step_kwargs)
+                else:
+                    result = await self.analyse(line, **step_kwargs)
+        except StopIteration as e:
+            return e.value
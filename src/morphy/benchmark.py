@@ -0,0 +1,347 @@
+import os
+
+ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+import sys
+sys.path.insert(0, os.path.join(ROOT_DIR, '..'))
+
+import collections
+import contextlib
+import functools
+import json
+import time
+import tracemalloc
+
+import click
+import chess.engine
+
+from morphy.config import settings
+from morphy.cache import (
+    AnalysisCache,
+    serialize_info,
+    deserialize_info,
+)
+from morphy.run_solver import (
+    normalize_fen,
+    load_settings,
+    solve_puzzle,
+)
+
+
+def recording_key(board, limit, multipv=None, options=None):
+    return json.dumps([AnalysisCache.make_key(board, limit, multipv=multipv, options=options), limit.depth, limit.nodes])
+
+
+class MissingRecording(Exception):
+    pass
+
+
+class RecordingEngine:
+    """
+    Passes analyses through to ``engine`` and records their results, so a
+    solve can be replayed later without the engine.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.analyses = {}
+
+    def analyse(self, board, limit, multipv=None, options=None, **kwargs):
+        infos = self.engine.analyse(board, limit, multipv=multipv, options=options or {}, **kwargs)
+        self.analyses[recording_key(board, limit, multipv=multipv, options=options)] = (
+            serialize_info(infos) if multipv is None else [serialize_info(i) for i in infos]
+        )
+        return infos
+
+
+class ReplayEngine:
+    """
+    Stand-in engine answering with recorded analyses, deterministic and with
+    (almost) no cost, so only the solver's own work is measured.
+    """
+
+    def __init__(self, analyses):
+        self.analyses = analyses
+        self.calls = 0
+        self.time = 0
+
+    def analyse(self, board, limit, multipv=None, options=None, **kwargs):
+        ts = time.perf_counter()
+        key = recording_key(board, limit, multipv=multipv, options=options)
+
+        try:
+            infos = self.analyses[key]
+        except KeyError:
+            raise MissingRecording('No recorded analysis for {} (recorded with different settings?)'.format(key))
+
+        infos = deserialize_info(infos) if multipv is None else [deserialize_info(i) for i in infos]
+        self.calls += 1
+        self.time += time.perf_counter() - ts
+        return infos
+
+
+class ScriptedEngine:
+    """
+    Synthetic deterministic engine: scores legal moves in generation order,
+    the first one winning, the next ones worse and worse. Useful to record
+    benchmarks where no real engine is available.
+    """
+
+    def analyse(self, board, limit, multipv=None, options=None, **kwargs):
+        moves = list(board.legal_moves)
+        infos = [
+            {
+                'depth': limit.depth or 1,
+                'multipv': i + 1,
+                'score': chess.engine.PovScore(chess.engine.Cp(500 - 400 * i), board.turn),
+                'nodes': limit.nodes or 1000,
+                'pv': [m],
+            }
+            for i, m in enumerate(moves[:multipv or 1])
+        ]
+
+        if not infos:
+            score = chess.engine.Mate(0) if board.is_checkmate() else chess.engine.Cp(0)
+            infos = [{'depth': 0, 'score': chess.engine.PovScore(score, board.turn)}]
+
+        return infos[0] if multipv is None else infos
+
+
+class Profile:
+    """
+    Inclusive time and number of calls of the profiled functions, plus time
+    per solver ply (``_go_deeper`` and ``_update_lines`` of one depth).
+    """
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.times = collections.Counter()
+        self.plies = collections.Counter()
+
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            ts = time.perf_counter()
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.times[name] += time.perf_counter() - ts
+                self.calls[name] += 1
+
+        return wrapper
+
+    def wrap_ply(self, func, depth_offset=0):
+        @functools.wraps(func)
+        def wrapper(solver, *args, **kwargs):
+            depth = solver._depth + depth_offset
+            ts = time.perf_counter()
+
+            try:
+                return func(solver, *args, **kwargs)
+            finally:
+                self.plies[depth] += time.perf_counter() - ts
+
+        return wrapper
+
+
+def profiled_targets():
+    import morphy.solver
+    from morphy.solver import Solver
+    from morphy.line import Line
+
+    return [
+        (Solver, 'solve'),
+        (Solver, 'analyse'),
+        (Solver, '_go_deeper'),
+        (Solver, '_update_lines'),
+        (Solver, '_evaluate_lines'),
+        (Solver, 'should_terminate'),
+        (Solver, 'remove_repetitions'),
+        (Solver, 'extract_best_winning_moves'),
+        (Solver, 'to_dict'),
+        (Line, 'make_move'),
+        (Line, 'copy'),
+        (Line, 'evaluate'),
+        (Line, 'has_repetition'),
+        (morphy.solver, 'flatten'),
+    ]
+
+
+@contextlib.contextmanager
+def profiling(profile):
+    from morphy.solver import Solver
+
+    originals = [(owner, name, getattr(owner, name)) for owner, name in profiled_targets()]
+
+    try:
+        for owner, name, func in originals:
+            label = '{}.{}'.format(getattr(owner, '__name__', owner), name)
+            setattr(owner, name, profile.wrap(label, func))
+
+        # Per ply timings, _update_lines runs after _go_deeper increased the depth
+        Solver._go_deeper = profile.wrap_ply(Solver._go_deeper)
+        Solver._update_lines = profile.wrap_ply(Solver._update_lines, depth_offset=-1)
+        yield profile
+    finally:
+        for owner, name, func in originals:
+            setattr(owner, name, func)
+
+
+def benchmark_puzzle(fen, analyses, repeat=1):
+    """
+    Replays the recorded solve of ``fen`` ``repeat`` times and returns its
+    timings (without the time spent in the replay engine).
+    """
+    profile = Profile()
+    engine = ReplayEngine(analyses)
+    ts = time.perf_counter()
+
+    with profiling(profile):
+        for _ in range(repeat):
+            solution, puzzle_cat, _ = solve_puzzle(fen, engine)
+
+    total_time = time.perf_counter() - ts
+    return {
+        'fen': fen,
+        'is_solved': solution['is_solved'],
+        'category': puzzle_cat,
+        'repeat': repeat,
+        'time': (total_time - engine.time) / repeat,
+        'engine_calls': engine.calls // repeat,
+        'plies': {d: t / repeat for d, t in sorted(profile.plies.items())},
+        'functions': {
+            name: {'calls': profile.calls[name] // repeat, 'time': t / repeat}
+            for name, t in profile.times.most_common()
+        },
+    }
+
+
+def measure_memory(fen, analyses, top=10):
+    """
+    Replays the solve of ``fen`` under ``tracemalloc``. Returns the peak of
+    traced memory and the allocation sites (in morphy) of the memory still
+    held when the solution is ready.
+    """
+    from morphy.solver import Solver
+
+    engine = ReplayEngine(analyses)
+    snapshots = []
+    to_dict = Solver.to_dict
+
+    def to_dict_with_snapshot(solver):
+        # Every line of the solve is still alive here
+        snapshots.append(tracemalloc.take_snapshot())
+        return to_dict(solver)
+
+    tracemalloc.start()
+    Solver.to_dict = to_dict_with_snapshot
+
+    try:
+        solve_puzzle(fen, engine)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        Solver.to_dict = to_dict
+        tracemalloc.stop()
+
+    if not snapshots:
+        return {'peak': peak, 'allocations': []}
+
+    snapshot = snapshots[-1].filter_traces([tracemalloc.Filter(True, os.path.join(ROOT_DIR, '*'))])
+    return {
+        'peak': peak,
+        'allocations': [
+            {'where': str(s.traceback[0]), 'size': s.size, 'count': s.count}
+            for s in snapshot.statistics('lineno')[:top]
+        ],
+    }
+
+
+def load_recording(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--puzzles', '-p', required=True, type=str)
+@click.option('--recording', '-r', required=True, type=str)
+@click.option('--number', '-n', type=int, default=10, show_default=True)
+@click.option('--engine', '-e', 'engine_path', required=False, type=str)
+@click.option('--settings', '-S', 'settings_module', required=False, type=str)
+@click.option('--scripted', is_flag=True, help='Record the synthetic ScriptedEngine instead of a real engine.')
+def record(puzzles, recording, number, engine_path, settings_module, scripted):
+    """
+    Solves puzzles with an engine and records every analysis.
+    """
+    from morphy.engine import EnginePool
+
+    load_settings(settings_module, {'ENGINE_PATH': engine_path or os.environ.get('MORPHY_ENGINE_PATH')})
+
+    with open(puzzles, 'r') as f:
+        fens = [normalize_fen(l) for l in f if l.strip()][:number]
+
+    with contextlib.ExitStack() as stack:
+        if scripted:
+            engine = RecordingEngine(ScriptedEngine())
+        else:
+            assert settings.ENGINE_PATH
+            engine = RecordingEngine(stack.enter_context(EnginePool(engine_path=settings.ENGINE_PATH)))
+
+        for fen in fens:
+            solution, puzzle_cat, solving_time = solve_puzzle(fen, engine)
+            click.echo('{} {} {} {:.1f}s'.format(fen, solution['is_solved'], puzzle_cat, solving_time))
+
+    with open(recording, 'w') as f:
+        json.dump({'puzzles': fens, 'analyses': engine.analyses}, f)
+
+    click.secho('Recorded {} analyses of {} puzzles'.format(len(engine.analyses), len(fens)), fg='green')
+
+
+@cli.command()
+@click.option('--recording', '-r', required=True, type=str)
+@click.option('--repeat', type=int, default=3, show_default=True)
+@click.option('--settings', '-S', 'settings_module', required=False, type=str)
+@click.option('--memory', is_flag=True, help='Also measure memory (separate, slower runs).')
+@click.option('--json', 'json_path', required=False, type=str, help='Write results as JSON.')
+def run(recording, repeat, settings_module, memory, json_path):
+    """
+    Replays recorded puzzles through the solver and reports its own time.
+    """
+    load_settings(settings_module, {})
+    recording = load_recording(recording)
+    results = []
+
+    for fen in recording['puzzles']:
+        result = benchmark_puzzle(fen, recording['analyses'], repeat=repeat)
+
+        if memory:
+            result['memory'] = measure_memory(fen, recording['analyses'])
+
+        results.append(result)
+        click.secho('{} ({}, solved: {})'.format(fen, result['category'], result['is_solved']), fg='green')
+        click.echo('  solver time: {:.4f}s, engine calls: {}'.format(result['time'], result['engine_calls']))
+        click.echo('  per ply: {}'.format(', '.join('{}: {:.4f}s'.format(d, t) for d, t in result['plies'].items())))
+
+        for name, f in result['functions'].items():
+            click.echo('  {:<40} {:>8} calls {:>10.4f}s'.format(name, f['calls'], f['time']))
+
+        if memory:
+            click.echo('  peak memory: {:.1f} KiB'.format(result['memory']['peak'] / 1024))
+
+            for a in result['memory']['allocations']:
+                click.echo('  {:<60} {:>10.1f} KiB {:>8} blocks'.format(a['where'], a['size'] / 1024, a['count']))
+
+    click.secho('Total solver time: {:.4f}s'.format(sum(r['time'] for r in results)), fg='green')
+
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,293 @@
+import json
+import sqlite3
+import threading
+import time
+
+from chess import Move
+from chess.polyglot import zobrist_hash
+from chess.engine import (
+    Cp,
+    Mate,
+    MateGiven,
+    PovScore,
+)
+
+from morphy.config import settings
+
+
+LIMIT_FIELDS = (
+    'time',
+    'mate',
+    'white_clock',
+    'black_clock',
+    'white_inc',
+    'black_inc',
+    'remaining_moves',
+)
+
+
+def position_key(board):
+    # Move counters do not change the engine evaluation
+    return ' '.join(board.fen().split()[:4])
+
+
+def trim_info(info):
+    # The solver only reads the score and the first move of the pv of a cached analysis
+    t_info = {k: info[k] for k in ('score', 'depth', 'nodes') if k in info}
+
+    if 'pv' in info:
+        t_info['pv'] = info['pv'][:1]
+
+    return t_info
+
+
+def trim_infos(infos):
+    if isinstance(infos, list):
+        return [trim_info(i) for i in infos]
+
+    return trim_info(infos)
+
+
+def serialize_score(pov_score):
+    s = pov_score.relative
+
+    if s == MateGiven:
+        value = {'mate_given': True}
+    elif s.is_mate():
+        value = {'mate': s.mate()}
+    else:
+        value = {'cp': s.score()}
+
+    value['turn'] = pov_score.turn
+    return value
+
+
+def deserialize_score(value):
+    if value.get('mate_given'):
+        s = MateGiven
+    elif 'mate' in value:
+        s = Mate(value['mate'])
+    else:
+        s = Cp(value['cp'])
+
+    return PovScore(s, value['turn'])
+
+
+def serialize_info(info):
+    s_info = {}
+
+    for k, v in info.items():
+        if k == 'score':
+            s_info[k] = serialize_score(v)
+        elif k == 'currmove':
+            s_info[k] = v.uci()
+        elif k == 'pv':
+            s_info[k] = [m.uci() for m in v]
+        elif k in ('refutation', 'currline'):
+            # Rarely sent by engines and never used by the solver
+            continue
+        elif k == 'wdl':
+            s_info[k] = list(v)
+        else:
+            s_info[k] = v
+
+    return s_info
+
+
+def deserialize_info(s_info):
+    info = dict(s_info)
+
+    if 'score' in info:
+        info['score'] = deserialize_score(info['score'])
+
+    if 'currmove' in info:
+        info['currmove'] = Move.from_uci(info['currmove'])
+
+    if 'pv' in info:
+        info['pv'] = [Move.from_uci(m) for m in info['pv']]
+
+    if 'wdl' in info:
+        info['wdl'] = tuple(info['wdl'])
+
+    return info
+
+
+class AnalysisCache:
+    """
+    Persistent (SQLite) cache of engine analyses.
+
+    Results are keyed by the position without move counters plus the search
+    configuration (multipv, engine options, limit). Depth and nodes are kept
+    out of the key, so a result of a deeper search answers a shallower request.
+    The least recently used results are evicted when there are more than
+    ``max_size`` of them. Access times of hits are kept in memory and written
+    with the next put, so reads never write to the database.
+    """
+
+    def __init__(self, path, max_size=settings.ANALYSIS_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._accessed = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS analysis ('
+            'key TEXT NOT NULL, '
+            'depth INTEGER NOT NULL, '
+            'nodes INTEGER NOT NULL, '
+            'infos TEXT NOT NULL, '
+            'accessed REAL NOT NULL, '
+            'PRIMARY KEY (key, depth, nodes))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS analysis_accessed ON analysis (accessed)')
+        self._db.commit()
+        self._size = self._db.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+
+    @staticmethod
+    def make_key(board, limit, multipv=None, options=None):
+        return json.dumps([
+            position_key(board),
+            multipv,
+            sorted((options or {}).items()),
+            [getattr(limit, f) for f in LIMIT_FIELDS],
+        ])
+
+    @staticmethod
+    def _limit_value(value):
+        # NULLs are not unique in SQLite primary keys
+        return -1 if value is None else value
+
+    def _select(self, columns, board, limit, multipv=None, options=None):
+        key = self.make_key(board, limit, multipv=multipv, options=options)
+        query = 'SELECT {} FROM analysis WHERE key = ?'.format(columns)
+        params = [key]
+
+        for field in ('depth', 'nodes'):
+            value = getattr(limit, field)
+            query += ' AND {} {} ?'.format(field, '=' if value is None else '>=')
+            params.append(self._limit_value(value))
+
+        query += ' ORDER BY depth DESC, nodes DESC LIMIT 1'
+        return key, self._db.execute(query, params).fetchone()
+
+    def contains(self, board, limit, multipv=None, options=None):
+        # Neither a hit nor a miss, nor an access of the result
+        with self._lock:
+            _, row = self._select('1', board, limit, multipv=multipv, options=options)
+
+        return row is not None
+
+    def get(self, board, limit, multipv=None, options=None):
+        with self._lock:
+            key, row = self._select('depth, nodes, infos', board, limit, multipv=multipv, options=options)
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._accessed[(key, row[0], row[1])] = time.time()
+
+        infos = [deserialize_info(i) for i in json.loads(row[2])]
+        return infos[0] if multipv is None else infos
+
+    def put(self, board, infos, limit, multipv=None, options=None):
+        key = self.make_key(board, limit, multipv=multipv, options=options)
+        s_infos = json.dumps([serialize_info(i) for i in ([infos] if multipv is None else infos)])
+
+        row_key = (key, self._limit_value(limit.depth), self._limit_value(limit.nodes))
+
+        with self._lock:
+            self._flush_accessed()
+            exists = self._db.execute(
+                'SELECT 1 FROM analysis WHERE key = ? AND depth = ? AND nodes = ?', row_key
+            ).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO analysis (key, depth, nodes, infos, accessed) VALUES (?, ?, ?, ?, ?)',
+                row_key + (s_infos, time.time())
+            )
+
+            if exists is None:
+                self._size += 1
+
+            self._evict()
+            self._db.commit()
+
+    def _flush_accessed(self):
+        if not self._accessed:
+            return
+
+        self._db.executemany(
+            'UPDATE analysis SET accessed = ? WHERE key = ? AND depth = ? AND nodes = ?',
+            [(accessed, ) + row_key for row_key, accessed in self._accessed.items()]
+        )
+        self._accessed = {}
+
+    def _evict(self):
+        if self.max_size is None or self._size <= self.max_size:
+            return
+
+        self._db.execute(
+            'DELETE FROM analysis WHERE rowid IN (SELECT rowid FROM analysis ORDER BY accessed LIMIT ?)',
+            (self._size - self.max_size, )
+        )
+        self._size = self._db.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+
+    def __len__(self):
+        return self._size
+
+    def close(self):
+        with self._lock:
+            self._flush_accessed()
+            self._db.commit()
+            self._db.close()
+
+
+class TranspositionTable:
+    """
+    In-memory cache of engine analyses for positions reached by different move
+    orders. Keyed by the Zobrist hash of the position and the exact search
+    configuration. Only the score, depth, nodes and the first move of the pv
+    of the infos are kept.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._table = {}
+
+    @staticmethod
+    def make_key(board, limit, multipv=None, options=None):
+        return (
+            zobrist_hash(board),
+            multipv,
+            tuple(sorted((options or {}).items())),
+            tuple(getattr(limit, f) for f in LIMIT_FIELDS + ('depth', 'nodes')),
+        )
+
+    def contains(self, board, limit, multipv=None, options=None):
+        return self.make_key(board, limit, multipv=multipv, options=options) in self._table
+
+    def get(self, board, limit, multipv=None, options=None):
+        infos = self._table.get(self.make_key(board, limit, multipv=multipv, options=options))
+
+        if infos is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return infos
+
+    def put(self, board, infos, limit, multipv=None, options=None):
+        self._table[self.make_key(board, limit, multipv=multipv, options=options)] = trim_infos(infos)
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self._table = {}
+
+    def __len__(self):
+        return len(self._table)
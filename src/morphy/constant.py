@@ -20,3 +20,11 @@ MATERIAL_CAT = 'MATERIAL_CAT'
 MATE_CAT = 'MATE_CAT'
 MATE_MATERIAL_CAT = 'MATE_MATERIAL_CAT'
 UNKNOWN_CAT = 'UNKNOWN_CAT'
+
+# Reasons of CannotSolve
+BROKEN_LINE = 'broken_line'
+TOO_MANY_GOOD_MOVES = 'too_many_good_moves'
+SOLUTION_TOO_LONG = 'solution_too_long'
+TOO_MANY_SOLUTIONS = 'too_many_solutions'
+GAME_OVER = 'game_over'
+PREDICTED_FAILURE = 'predicted_failure'
@@ -5,94 +5,53 @@ ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
 import sys
 sys.path.insert(0, os.path.join(ROOT_DIR, '..'))
 
-from io import StringIO
-import time
-
-import chess.pgn
-import chess.engine
-
+from morphy.pgn_reader import mmap_games
+from morphy.mining import (
+    mine_games,
+    mine_in_shards,
+    mining_session,
+    open_mining_metrics,
+    holds_at_every_threshold,
+)
 from morphy.utils import (
-    games_reader,
-    is_winning_move,
-    score,
     move as move_,
     see,
-    one_winning_move,
-    is_losing_move,
     one_non_losing_move,
 )
 
 
 ENGINE_PATH = os.environ.get('MORPHY_ENGINE_PATH')
+METRICS_PATH = os.environ.get('MORPHY_METRICS_PATH')
+CANDIDATE_FILTER = one_non_losing_move
 
 
-def save_fen(fen, out_file):
-    with open(out_file, 'a') as f:
-        f.write('{}\n'.format(fen))
-
-
-def is_good_puzzle(board, engine, nodes, move, prev_boards):
+def is_good_puzzle(board, engine, move, prev_boards):
     
     if len(prev_boards) < 3:
         return False
-    
-    infos = engine.analyse(board, chess.engine.Limit(nodes=nodes), multipv=2)
-    best_move = move_(infos[0])
-    good_puzzle = one_non_losing_move(infos)
-    
-    if good_puzzle:
-        infos = engine.analyse(
-            prev_boards[-3],
-            chess.engine.Limit(nodes=nodes),
-            multipv=2,
-        )
-        good_puzzle = good_puzzle and (not one_non_losing_move(infos))
 
-    good_puzzle = good_puzzle and (see(board, best_move) <= 0)
+    def is_good_position(infos):
+        best_move = move_(infos[0])
+        return one_non_losing_move(infos) and (see(board, best_move) <= 0) and (move != best_move)
 
-    good_puzzle = good_puzzle and (move != best_move)   
-    
-    return good_puzzle
+    def had_more_defenses(infos):
+        return not one_non_losing_move(infos)
 
+    return (holds_at_every_threshold(engine, board, is_good_position, multipv=2) and
+            holds_at_every_threshold(engine, prev_boards[-3], had_more_defenses, multipv=2))
 
-def main(pgn_file, out_file):
-    
-    game_number = 1
-    
-    for game_str in games_reader(open(pgn_file, 'r')):
-        print('Game number: {}'.format(game_number))
-        engine = chess.engine.SimpleEngine.popen_uci(ENGINE_PATH)
-        game = chess.pgn.read_game(StringIO(game_str))
-        board = game.board()
-        moves = list(game.mainline_moves())
-        prev_boards = [board.copy()]
-        
-        for move in moves:
-            infos = engine.analyse(board, chess.engine.Limit(nodes=10**6), multipv=2)
-            
-            if one_non_losing_move(infos):
-                nodes = 10**6
-                
-                while nodes < 40 * (10**6):
-                    if is_good_puzzle(board, engine, nodes, move, prev_boards):
-                        nodes = int(nodes * 1.4)
-                        is_puzzle_candidate = True
-                    else:
-                        is_puzzle_candidate = False
-                        break
-                
-                if is_puzzle_candidate:
-                    print('Tactics found: {}'.format(board.fen()))
-                    save_fen(board.fen(), out_file)
-                    
-            board.push(move)
-            prev_boards.append(board.copy())
-
-        engine.close()
-        game_number += 1
-        print('No tactics found :(')
-        time.sleep(20)
+
+def main(pgn_file, out_file, workers=1):
+
+    if workers > 1:
+        mine_in_shards(pgn_file, out_file, workers, ENGINE_PATH, CANDIDATE_FILTER, is_good_puzzle,
+                       metrics_path=METRICS_PATH)
+        return
+
+    with mining_session(ENGINE_PATH) as session:
+        mine_games(mmap_games(pgn_file), session, out_file, CANDIDATE_FILTER, is_good_puzzle,
+                   metrics=open_mining_metrics(METRICS_PATH))
 
 
 if __name__ == '__main__':
-    main(sys.argv[1], sys.argv[2])
+    main(sys.argv[1], sys.argv[2], *[int(w) for w in sys.argv[3:4]])
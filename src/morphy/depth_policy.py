@@ -0,0 +1,52 @@
+from morphy.engine import Limit
+
+
+class FixedDepthPolicy:
+    """
+    Searches every position once, with the limit of the search conf.
+    """
+
+    def limits(self, limit):
+        yield limit
+
+    def is_settled(self, results):
+        return False
+
+    def __repr__(self):
+        return 'FixedDepthPolicy()'
+
+
+class AdaptiveDepthPolicy:
+    """
+    Searches a position at ``start_depth``, then ``step`` plies deeper at a
+    time up to the depth of the search conf, and stops as soon as the result
+    (the winning moves of a player move, the best computer reply) has been the
+    same for ``stable_iterations`` depths in a row. Limits without a depth are
+    searched once.
+    """
+
+    def __init__(self, start_depth=16, step=4, stable_iterations=2):
+        assert start_depth >= 1
+        assert step >= 1
+        assert stable_iterations >= 2
+        self.start_depth = start_depth
+        self.step = step
+        self.stable_iterations = stable_iterations
+
+    def limits(self, limit):
+        if not limit.depth or limit.nodes or limit.time or limit.mate:
+            yield limit
+            return
+
+        for depth in range(self.start_depth, limit.depth, self.step):
+            yield Limit(depth=depth)
+
+        yield limit
+
+    def is_settled(self, results):
+        last = results[-self.stable_iterations:]
+        return len(last) == self.stable_iterations and all(r == last[0] for r in last)
+
+    def __repr__(self):
+        return 'AdaptiveDepthPolicy(start_depth={}, step={}, stable_iterations={})'.format(
+            self.start_depth, self.step, self.stable_iterations)
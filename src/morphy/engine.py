@@ -1,6 +1,13 @@
+import asyncio
+import contextlib
+import queue
+import threading
+
 from chess.engine import (
     Limit as _Limit,
     SimpleEngine,
+    EngineError,
+    popen_uci,
 )
 
 
@@ -24,3 +31,220 @@ class Limit(_Limit):
 def open_engine(engine_path=None):
     from morphy.config import settings
     return SimpleEngine.popen_uci(engine_path or settings.ENGINE_PATH)
+
+
+async def open_async_engine(engine_path=None):
+    from morphy.config import settings
+    _, engine = await popen_uci(engine_path or settings.ENGINE_PATH)
+    return engine
+
+
+class AnalysisStopped(Exception):
+    pass
+
+
+def analyse_until(engine, stop_event, board, limit, multipv=None, **kwargs):
+    """
+    Same as ``engine.analyse`` but the search is stopped (and ``AnalysisStopped``
+    raised) as soon as ``stop_event`` is set by another thread.
+    """
+    if stop_event.is_set():
+        raise AnalysisStopped
+
+    with engine.analysis(board, limit, multipv=multipv, **kwargs) as analysis:
+        for _ in analysis:
+            if stop_event.is_set():
+                raise AnalysisStopped
+
+        return analysis.info if multipv is None else analysis.multipv
+
+
+class EnginePool:
+    """
+    Pool of warm engine processes shared across puzzles and games.
+
+    Engines are started lazily, handed out with ``checkout``/``checkin`` (or the
+    ``engine`` context manager) and pinged before every checkout, so an engine
+    which crashed in the meantime is transparently replaced by a fresh one.
+    """
+
+    def __init__(self, size=1, engine_path=None):
+        assert size >= 1
+        self.size = size
+        self.engine_path = engine_path
+        self._idle = queue.LifoQueue()
+        self._engines = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open_engine(self):
+        engine = open_engine(self.engine_path)
+
+        with self._lock:
+            self._engines.append(engine)
+
+        return engine
+
+    def _discard(self, engine):
+        with self._lock:
+            if engine in self._engines:
+                self._engines.remove(engine)
+
+        with contextlib.suppress(Exception):
+            engine.quit()
+
+        with contextlib.suppress(Exception):
+            engine.close()
+
+    @staticmethod
+    def is_healthy(engine):
+        try:
+            engine.ping()
+        except (EngineError, asyncio.TimeoutError):
+            return False
+        return True
+
+    def restart(self, engine):
+        self._discard(engine)
+        return self._open_engine()
+
+    def checkout(self, timeout=None):
+        assert not self._closed
+
+        try:
+            engine = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if len(self._engines) < self.size:
+                    engine = open_engine(self.engine_path)
+                    self._engines.append(engine)
+                    return engine
+
+            engine = self._idle.get(timeout=timeout)
+
+        if not self.is_healthy(engine):
+            engine = self.restart(engine)
+
+        return engine
+
+    def checkin(self, engine):
+        if self._closed:
+            self._discard(engine)
+        else:
+            self._idle.put(engine)
+
+    @contextlib.contextmanager
+    def engine(self, timeout=None):
+        engine = self.checkout(timeout=timeout)
+
+        try:
+            yield engine
+        finally:
+            self.checkin(engine)
+
+    def analyse(self, board, *args, stop_event=None, **kwargs):
+        with self.engine() as engine:
+            if stop_event is None:
+                return engine.analyse(board, *args, **kwargs)
+
+            return analyse_until(engine, stop_event, board, *args, **kwargs)
+
+    def close(self):
+        self._closed = True
+
+        for engine in list(self._engines):
+            self._discard(engine)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncEnginePool:
+    """
+    Asyncio counterpart of ``EnginePool``, handing out ``chess.engine.UciProtocol``
+    instances driven by the running event loop (no thread per engine).
+    Has to be created inside the event loop it is used in.
+    """
+
+    def __init__(self, size=1, engine_path=None):
+        assert size >= 1
+        self.size = size
+        self.engine_path = engine_path
+        self._idle = asyncio.LifoQueue()
+        self._engines = []
+        self._lock = asyncio.Lock()
+        self._closed = False
+
+    @staticmethod
+    async def is_healthy(engine, timeout=10):
+        try:
+            await asyncio.wait_for(engine.ping(), timeout)
+        except (EngineError, asyncio.TimeoutError):
+            return False
+        return True
+
+    async def _discard(self, engine):
+        if engine in self._engines:
+            self._engines.remove(engine)
+
+        with contextlib.suppress(Exception):
+            await asyncio.wait_for(engine.quit(), 10)
+
+    async def restart(self, engine):
+        await self._discard(engine)
+        new_engine = await open_async_engine(self.engine_path)
+        self._engines.append(new_engine)
+        return new_engine
+
+    async def checkout(self):
+        assert not self._closed
+
+        try:
+            engine = self._idle.get_nowait()
+        except asyncio.QueueEmpty:
+            async with self._lock:
+                if len(self._engines) < self.size:
+                    engine = await open_async_engine(self.engine_path)
+                    self._engines.append(engine)
+                    return engine
+
+            engine = await self._idle.get()
+
+        if not await self.is_healthy(engine):
+            engine = await self.restart(engine)
+
+        return engine
+
+    async def checkin(self, engine):
+        if self._closed:
+            await self._discard(engine)
+        else:
+            self._idle.put_nowait(engine)
+
+    @contextlib.asynccontextmanager
+    async def engine(self):
+        engine = await self.checkout()
+
+        try:
+            yield engine
+        finally:
+            await self.checkin(engine)
+
+    async def analyse(self, board, *args, **kwargs):
+        async with self.engine() as engine:
+            return await engine.analyse(board, *args, **kwargs)
+
+    async def close(self):
+        self._closed = True
+
+        for engine in list(self._engines):
+            await self._discard(engine)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -0,0 +1,73 @@
+import collections
+
+from morphy.config import settings
+from morphy.cache import deserialize_score
+from morphy.constant import PREDICTED_FAILURE
+
+
+def root_bucket(puzzle_cat, root_score, cp_bucket=settings.FAILURE_PREDICTOR_CP_BUCKET,
+                max_mate=settings.FAILURE_PREDICTOR_MAX_MATE):
+    """
+    Groups puzzles by category and evaluation of the root position (relative
+    to the side to move): centipawns in ``cp_bucket`` wide buckets, mates by
+    distance up to ``max_mate``.
+    """
+    s = deserialize_score(root_score).relative
+
+    if s.is_mate():
+        mate = s.mate() or 0
+        return puzzle_cat, 'mate', max(-max_mate, min(max_mate, mate))
+
+    return puzzle_cat, 'cp', s.score() // cp_bucket
+
+
+class FailurePredictor:
+    """
+    Predicts from solved and unsolved records which puzzles are not worth
+    solving: those whose bucket (see ``root_bucket``) failed expensively, after
+    at least ``expensive_time`` engine seconds, in ``skip_rate`` of at least
+    ``min_samples`` puzzles.
+    """
+
+    def __init__(self, min_samples=settings.FAILURE_PREDICTOR_MIN_SAMPLES,
+                 skip_rate=settings.FAILURE_PREDICTOR_SKIP_RATE,
+                 expensive_time=settings.FAILURE_PREDICTOR_EXPENSIVE_TIME):
+        self.min_samples = min_samples
+        self.skip_rate = skip_rate
+        self.expensive_time = expensive_time
+        self.samples = collections.Counter()
+        self.failures = collections.Counter()
+
+    @classmethod
+    def from_solutions(cls, solutions, **kwargs):
+        predictor = cls(**kwargs)
+
+        for solution in solutions:
+            predictor.add(solution)
+
+        return predictor
+
+    def add(self, solution):
+        search = solution.get('search')
+
+        # Older records have no search summary, skipped ones no search at all
+        if not search or search.get('reason') == PREDICTED_FAILURE or not search.get('root_score'):
+            return
+
+        bucket = root_bucket(search['puzzle_cat'], search['root_score'])
+        self.samples[bucket] += 1
+
+        if not solution['is_solved'] and search['engine_time'] >= self.expensive_time:
+            self.failures[bucket] += 1
+
+    def failure_rate(self, puzzle_cat, root_score):
+        bucket = root_bucket(puzzle_cat, root_score)
+
+        if self.samples[bucket] < self.min_samples:
+            return None
+
+        return self.failures[bucket] / self.samples[bucket]
+
+    def should_skip(self, puzzle_cat, root_score):
+        rate = self.failure_rate(puzzle_cat, root_score)
+        return rate is not None and rate >= self.skip_rate
@@ -18,6 +18,7 @@ from morphy.constant import (
     MATERIAL_CAT,
 )
 from morphy.line import Line as _Line
+from morphy.solutions import open_solutions
 
 
 def too_long_line(p):
@@ -33,31 +34,22 @@ def too_long_line(p):
             line._make_move(Move.from_uci(m))
             pm.append((line.get_player_material(), line.get_comp_material()))
 
-        if pm[-1] == pm[-2]:
+        if len(pm) > 1 and pm[-1] == pm[-2]:
             return True
 
     return False
 
 
 def main():
-    puzzles_path = sys.argv[1]
-    puzzles = []
-
-    with open(puzzles_path, 'r') as puzzles_file:
-       for l in puzzles_file:
-           l = l.strip()
-           if l:
-               puzzles.append(json.loads(l))
-
-    for p in puzzles:
-        fen = Puzzle.normalize_fen(p['fen'])
-
-        if not p['is_solved']:
-            continue
-        puzzle = Puzzle.create_puzzle(p)
-
-        if too_long_line(puzzle):
-            print(json.dumps(p))
+    # A JSON lines file or a SQLite store
+    with open_solutions(sys.argv[1]) as solutions:
+        for p in solutions:
+            if not p['is_solved']:
+                continue
+            puzzle = Puzzle.create_puzzle(p)
+
+            if too_long_line(puzzle):
+                print(json.dumps(p))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
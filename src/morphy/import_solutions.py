@@ -0,0 +1,41 @@
+import os
+
+ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+import sys
+sys.path.insert(0, os.path.join(ROOT_DIR, '..'))
+
+import click
+
+from morphy.run_solver import load_settings
+
+
+@click.command()
+@click.argument('jsonl_file', type=click.Path(exists=True, dir_okay=False))
+@click.argument('store_file', type=str)
+@click.option('--settings', '-S', 'settings_module', required=False, type=str)
+def main(jsonl_file, store_file, settings_module):
+    """
+    Imports the solutions of a JSON lines file into a SQLite solutions store
+    (created if needed). Solutions of positions already in the store replace
+    them.
+    """
+    load_settings(settings_module or os.environ.get('MORPHY_SETTINGS_MODULE'), {})
+
+    from morphy.solutions import (
+        SolutionsStore,
+        is_sqlite_file,
+    )
+
+    if is_sqlite_file(store_file) is False:
+        raise click.BadParameter('not an SQLite solutions store', param_hint='STORE_FILE')
+
+    with SolutionsStore(store_file) as store:
+        before = store.count()
+        store.import_jsonl(jsonl_file)
+        click.secho('Imported {} new solutions, {} in the store'.format(store.count() - before, store.count()),
+                    fg='green')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 from chess import (
+    PAWN,
     KNIGHT,
     ROOK,
-    WHITE,
 )
 
 from morphy.utils import (
@@ -15,44 +15,160 @@ from morphy.constant import (
     UNKNOWN_CAT,
     MATE_CAT,
     MATERIAL_CAT,
+    GAME_OVER,
 )
 
 
+class AnalysisRecord:
+    """
+    The part of an engine info kept in the move tree. Only the score is read
+    again by the solver, depth and nodes are kept for diagnostics. Supports
+    ``record['score']`` so it can be used wherever an info dict is expected.
+    """
+    __slots__ = ('score', 'depth', 'nodes')
+
+    def __init__(self, score, depth=None, nodes=None):
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+
+    @classmethod
+    def from_info(cls, info):
+        return cls(info['score'], depth=info.get('depth'), nodes=info.get('nodes'))
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if not isinstance(other, AnalysisRecord):
+            return NotImplemented
+
+        return (self.score, self.depth, self.nodes) == (other.score, other.depth, other.nodes)
+
+    def __repr__(self):
+        return 'AnalysisRecord(score={!r}, depth={!r}, nodes={!r})'.format(self.score, self.depth, self.nodes)
+
+
+class MoveNode:
+    """
+    Node of the move tree shared by all lines of a puzzle: one move, the
+    analysis which chose it and a pointer to the previous node.
+    """
+    __slots__ = ('move', 'info', 'parent', 'depth')
+
+    def __init__(self, move=None, info=None, parent=None):
+        self.move = move
+        self.info = info
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+
+    def moves(self):
+        moves = []
+        node = self
+
+        while node.parent is not None:
+            moves.append(node.move)
+            node = node.parent
+
+        moves.reverse()
+        return moves
+
+
 class Line:
+    __slots__ = ('_board', '_root_board', '_node', '_closed', '_player_color', '_material',
+                 '_initial_player_material', '_initial_comp_material', '_parent', '_children',
+                 '_repeated_position')
     
     def __init__(self, board):
-        self.board = board
+        self._board = board
+        # Boards of lines which are not open anymore are released and rebuilt from the root on demand
+        self._root_board = board.copy()
+        self._node = MoveNode()
         self._closed = False
-        self._player_color = self.get_player_color()
-        self._analysis_result = []
+        self._player_color = board.root().turn
+        # Material indexed by color, updated incrementally by _make_move
+        self._material = [black_material(board), white_material(board)]
         self._initial_player_material = self.get_player_material()
         self._initial_comp_material = self.get_comp_material()
         self._parent = None
         self._children = []
         self._repeated_position = False
+
+    @property
+    def board(self):
+        if self._board is None:
+            parent = self._parent
+            parent_board = parent._board if parent is not None else None
+
+            # Copies and children are built from the board of their parent while it is still there
+            if parent_board is not None and parent._node is self._node:
+                board = parent_board.copy()
+            elif parent_board is not None and parent._node is self._node.parent:
+                board = parent_board.copy()
+                board.push(self._node.move)
+            else:
+                board = self._root_board.copy()
+
+                for m in self._node.moves():
+                    board.push(m)
+
+            self._board = board
+
+        return self._board
+
+    def release_board(self):
+        self._board = None
         
     def get_player_color(self):
-        return self.board.root().turn
+        return self._player_color
     
     def copy(self):
-        new_line = type(self)(self.board.copy())
+        new_line = type(self).__new__(type(self))
+        new_line._board = None
+        new_line._root_board = self._root_board
+        new_line._node = self._node
         new_line._closed = self._closed
-        new_line._analysis_result = self._analysis_result[:]
+        new_line._player_color = self._player_color
+        new_line._material = self._material[:]
         new_line._initial_comp_material = self._initial_comp_material
         new_line._initial_player_material = self._initial_player_material
         new_line._parent = self
+        new_line._children = []
         new_line._repeated_position = self._repeated_position
         self._children.append(new_line)
         return new_line
     
-    def _make_move(self, move):
-        self.board.push(move)
+    def _update_material(self, board, move):
+        turn = board.turn
+
+        if board.is_en_passant(move):
+            captured = PAWN
+        elif board.color_at(move.to_square) is (not turn):
+            captured = board.piece_type_at(move.to_square)
+        else:
+            captured = None
+
+        if captured:
+            self._material[not turn] -= PIECE_VALUES[captured]
+
+        if move.promotion:
+            self._material[turn] += PIECE_VALUES[move.promotion] - PIECE_VALUES[PAWN]
+
+    def _make_move(self, move, info=None):
+        board = self.board
+        self._update_material(board, move)
+        board.push(move)
+        self._node = MoveNode(move, info, self._node)
     
     def make_move(self, move, info=None):
         assert not self.is_closed()
         line = self.copy()
-        line._make_move(move)
-        line._analysis_result.append(info)
+        # The board of the new line is only built when it is read
+        line._update_material(self.board, move)
+        line._node = MoveNode(move, info, self._node)
         return line
     
     def close(self):
@@ -68,14 +184,10 @@ class Line:
         return self.board.turn == self._player_color
     
     def get_player_material(self):
-        if self._player_color is WHITE:
-            return white_material(self.board)
-        return black_material(self.board)
+        return self._material[self._player_color]
     
     def get_comp_material(self):
-        if self._player_color is WHITE:
-            return black_material(self.board)
-        return white_material(self.board)
+        return self._material[not self._player_color]
 
     def player_won_game(self):
         return self.board.is_checkmate() and not  self.is_player_move()
@@ -98,10 +210,10 @@ class Line:
         )
     
     def get_line_category(self):
-        if not self._analysis_result or not self._analysis_result[-1]:
+        if not self._node.info:
             return UNKNOWN_CAT
         
-        if score(self._analysis_result[-1]).is_mate():
+        if score(self._node.info).is_mate():
             return MATE_CAT
         
         return MATERIAL_CAT
@@ -114,13 +226,13 @@ class Line:
             return 
         
         if self.board.is_game_over(claim_draw=True):
-            cannot_solve()
+            cannot_solve('Game over: {}'.format(self.board.result(claim_draw=True)), reason=GAME_OVER)
     
     def moves(self):
-        return self.board.move_stack
+        return self._root_board.move_stack + self._node.moves()
     
     def length(self):
-        return len(self.board.move_stack)
+        return len(self._root_board.move_stack) + self._node.depth
     
     def is_repetition(self):
         return self.board.is_repetition(2)
@@ -133,7 +245,7 @@ class Line:
             'category': self.get_line_category(),
             'is_closed': self.is_closed(),
             'player_color': self.get_player_color(),
-            'moves': [m.uci() for m in self.board.move_stack],
+            'moves': [m.uci() for m in self.moves()],
             'initial_player_material': self._initial_player_material,
             'initial_comp_material': self._initial_comp_material,
             'player_material': self.get_player_material(),
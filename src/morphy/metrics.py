@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+
+from morphy.config import settings
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in sorted(labels.items())
+    ))
+
+
+class Metrics:
+    """
+    Counters and gauges of a long-running job, written in the Prometheus text
+    format to ``path`` for the node_exporter textfile collector. ``labels``
+    are added to every sample. The file is replaced atomically, at most once
+    every ``interval`` seconds unless forced.
+    """
+
+    def __init__(self, path, labels=None, interval=settings.METRICS_INTERVAL):
+        self.path = path
+        self.labels = labels or {}
+        self.interval = interval
+        self.started = time.time()
+        self._metrics = {}
+        self._samples = {}
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        self._metrics[name] = ('counter', help_text)
+
+    def gauge(self, name, help_text):
+        self._metrics[name] = ('gauge', help_text)
+
+    def _key(self, name, labels):
+        assert name in self._metrics, 'Undeclared metric: {}'.format(name)
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = self._key(name, labels)
+
+        with self._lock:
+            self._samples[key] = value
+
+    def get(self, name, **labels):
+        with self._lock:
+            return self._samples.get(self._key(name, labels), 0)
+
+    def total(self, name):
+        with self._lock:
+            return sum(v for (n, _), v in self._samples.items() if n == name)
+
+    def render(self):
+        lines = []
+
+        with self._lock:
+            samples = sorted(self._samples.items())
+
+        for name, (metric_type, help_text) in sorted(self._metrics.items()):
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+
+            for (sample_name, labels), value in samples:
+                if sample_name == name:
+                    lines.append('{}{} {}'.format(name, _format_labels(dict(self.labels, **dict(labels))), value))
+
+        return ''.join('{}\n'.format(l) for l in lines)
+
+    def write(self, force=False):
+        now = time.time()
+
+        if not force and now - self._written < self.interval:
+            return
+
+        self._written = now
+        # The collector must never read a half written file
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+
+        os.replace(tmp_path, self.path)
+
+    def hours(self):
+        return max(time.time() - self.started, 1) / 3600
+
+
+def solver_metrics(path, labels=None):
+    metrics = Metrics(path, labels=labels)
+    metrics.counter('morphy_puzzles_total', 'Puzzles solved or given up, by result and category.')
+    metrics.counter('morphy_puzzle_errors_total', 'Puzzles failed by an error (e.g. a crashed engine).')
+    metrics.counter('morphy_cannot_solve_total', 'Unsolved puzzles by the check which stopped the solver.')
+    metrics.counter('morphy_solving_seconds_total', 'Wall time spent solving puzzles.')
+    metrics.counter('morphy_engine_seconds_total', 'Time spent waiting for engine analyses.')
+    metrics.counter('morphy_analyses_total', 'Analyses by source, the engine or a cache.')
+    metrics.gauge('morphy_puzzles_per_hour', 'Puzzles done per hour since the start of the job.')
+    metrics.gauge('morphy_engine_seconds_per_puzzle', 'Average engine time per puzzle.')
+    metrics.gauge('morphy_analysis_cache_hit_ratio', 'Share of analyses answered by a cache.')
+    metrics.gauge('morphy_last_puzzle_timestamp_seconds', 'Unix time of the last puzzle done.')
+    metrics.gauge('morphy_queue_size', 'Items waiting in the queue of a pipeline stage.')
+    return metrics
+
+
+def record_solution(metrics, solution, puzzle_cat, solving_time, stats=None):
+    result = 'solved' if solution['is_solved'] else 'unsolved'
+    metrics.inc('morphy_puzzles_total', result=result, category=puzzle_cat)
+    metrics.inc('morphy_solving_seconds_total', solving_time)
+
+    if not solution['is_solved']:
+        metrics.inc('morphy_cannot_solve_total', reason=solution.get('reason') or 'unknown')
+
+    if stats is not None:
+        metrics.inc('morphy_engine_seconds_total', stats['engine_time'])
+        metrics.inc('morphy_analyses_total', stats['analyses'] - stats['cached'], source='engine')
+        metrics.inc('morphy_analyses_total', stats['cached'], source='cache')
+
+    puzzles = metrics.total('morphy_puzzles_total')
+    analyses = metrics.total('morphy_analyses_total')
+    metrics.set('morphy_puzzles_per_hour', puzzles / metrics.hours())
+    metrics.set('morphy_engine_seconds_per_puzzle', metrics.get('morphy_engine_seconds_total') / puzzles)
+
+    if analyses:
+        metrics.set('morphy_analysis_cache_hit_ratio', metrics.get('morphy_analyses_total', source='cache') / analyses)
+
+    metrics.set('morphy_last_puzzle_timestamp_seconds', time.time())
+
+
+def record_error(metrics):
+    metrics.inc('morphy_puzzle_errors_total')
+
+
+def mining_metrics(path, labels=None):
+    metrics = Metrics(path, labels=labels)
+    metrics.counter('morphy_games_total', 'Games mined.')
+    metrics.counter('morphy_mined_puzzles_total', 'Puzzles found in the mined games.')
+    metrics.counter('morphy_positions_total', 'Positions checked by the puzzle filter.')
+    metrics.counter('morphy_positions_rejected_total', 'Positions rejected, by filter stage.')
+    metrics.gauge('morphy_games_per_hour', 'Games mined per hour since the start of the job.')
+    metrics.gauge('morphy_last_game_timestamp_seconds', 'Unix time of the last game mined.')
+    return metrics
+
+
+def record_game(metrics, puzzles_found, puzzle_filter):
+    metrics.inc('morphy_games_total')
+    metrics.inc('morphy_mined_puzzles_total', puzzles_found)
+    # The filter keeps its own totals
+    metrics.set('morphy_positions_total', puzzle_filter.positions)
+
+    for stage, _ in puzzle_filter.stages:
+        metrics.set('morphy_positions_rejected_total', puzzle_filter.rejected[stage], stage=stage)
+
+    metrics.set('morphy_games_per_hour', metrics.get('morphy_games_total') / metrics.hours())
+    metrics.set('morphy_last_game_timestamp_seconds', time.time())
@@ -0,0 +1,572 @@
+import collections
+import contextlib
+import functools
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+import chess.engine
+
+from morphy.config import settings
+from morphy.constant import PIECE_VALUES
+from morphy.engine import EnginePool
+from morphy.metrics import (
+    mining_metrics,
+    record_game,
+)
+from morphy.pgn_index import PgnIndex
+from morphy.pgn_reader import (
+    mmap_games,
+    read_mainline,
+)
+from morphy.utils import (
+    white_material,
+    black_material,
+    see,
+)
+
+
+def save_fen(fen, out_file):
+    with open(out_file, 'a') as f:
+        f.write('{}\n'.format(fen))
+
+
+class GameEngine:
+    """
+    Engine proxy tagging all analyses with the game they belong to, so the
+    engine gets ``ucinewgame`` once at the start of every game.
+    """
+
+    def __init__(self, engine, game):
+        self.engine = engine
+        self.game = game
+
+    def analyse(self, board, limit, **kwargs):
+        kwargs.setdefault('game', self.game)
+        return self.engine.analyse(board, limit, **kwargs)
+
+    def analysis(self, board, limit=None, **kwargs):
+        kwargs.setdefault('game', self.game)
+        return self.engine.analysis(board, limit, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self.engine, item)
+
+
+class MiningSession:
+    """
+    One engine process kept for all games mined by a process. It is restarted
+    only when it fails or after ``restart_after`` games (never if ``None``).
+    """
+
+    def __init__(self, engine_pool, restart_after=settings.MINING_RESTART_AFTER_GAMES):
+        self.engine_pool = engine_pool
+        self.restart_after = restart_after
+        self._engine = None
+        self._games = 0
+
+    def _restart(self):
+        self._engine = self.engine_pool.restart(self._engine)
+        self._games = 0
+
+    @contextlib.contextmanager
+    def game(self):
+        if self._engine is None:
+            self._engine = self.engine_pool.checkout()
+        elif self.restart_after and self._games >= self.restart_after:
+            self._restart()
+
+        self._games += 1
+
+        try:
+            yield GameEngine(self._engine, object())
+        except chess.engine.EngineError:
+            self._restart()
+            raise
+
+    def close(self):
+        if self._engine is not None:
+            self.engine_pool.checkin(self._engine)
+            self._engine = None
+
+
+@contextlib.contextmanager
+def mining_session(engine_path, restart_after=settings.MINING_RESTART_AFTER_GAMES):
+    with EnginePool(engine_path=engine_path) as engine_pool:
+        session = MiningSession(engine_pool, restart_after=restart_after)
+
+        try:
+            yield session
+        finally:
+            session.close()
+
+
+def node_thresholds(first=10**6, last=40 * 10**6, factor=1.4):
+    thresholds = []
+    nodes = first
+
+    while nodes < last:
+        thresholds.append(nodes)
+        nodes = int(nodes * factor)
+
+    return thresholds
+
+
+NODE_THRESHOLDS = node_thresholds()
+
+
+def _snapshot(analysis, multipv):
+    return [dict(i) for i in analysis.multipv] if multipv else dict(analysis.info)
+
+
+def analysis_snapshots(engine, board, thresholds=NODE_THRESHOLDS, multipv=None, **kwargs):
+    """
+    Runs one continuous search up to the last of ``thresholds`` (nodes) and
+    yields the analysis (like ``engine.analyse`` returns it) every time the
+    search passes the next threshold. Closing the generator stops the search.
+    """
+    threshold = 0
+
+    with engine.analysis(board, chess.engine.Limit(nodes=thresholds[-1]), multipv=multipv, **kwargs) as analysis:
+        for info in analysis:
+            # Only the last line of an iteration completes a consistent set of lines
+            if 'score' not in info or info.get('multipv', 1) < len(analysis.multipv):
+                continue
+
+            passed = threshold
+
+            while threshold < len(thresholds) and info.get('nodes', 0) >= thresholds[threshold]:
+                threshold += 1
+
+            if threshold > passed:
+                yield _snapshot(analysis, multipv)
+
+        # Search finished before the last threshold, e.g. a forced mate was found
+        if threshold < len(thresholds):
+            yield _snapshot(analysis, multipv)
+
+
+def holds_at_every_threshold(engine, board, condition, thresholds=NODE_THRESHOLDS, multipv=None):
+    """
+    Checks ``condition`` on the analysis of ``board`` at every node threshold
+    of a single search, which is stopped as soon as the condition breaks.
+    """
+    snapshots = analysis_snapshots(engine, board, thresholds=thresholds, multipv=multipv)
+
+    try:
+        return all(condition(s) for s in snapshots)
+    finally:
+        snapshots.close()
+
+
+def is_hanging(board, square):
+    """
+    Whether the piece on ``square`` loses material if left there: it is
+    attacked and either undefended or attacked by a cheaper piece.
+    """
+    piece = board.piece_at(square)
+    attackers = board.attackers(not piece.color, square)
+
+    if not attackers:
+        return False
+
+    return (not board.attackers(piece.color, square) or
+            min(PIECE_VALUES[board.piece_type_at(a)] for a in attackers) < PIECE_VALUES[piece.piece_type])
+
+
+def gives_forcing_check(board, move):
+    """
+    A check counts when a checking piece cannot simply be taken, or when the
+    checking move also attacks a piece which is left hanging.
+    """
+    board.push(move)
+
+    try:
+        if not board.is_check():
+            return False
+
+        if any(not is_hanging(board, s) for s in board.checkers()):
+            return True
+
+        return any(
+            board.piece_type_at(s) != chess.KING and is_hanging(board, s)
+            for s in board.attacks(move.to_square) & board.occupied_co[board.turn]
+        )
+    finally:
+        board.pop()
+
+
+def can_retreat(board, square):
+    for m in board.legal_moves:
+        if m.from_square != square:
+            continue
+
+        board.push(m)
+
+        try:
+            if not is_hanging(board, m.to_square):
+                return True
+        finally:
+            board.pop()
+
+    return False
+
+
+def has_piece_en_prise(board, color):
+    """
+    Whether ``color`` has a piece en prise which it cannot simply save: two of
+    them at once, or one without a safe square to go to when it is to move.
+    """
+    en_prise = [
+        square for square, piece in board.piece_map().items()
+        if piece.color == color and piece.piece_type != chess.KING and is_hanging(board, square)
+    ]
+
+    if len(en_prise) != 1:
+        return len(en_prise) > 1
+
+    return board.turn != color or not can_retreat(board, en_prise[0])
+
+
+def total_material(board):
+    return white_material(board) + black_material(board)
+
+
+def material_balance(board):
+    return white_material(board) - black_material(board)
+
+
+def has_mate_in_one(board):
+    for m in board.legal_moves:
+        board.push(m)
+
+        try:
+            if board.is_checkmate():
+                return True
+        finally:
+            board.pop()
+
+    return False
+
+
+def faces_threat(board, captures=True):
+    """
+    Whether the side not to move threatens a mate in one or (with
+    ``captures``) a capture winning material, i.e. would have it after a null
+    move.
+    """
+    if board.is_check():
+        return False
+
+    board.push(chess.Move.null())
+
+    try:
+        if has_mate_in_one(board):
+            return True
+
+        return captures and any(board.is_capture(m) and see(board, m) > 0 for m in board.legal_moves)
+    finally:
+        board.pop()
+
+
+def has_quiet_mate_threat(board):
+    """
+    Whether a quiet move of the side to move threatens a mate in one.
+    """
+    for m in board.legal_moves:
+        if board.is_capture(m) or m.promotion:
+            continue
+
+        board.push(m)
+
+        try:
+            if faces_threat(board, captures=False):
+                return True
+        finally:
+            board.pop()
+
+    return False
+
+
+def is_forcing_position(board, engine, move, prev_boards):
+    """
+    Static stage: a tactic needs something forcing, a material swing still
+    going on, a check which cannot simply be answered by taking the checking
+    piece, a capture winning material, a piece en prise which cannot simply
+    retreat, a threat of the other side to answer (a defence) or a quiet move
+    threatening mate.
+    """
+    # The last move captured and did not just even out the material (a recapture of an even trade)
+    if len(prev_boards) >= 2:
+        last_board = prev_boards[-2]
+        first_board = prev_boards[-min(3, len(prev_boards))]
+
+        if (total_material(last_board) != total_material(board) and
+                material_balance(first_board) != material_balance(board)):
+            return True
+
+    for m in board.legal_moves:
+        if m.promotion or gives_forcing_check(board, m):
+            return True
+
+        if board.is_capture(m) and see(board, m) > 0:
+            return True
+
+    return has_piece_en_prise(board, board.turn) or faces_threat(board) or has_quiet_mate_threat(board)
+
+
+def low_nodes_search(board, engine, move, prev_boards, candidate_filter=None, nodes=settings.MINING_PREFILTER_NODES):
+    """
+    Cheap search stage: the candidate filter of the miner already holds on a
+    search of a few nodes.
+    """
+    return candidate_filter(engine.analyse(board, chess.engine.Limit(nodes=nodes), multipv=2))
+
+
+def candidate_search(board, engine, move, prev_boards, candidate_filter=None):
+    return candidate_filter(engine.analyse(board, chess.engine.Limit(nodes=10**6), multipv=2))
+
+
+class StagedFilter:
+    """
+    Checks a position has to pass to be saved as a puzzle, from the cheapest to
+    the most expensive one. Counts the positions rejected by every stage.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.positions = 0
+        self.rejected = collections.Counter()
+
+    def __call__(self, board, engine, move, prev_boards):
+        self.positions += 1
+
+        for name, check in self.stages:
+            if not check(board, engine, move, prev_boards):
+                self.rejected[name] += 1
+                return False
+
+        return True
+
+    def report(self):
+        return 'Positions: {}, rejected by {}'.format(
+            self.positions,
+            ', '.join('{}: {}'.format(name, self.rejected[name]) for name, _ in self.stages),
+        )
+
+
+def make_puzzle_filter(candidate_filter, is_good_puzzle, static_prefilter=settings.MINING_STATIC_PREFILTER,
+                       prefilter_nodes=settings.MINING_PREFILTER_NODES):
+    stages = []
+
+    if static_prefilter:
+        stages.append(('static', is_forcing_position))
+
+    if prefilter_nodes:
+        stages.append(('low_nodes', functools.partial(low_nodes_search, candidate_filter=candidate_filter,
+                                                      nodes=prefilter_nodes)))
+
+    stages.append(('search', functools.partial(candidate_search, candidate_filter=candidate_filter)))
+    stages.append(('is_good_puzzle', is_good_puzzle))
+    return StagedFilter(stages)
+
+
+def mine_game(board, moves, engine, is_puzzle):
+    """
+    Yields FENs of the positions of the mainline of a game passing ``is_puzzle``.
+    """
+    prev_boards = [board.copy()]
+
+    for move in moves:
+        if is_puzzle(board, engine, move, prev_boards):
+            yield board.fen()
+
+        board.push(move)
+        prev_boards.append(board.copy())
+
+
+def find_puzzles(game, session, is_puzzle, log=print):
+    """
+    Yields FENs of the puzzles found in a game given as PGN bytes. Broken games
+    and games the engine failed on are skipped.
+    """
+    try:
+        board, moves = read_mainline(game)
+    except ValueError as e:
+        log('Skipping broken game: {}'.format(e))
+        return
+
+    try:
+        with session.game() as engine:
+            yield from mine_game(board, moves, engine, is_puzzle)
+    except chess.engine.EngineError as e:
+        log('Engine failed, restarted it and skipped the game: {}'.format(e))
+
+
+def open_mining_metrics(metrics_path, **labels):
+    return mining_metrics(metrics_path, labels=dict(job='miner', **labels)) if metrics_path else None
+
+
+def mine_games(games, session, out_file, candidate_filter, is_good_puzzle, first_game=0,
+               on_game_done=None, pause=settings.MINING_PAUSE, log=print, metrics=None):
+    is_puzzle = make_puzzle_filter(candidate_filter, is_good_puzzle)
+
+    try:
+        for game_number, game in enumerate(games, first_game):
+            log('Game number: {}'.format(game_number + 1))
+
+            tactics_found = 0
+
+            for fen in find_puzzles(game, session, is_puzzle, log=log):
+                log('Tactics found: {}'.format(fen))
+                save_fen(fen, out_file)
+                tactics_found += 1
+
+            if not tactics_found:
+                log('No tactics found :(')
+
+            log(is_puzzle.report())
+
+            if metrics is not None:
+                record_game(metrics, tactics_found, is_puzzle)
+                metrics.write()
+
+            if on_game_done is not None:
+                on_game_done(game_number)
+
+            if pause:
+                time.sleep(pause)
+    finally:
+        if metrics is not None:
+            metrics.write(force=True)
+
+
+def shard_ranges(games_number, shards):
+    return [(i * games_number // shards, (i + 1) * games_number // shards) for i in range(shards)]
+
+
+def shard_path(out_file, shard):
+    return '{}.shard{}'.format(out_file, shard)
+
+
+def checkpoint_path(out_file, shard):
+    return '{}.checkpoint'.format(shard_path(out_file, shard))
+
+
+def metrics_shard_path(metrics_path, shard):
+    # The textfile collector only reads *.prom files, keep the extension
+    root, ext = os.path.splitext(metrics_path)
+    return '{}.shard{}{}'.format(root, shard, ext)
+
+
+def load_checkpoint(path, first_game, last_game):
+    """
+    Returns the first game of the shard which is not mined yet. A checkpoint of
+    a different split of the database is ignored.
+    """
+    try:
+        with open(path, 'r') as f:
+            checkpoint = json.load(f)
+    except (IOError, ValueError):
+        return first_game
+
+    if (checkpoint['first_game'], checkpoint['last_game']) != (first_game, last_game):
+        return first_game
+
+    return checkpoint['next_game']
+
+
+def save_checkpoint(path, first_game, last_game, next_game):
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        json.dump({'first_game': first_game, 'last_game': last_game, 'next_game': next_game}, f)
+
+    os.replace(tmp_path, path)
+
+
+def mine_shard(pgn_file, out_file, shard, games, engine_path, candidate_filter, is_good_puzzle, metrics_path=None):
+    first_game, last_game = games
+    checkpoint = checkpoint_path(out_file, shard)
+    next_game = load_checkpoint(checkpoint, first_game, last_game)
+
+    def log(msg):
+        print('[shard {}] {}'.format(shard, msg), flush=True)
+
+    def on_game_done(game_number):
+        save_checkpoint(checkpoint, first_game, last_game, game_number + 1)
+
+    if next_game >= last_game:
+        log('Already mined')
+        return
+
+    index = PgnIndex.open(pgn_file)
+    games = itertools.islice(mmap_games(pgn_file, index=index), next_game, last_game)
+
+    # One long-lived engine per worker
+    with mining_session(engine_path) as session:
+        mine_games(
+            games,
+            session,
+            shard_path(out_file, shard),
+            candidate_filter,
+            is_good_puzzle,
+            first_game=next_game,
+            on_game_done=on_game_done,
+            log=log,
+            metrics=open_mining_metrics(metrics_path and metrics_shard_path(metrics_path, shard), shard=shard),
+        )
+
+
+def merge_shards(out_file, shards):
+    """
+    Merges FENs found by the shards into ``out_file``, without duplicates.
+    """
+    fens = {}
+
+    for path in [out_file] + [shard_path(out_file, s) for s in range(shards)]:
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    fen = line.strip()
+
+                    if fen:
+                        fens[fen] = None
+        except IOError:
+            pass
+
+    tmp_path = out_file + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        for fen in fens:
+            f.write('{}\n'.format(fen))
+
+    os.replace(tmp_path, out_file)
+    return len(fens)
+
+
+def mine_in_shards(pgn_file, out_file, shards, engine_path, candidate_filter, is_good_puzzle,
+                   metrics_path=settings.METRICS_PATH):
+    """
+    Splits the games of ``pgn_file`` into ``shards`` ranges mined by as many
+    worker processes, each with its own engine. Every shard keeps its own
+    output and checkpoint, so an interrupted run resumes where it stopped.
+    """
+    # Build the index once, before the workers load it
+    index = PgnIndex.open(pgn_file)
+
+    try:
+        with ProcessPoolExecutor(shards) as executor:
+            futures = [
+                executor.submit(mine_shard, pgn_file, out_file, shard, games, engine_path, candidate_filter,
+                                is_good_puzzle, metrics_path=metrics_path)
+                for shard, games in enumerate(shard_ranges(len(index), shards))
+            ]
+
+            for f in futures:
+                f.result()
+    finally:
+        print('Puzzles found: {}'.format(merge_shards(out_file, shards)))
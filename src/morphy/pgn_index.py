@@ -0,0 +1,166 @@
+import os
+import struct
+from array import array
+
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'MPGNIDX1'
+# Magic, PGN size, PGN mtime (ns), number of games
+INDEX_HEADER = struct.Struct('<8sQQQ')
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+def scan_game_offsets(pgn_file):
+    """
+    Yields ``(start, end)`` byte offsets of the games of a PGN file opened in
+    binary mode, in a single streaming pass. A game starts at its first header
+    line and ends after its last non blank line.
+    """
+    offset = 0
+    start = end = None
+    in_headers = False
+    in_comment = False
+
+    for line in pgn_file:
+        line_start = offset
+        offset += len(line)
+
+        if line_start == 0 and line.startswith(UTF8_BOM):
+            line_start = len(UTF8_BOM)
+            line = line[len(UTF8_BOM):]
+
+        stripped = line.strip()
+
+        if not stripped:
+            continue
+
+        if not in_comment and stripped.startswith(b'['):
+            if not in_headers:
+                if start is not None:
+                    yield start, end
+
+                start = line_start
+                in_headers = True
+        else:
+            in_headers = False
+            # Header-like lines inside multiline comments do not start a new game
+            opening, closing = stripped.rfind(b'{'), stripped.rfind(b'}')
+
+            if opening != closing:
+                in_comment = opening > closing
+
+        end = line_start + len(line.rstrip())
+
+    if start is not None:
+        yield start, end
+
+
+class PgnIndex:
+    """
+    Byte offsets of the games of a PGN file, kept in a sidecar file
+    (``<pgn>.idx``) next to it. Built once in a streaming pass, then reading
+    game N or a slice of games takes a single seek.
+    """
+
+    def __init__(self, offsets, pgn_size=0, pgn_mtime=0):
+        # Start and end offsets of every game, interleaved
+        self._offsets = offsets
+        self.pgn_size = pgn_size
+        self.pgn_mtime = pgn_mtime
+
+    @staticmethod
+    def index_path(pgn_path):
+        return pgn_path + INDEX_SUFFIX
+
+    @staticmethod
+    def _pgn_stat(pgn_path):
+        st = os.stat(pgn_path)
+        return st.st_size, st.st_mtime_ns
+
+    @classmethod
+    def build(cls, pgn_path):
+        offsets = array('Q')
+
+        with open(pgn_path, 'rb') as f:
+            for start, end in scan_game_offsets(f):
+                offsets.append(start)
+                offsets.append(end)
+
+        return cls(offsets, *cls._pgn_stat(pgn_path))
+
+    @classmethod
+    def load(cls, index_path):
+        with open(index_path, 'rb') as f:
+            magic, pgn_size, pgn_mtime, games_number = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+
+            if magic != INDEX_MAGIC:
+                raise ValueError('{} is not a PGN index'.format(index_path))
+
+            offsets = array('Q')
+            offsets.fromfile(f, 2 * games_number)
+
+        return cls(offsets, pgn_size, pgn_mtime)
+
+    def save(self, index_path):
+        tmp_path = index_path + '.tmp'
+
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.pgn_size, self.pgn_mtime, len(self)))
+            self._offsets.tofile(f)
+
+        os.replace(tmp_path, index_path)
+
+    def is_stale(self, pgn_path):
+        return (self.pgn_size, self.pgn_mtime) != self._pgn_stat(pgn_path)
+
+    @classmethod
+    def open(cls, pgn_path, index_path=None):
+        """
+        Loads the index of ``pgn_path``, (re)building it if it is missing or the
+        PGN file has changed since.
+        """
+        index_path = index_path or cls.index_path(pgn_path)
+
+        if os.path.exists(index_path):
+            index = cls.load(index_path)
+
+            if not index.is_stale(pgn_path):
+                return index
+
+        index = cls.build(pgn_path)
+        index.save(index_path)
+        return index
+
+    def __len__(self):
+        return len(self._offsets) // 2
+
+    def __getitem__(self, game_number):
+        if not 0 <= game_number < len(self):
+            raise IndexError(game_number)
+
+        return self._offsets[2 * game_number], self._offsets[2 * game_number + 1]
+
+    def read_game(self, pgn_file, game_number, encoding='utf-8'):
+        start, end = self[game_number]
+        pgn_file.seek(start)
+        return pgn_file.read(end - start).decode(encoding, errors='replace')
+
+    def read_games(self, pgn_file, first_game=0, games_number=None, encoding='utf-8'):
+        """
+        Yields games (as strings) from ``first_game`` on, ``pgn_file`` has to be
+        opened in binary mode.
+        """
+        last_game = len(self) if games_number is None else min(len(self), first_game + games_number)
+
+        if first_game >= last_game:
+            return
+
+        pgn_file.seek(self[first_game][0])
+        position = self[first_game][0]
+
+        for n in range(first_game, last_game):
+            start, end = self[n]
+            # Games are consecutive, only skip what is between them
+            pgn_file.read(start - position)
+            yield pgn_file.read(end - start).decode(encoding, errors='replace')
+            position = end
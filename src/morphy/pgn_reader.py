@@ -0,0 +1,102 @@
+import mmap
+import os
+import re
+
+import chess
+
+from morphy.pgn_index import scan_game_offsets
+
+
+HEADER_RE = re.compile(rb'\s*\[([A-Za-z0-9_]+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TOKEN_RE = re.compile(rb'\{[^}]*\}?|;[^\n]*|%[^\n]*|\(|\)|\$\d+|[!?]+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s(){};!?$]+')
+RESULTS = (b'1-0', b'0-1', b'1/2-1/2', b'*')
+
+
+def mmap_games(pgn_path, index=None):
+    """
+    Yields the games of a PGN file as ``memoryview`` slices of a read-only
+    memory map, so nothing is copied before parsing. Game boundaries are taken
+    from ``index`` (a ``PgnIndex``) when given, scanned otherwise. A slice is
+    released when the next game is requested: callers keeping a game longer
+    (e.g. handing it to another thread) must copy it with ``bytes()``.
+    """
+    with open(pgn_path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mm)
+    game = None
+
+    try:
+        if index is None:
+            offsets = scan_game_offsets(iter(mm.readline, b''))
+        else:
+            offsets = (index[n] for n in range(len(index)))
+
+        for start, end in offsets:
+            game = view[start:end]
+            yield game
+            game.release()
+    finally:
+        # The map can only be closed once no view of it is left
+        if game is not None:
+            game.release()
+
+        view.release()
+        mm.close()
+
+
+def parse_mainline(game):
+    """
+    Lightweight parser of a PGN game (bytes-like): returns its headers and the
+    SAN moves of the mainline. Comments, variations, NAGs and annotations are
+    skipped.
+    """
+    headers = {}
+    position = 0
+
+    while True:
+        match = HEADER_RE.match(game, position)
+
+        if match is None:
+            break
+
+        headers[match.group(1).decode()] = match.group(2).decode('utf-8', errors='replace')
+        position = match.end()
+
+    sans = []
+    variation_depth = 0
+
+    for match in TOKEN_RE.finditer(game, position):
+        token = match.group()
+
+        if token == b'(':
+            variation_depth += 1
+        elif token == b')':
+            variation_depth = max(variation_depth - 1, 0)
+        elif variation_depth or token[:1] in b'{;%$!?' or token[:1].isdigit() and token[-1:] == b'.':
+            continue
+        elif token in RESULTS:
+            break
+        else:
+            sans.append(token.decode())
+
+    return headers, sans
+
+
+def read_mainline(game):
+    """
+    Returns the starting board and the mainline moves of a PGN game given as
+    bytes (e.g. a slice yielded by ``mmap_games``).
+    """
+    headers, sans = parse_mainline(game)
+    board = chess.Board(headers['FEN']) if 'FEN' in headers else chess.Board()
+    moves = []
+    b = board.copy(stack=False)
+
+    for san in sans:
+        moves.append(b.push_san(san))
+
+    return board, moves
@@ -0,0 +1,163 @@
+import contextlib
+import queue
+import threading
+import traceback
+
+
+DONE = object()
+
+
+class Stage:
+    """
+    Step of a ``Pipeline``. ``worker`` is a context manager factory yielding a
+    function which maps one item to an iterable of items for the next stage.
+    Every one of the ``workers`` threads enters its own context, so it can
+    hold resources like an engine for the whole run.
+    """
+
+    def __init__(self, name, worker, workers=1, queue_size=None):
+        assert workers >= 1
+        self.name = name
+        self.worker = worker
+        self.workers = workers
+        # Bounded input queue, a full one blocks the previous stage
+        self.queue = queue.Queue(queue_size or 2 * workers)
+        self.processed = 0
+
+
+def simple_worker(func):
+    """
+    Turns a function (item -> iterable) into a ``Stage`` worker without state.
+    """
+    @contextlib.contextmanager
+    def worker():
+        yield func
+
+    return worker
+
+
+class Pipeline:
+    """
+    Runs stages concurrently in threads connected by bounded queues, so the
+    first results come out while the source is still read and a slow stage
+    slows down (instead of flooding) the stages before it. Items are yielded
+    by ``run`` as soon as they leave the last stage, in no particular order.
+    """
+
+    def __init__(self, stages, poll_interval=0.5):
+        assert stages
+        self.stages = stages
+        self.poll_interval = poll_interval
+        self.errors = []
+        self._stop = threading.Event()
+        self._output = queue.Queue(stages[-1].queue.maxsize)
+        self._lock = threading.Lock()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=self.poll_interval)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=self.poll_interval)
+            except queue.Empty:
+                pass
+
+        return DONE
+
+    def _next_queue(self, i):
+        return self.stages[i + 1].queue if i + 1 < len(self.stages) else self._output
+
+    def _fail(self, name):
+        with self._lock:
+            self.errors.append((name, traceback.format_exc()))
+
+        self._stop.set()
+
+    def _feed(self, source):
+        try:
+            for item in source:
+                if not self._put(self.stages[0].queue, item):
+                    return
+        except Exception:
+            self._fail('source')
+        finally:
+            self._finish_stage(-1)
+
+    def _finish_stage(self, i):
+        # Tells every worker of the next stage (or the consumer) there is nothing more to come
+        next_workers = self.stages[i + 1].workers if i + 1 < len(self.stages) else 1
+
+        for _ in range(next_workers):
+            self._put(self._next_queue(i), DONE)
+
+    def _work(self, i, remaining):
+        stage = self.stages[i]
+        out_queue = self._next_queue(i)
+
+        try:
+            with stage.worker() as process:
+                while True:
+                    item = self._get(stage.queue)
+
+                    if item is DONE:
+                        break
+
+                    for result in process(item):
+                        if not self._put(out_queue, result):
+                            return
+
+                    with self._lock:
+                        stage.processed += 1
+        except Exception:
+            self._fail(stage.name)
+        finally:
+            with self._lock:
+                remaining[i] -= 1
+                last_worker = remaining[i] == 0
+
+            if last_worker:
+                self._finish_stage(i)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, source):
+        remaining = [s.workers for s in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(source, ), name='feed', daemon=True)]
+
+        for i, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(i, remaining),
+                    name='{}-{}'.format(stage.name, n),
+                    daemon=True,
+                ))
+
+        for t in threads:
+            t.start()
+
+        try:
+            while True:
+                item = self._get(self._output)
+
+                if item is DONE:
+                    break
+
+                yield item
+        finally:
+            self.stop()
+
+            for t in threads:
+                t.join()
+
+    def queue_sizes(self):
+        return {s.name: s.queue.qsize() for s in self.stages}
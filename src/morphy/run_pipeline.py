@@ -0,0 +1,202 @@
+import os
+
+ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+import sys
+sys.path.insert(0, os.path.join(ROOT_DIR, '..'))
+
+import contextlib
+import importlib
+import json
+import threading
+import traceback
+
+import click
+
+from morphy.config import settings
+from morphy.pipeline import (
+    Pipeline,
+    Stage,
+    simple_worker,
+)
+from morphy.run_solver import (
+    normalize_fen,
+    load_settings,
+    open_analysis_cache,
+    solve_puzzle,
+)
+
+
+MINERS = {
+    'tactics': 'morphy.tactics_miner',
+    'defense': 'morphy.defense_miner',
+}
+
+
+def miner_worker(miner, log_func):
+    # Mining binds settings as default arguments, import it after settings are loaded
+    from morphy.mining import (
+        find_puzzles,
+        make_puzzle_filter,
+        mining_session,
+    )
+
+    @contextlib.contextmanager
+    def worker():
+        is_puzzle = make_puzzle_filter(miner.CANDIDATE_FILTER, miner.is_good_puzzle)
+
+        # One long-lived engine per mining thread
+        with mining_session(settings.ENGINE_PATH) as session:
+            yield lambda game: find_puzzles(game, session, is_puzzle, log=log_func)
+
+    return worker
+
+
+def solver_worker(engine_pool, analysis_cache, stores, log_func):
+    lock = threading.Lock()
+    scheduled = set()
+
+    def solve(fen):
+        fen = normalize_fen(fen)
+
+        # The same position is often reached in many games
+        with lock:
+            if fen in scheduled or any(fen in s for s in stores):
+                return
+
+            scheduled.add(fen)
+
+        try:
+            yield solve_puzzle(fen, engine_pool, analysis_cache=analysis_cache)
+        except Exception:
+            # Broken engines are replaced by the pool, the puzzle is solved again by the next run
+            with lock:
+                scheduled.discard(fen)
+
+            log_func('Cannot solve {} due to an error:\n{}'.format(fen, traceback.format_exc()))
+
+    return simple_worker(solve)
+
+
+def is_accepted(solution):
+    from morphy.cn_utils import Puzzle
+    from morphy.find_unclosed_lines import too_long_line
+
+    return solution['is_solved'] and not too_long_line(Puzzle.create_puzzle(solution))
+
+
+def filter_solution(result):
+    solution, puzzle_cat, solving_time = result
+    yield solution, puzzle_cat, solving_time, is_accepted(solution)
+
+
+@click.command()
+@click.option('--pgn', '-g', 'pgn_file', required=True, type=str)
+@click.option('--solutions', '-s', required=True, type=str)
+@click.option('--rejected', '-r', required=False, type=str,
+              help='File for unsolved puzzles and puzzles with unclosed lines.')
+@click.option('--miner', '-m', type=click.Choice(sorted(MINERS)), default='tactics', show_default=True)
+@click.option('--engine', '-e', 'engine_path', required=False, type=str)
+@click.option('--settings', '-S', 'settings_module', required=False, type=str)
+@click.option('--cache', '-c', 'cache_path', required=False, type=str)
+@click.option('--miners', 'miners', type=int, default=1, show_default=True)
+@click.option('--solvers', 'solvers', type=int, default=1, show_default=True)
+@click.option('--queue-size', 'queue_size', type=int, default=0,
+              help='Size of the queues between stages (default: twice the workers of the next stage).')
+@click.option('--metrics', 'metrics_path', required=False, type=str,
+              help='Write Prometheus metrics to this file (for the node_exporter textfile collector).')
+def main(pgn_file, solutions, rejected, miner, engine_path, settings_module, cache_path, miners, solvers, queue_size,
+         metrics_path):
+    """
+    Mines puzzles from a PGN file and solves them as they are found:
+    read games -> find candidates -> solve -> filter, all stages running at
+    once with bounded queues in between.
+    """
+    from morphy.engine import EnginePool
+    from morphy.pgn_reader import mmap_games
+
+    settings_module = settings_module or os.environ.get('MORPHY_SETTINGS_MODULE')
+    load_settings(settings_module, {
+        'ENGINE_PATH': engine_path or os.environ.get('MORPHY_ENGINE_PATH'),
+        'ANALYSIS_CACHE_PATH': cache_path or os.environ.get('MORPHY_CACHE_PATH'),
+        'METRICS_PATH': metrics_path or os.environ.get('MORPHY_METRICS_PATH'),
+    })
+
+    assert miners >= 1
+    assert solvers >= 1
+    assert settings.ENGINE_PATH
+
+    from morphy.solutions import open_solutions
+    from morphy.metrics import (
+        solver_metrics,
+        record_solution,
+    )
+
+    miner = importlib.import_module(MINERS[miner])
+    # Already solved or rejected puzzles are not solved again
+    solutions = open_solutions(solutions)
+    rejected = open_solutions(rejected) if rejected else None
+    stores = [s for s in (solutions, rejected) if s is not None]
+    analysis_cache = open_analysis_cache()
+    accepted_number = rejected_number = 0
+    metrics = solver_metrics(settings.METRICS_PATH, labels={'job': 'pipeline'}) if settings.METRICS_PATH else None
+
+    with EnginePool(size=solvers * settings.SOLVER_WORKERS, engine_path=settings.ENGINE_PATH) as engine_pool:
+        pipeline = Pipeline([
+            Stage('mine', miner_worker(miner, click.echo), workers=miners, queue_size=queue_size),
+            Stage('solve', solver_worker(engine_pool, analysis_cache, stores, click.echo), workers=solvers,
+                  queue_size=queue_size),
+            Stage('filter', simple_worker(filter_solution), queue_size=queue_size),
+        ])
+        # Games wait in the queue of the miners, past the lifetime of their slice of the map
+        results = pipeline.run(bytes(g) for g in mmap_games(pgn_file))
+
+        try:
+            for solution, puzzle_cat, solving_time, accepted in results:
+                stats = solution.pop('stats', None)
+
+                if metrics is not None:
+                    record_solution(metrics, solution, puzzle_cat, solving_time, stats)
+
+                    for stage, size in pipeline.queue_sizes().items():
+                        metrics.set('morphy_queue_size', size, stage=stage)
+
+                    metrics.write()
+
+                if accepted:
+                    solutions.add(solution)
+                    accepted_number += 1
+                else:
+                    if rejected is not None:
+                        rejected.add(solution)
+
+                    rejected_number += 1
+
+                click.secho('{} {} ({}, {:.1f}s)'.format(
+                    'Accepted' if accepted else 'Rejected',
+                    solution['fen'],
+                    puzzle_cat,
+                    solving_time,
+                ), fg='green' if accepted else 'red')
+                click.echo('Accepted: {}, rejected: {}, queues: {}'.format(
+                    accepted_number,
+                    rejected_number,
+                    json.dumps(pipeline.queue_sizes()),
+                ))
+        except KeyboardInterrupt:
+            click.secho('Stopping pipeline...', fg='red')
+        finally:
+            results.close()
+
+            for s in stores:
+                s.close()
+
+            if metrics is not None:
+                metrics.write(force=True)
+
+    for stage, error in pipeline.errors:
+        click.secho('Stage {} failed:\n{}'.format(stage, error), fg='red')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,39 +7,71 @@ sys.path.insert(0, os.path.join(ROOT_DIR, '..'))
 
 import json
 import time
+import asyncio
 import importlib
 import pprint
+import collections
+import traceback
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
 
 import click
-from chess import (
-    Board,
-)
 
 from morphy.config import settings
 from morphy.cn_utils import Puzzle
+from morphy.constant import PREDICTED_FAILURE
 
 
 def normalize_fen(fen):
     return ' '.join(fen.strip().split())
 
 
-def save_solution(solution, solutions_file):
-    with open(solutions_file, 'a') as f:
-        f.write('{}\n'.format(json.dumps(solution)))
+def read_puzzles(puzzles_file, offset=0):
+    """
+    Yields FENs of a puzzles file opened in binary mode, starting at byte
+    ``offset``, each with the offset of the line after it.
+    """
+    puzzles_file.seek(offset)
 
+    for line in puzzles_file:
+        offset += len(line)
+        fen = normalize_fen(line.decode('utf-8'))
 
-def already_solved(solutions_file):
-    solved = {}
+        if fen:
+            yield fen, offset
+
+
+def cursor_path(solutions_file):
+    return '{}.cursor'.format(solutions_file)
+
+
+def load_cursors(solutions_file):
     try:
-        with open(solutions_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    fen = normalize_fen(json.loads(line)['fen'])
-                    solved[fen] = line
-    except IOError:
-        pass
-    return solved
+        with open(cursor_path(solutions_file), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def load_cursor(solutions_file, puzzles_file):
+    """
+    Byte offset in ``puzzles_file`` up to which all puzzles are already in
+    ``solutions_file``.
+    """
+    offset = load_cursors(solutions_file).get(os.path.realpath(puzzles_file), 0)
+    # Puzzles file was replaced by a shorter one
+    return offset if offset <= os.path.getsize(puzzles_file) else 0
+
+
+def save_cursor(solutions_file, puzzles_file, offset):
+    cursors = load_cursors(solutions_file)
+    cursors[os.path.realpath(puzzles_file)] = offset
+    tmp_path = cursor_path(solutions_file) + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        json.dump(cursors, f)
+
+    os.replace(tmp_path, cursor_path(solutions_file))
 
 
 def get_solutions_number(p):
@@ -47,115 +79,501 @@ def get_solutions_number(p):
     return len(lines)
 
 
+def save_stats(path, solution, puzzle_cat, solving_time, stats):
+    with open(path, 'a') as f:
+        f.write('{}\n'.format(json.dumps({
+            'fen': solution['fen'],
+            'is_solved': solution['is_solved'],
+            'puzzle_cat': puzzle_cat,
+            'solving_time': solving_time,
+            'stats': stats,
+        })))
+
+
+def load_settings(settings_module, overrides):
+    if settings_module:
+        settings.load_settings(importlib.import_module(settings_module))
+
+    for k, v in overrides.items():
+        if v:
+            settings[k] = v
+
+
+def open_analysis_cache():
+    from morphy.cache import AnalysisCache
+
+    if settings.ANALYSIS_CACHE_PATH:
+        return AnalysisCache(settings.ANALYSIS_CACHE_PATH, max_size=settings.ANALYSIS_CACHE_SIZE)
+
+
+def analyse_root(fen, engine, analysis_cache=None, stats=None):
+    """
+    Returns the category of a puzzle, the root analysis of the solver of that
+    category, the (serialized) root score the category was picked from and
+    the engine time of the root analyses.
+
+    The root is first searched with the (shallower) conf of the mate category,
+    mates found there are solved from that search. Other puzzles are searched
+    with the conf of the material category, which seeds their solve. Deeper
+    mates only found by it are solved from the first search.
+    """
+    from morphy.solver import guess_puzzle_cat
+    from morphy.constant import (
+        MATE_CAT,
+        MATERIAL_CAT,
+    )
+
+    mate_solver = create_solver(engine, MATE_CAT, analysis_cache=analysis_cache, stats=stats)
+    mate_infos = mate_solver.analyse_root(fen)
+
+    if guess_puzzle_cat(mate_infos) == MATE_CAT:
+        return MATE_CAT, mate_infos, serialize_root_score(mate_infos), mate_solver.engine_time
+
+    solver = create_solver(engine, MATERIAL_CAT, analysis_cache=analysis_cache, stats=stats)
+    root_infos = solver.analyse_root(fen)
+    engine_time = mate_solver.engine_time + solver.engine_time
+
+    if guess_puzzle_cat(root_infos) == MATE_CAT:
+        return MATE_CAT, mate_infos, serialize_root_score(root_infos), engine_time
+
+    return MATERIAL_CAT, root_infos, serialize_root_score(root_infos), engine_time
+
+
+async def analyse_root_async(fen, engine, analysis_cache=None, stats=None):
+    """
+    ``analyse_root`` with an ``AsyncSolver``.
+    """
+    from morphy.async_solver import AsyncSolver
+    from morphy.solver import guess_puzzle_cat
+    from morphy.constant import (
+        MATE_CAT,
+        MATERIAL_CAT,
+    )
+
+    mate_solver = create_solver(engine, MATE_CAT, analysis_cache=analysis_cache, solver_class=AsyncSolver,
+                                stats=stats)
+    mate_infos = await mate_solver.analyse_root(fen)
+
+    if guess_puzzle_cat(mate_infos) == MATE_CAT:
+        return MATE_CAT, mate_infos, serialize_root_score(mate_infos), mate_solver.engine_time
+
+    solver = create_solver(engine, MATERIAL_CAT, analysis_cache=analysis_cache, solver_class=AsyncSolver,
+                           stats=stats)
+    root_infos = await solver.analyse_root(fen)
+    engine_time = mate_solver.engine_time + solver.engine_time
+
+    if guess_puzzle_cat(root_infos) == MATE_CAT:
+        return MATE_CAT, mate_infos, serialize_root_score(root_infos), engine_time
+
+    return MATERIAL_CAT, root_infos, serialize_root_score(root_infos), engine_time
+
+
+def create_stats(with_stats=None):
+    from morphy.stats import SolverStats
+
+    if with_stats is None:
+        # Metrics need the engine time of the solves
+        with_stats = settings.SOLVER_STATS or bool(settings.METRICS_PATH)
+
+    return SolverStats() if with_stats else None
+
+
+def create_solver(engine, puzzle_cat, analysis_cache=None, log_func=None, solver_class=None, stats=None):
+    from morphy.solver import Solver
+    from morphy.constant import MATE_CAT
+
+    Solver = solver_class or Solver
+
+    if puzzle_cat == MATE_CAT:
+        return Solver(
+            engine,
+            best_moves_search_conf=settings.BEST_MOVES_SEARCH_MATE_CAT_CONF,
+            max_number_best_moves=settings.MAX_NUMBER_BEST_MOVES_MATE_CAT,
+            max_lines_number=settings.MAX_LINES_NUMBER_MATE_CAT,
+            analysis_cache=analysis_cache,
+            log_func=log_func,
+            stats=stats,
+        )
+
+    return Solver(engine, analysis_cache=analysis_cache, log_func=log_func, stats=stats)
+
+
+def serialize_root_score(root_infos):
+    from morphy.cache import serialize_score
+
+    return serialize_score(root_infos[0]['score'])
+
+
+def make_solution(fen, solver, puzzle_cat, root_score, error=None, stats=None):
+    """
+    Solution record of a finished search. ``search`` keeps where the search
+    ended, and for unsolved puzzles the check which stopped it (``error``).
+    """
+    search = dict(solver.search_summary(), puzzle_cat=puzzle_cat, root_score=root_score)
+
+    if error is None:
+        solution = solver.to_dict()
+    else:
+        solution = {
+            'fen': normalize_fen(fen),
+            'is_solved': False,
+            'reason': error.reason,
+        }
+        search.update(reason=error.reason, message=str(error))
+
+    solution['search'] = search
+
+    if stats is not None:
+        solution['stats'] = stats.to_dict()
+
+    return solution
+
+
+def skipped_solution(fen, puzzle_cat, root_score, engine_time):
+    return {
+        'fen': normalize_fen(fen),
+        'is_solved': False,
+        'reason': PREDICTED_FAILURE,
+        'search': {
+            'engine_time': engine_time,
+            'puzzle_cat': puzzle_cat,
+            'root_score': root_score,
+            'reason': PREDICTED_FAILURE,
+        },
+    }
+
+
+def solve_puzzle(fen, engine, analysis_cache=None, log_func=None, with_stats=None, predictor=None):
+    """
+    Solves one puzzle, returns its solution, category and solving time. With
+    stats (on by default with the ``SOLVER_STATS`` or ``METRICS_PATH``
+    settings) the solution has the ``SolverStats`` summary of the solve
+    under the ``stats`` key. Puzzles ``predictor`` expects to fail after an
+    expensive search are given up after the root analysis.
+    """
+    from morphy.utils import CannotSolve
+
+    ts = time.time()
+    stats = create_stats(with_stats)
+    puzzle_cat, root_infos, root_score, root_time = analyse_root(fen, engine, analysis_cache=analysis_cache,
+                                                                 stats=stats)
+
+    if predictor is not None and predictor.should_skip(puzzle_cat, root_score):
+        return skipped_solution(fen, puzzle_cat, root_score, root_time), puzzle_cat, time.time() - ts
+
+    solver = create_solver(engine, puzzle_cat, analysis_cache=analysis_cache, log_func=log_func, stats=stats)
+    # The root analyses ran on other solvers, they are part of the search all the same
+    solver.engine_time += root_time
+
+    try:
+        solver.solve(fen, root_infos=root_infos)
+        solution = make_solution(fen, solver, puzzle_cat, root_score, stats=stats)
+    except CannotSolve as e:
+        solution = make_solution(fen, solver, puzzle_cat, root_score, error=e, stats=stats)
+
+    return solution, puzzle_cat, time.time() - ts
+
+
+async def solve_puzzle_async(fen, engine, analysis_cache=None, with_stats=None, predictor=None):
+    from morphy.async_solver import AsyncSolver
+    from morphy.utils import CannotSolve
+
+    ts = time.time()
+    stats = create_stats(with_stats)
+    puzzle_cat, root_infos, root_score, root_time = await analyse_root_async(fen, engine,
+                                                                             analysis_cache=analysis_cache,
+                                                                             stats=stats)
+
+    if predictor is not None and predictor.should_skip(puzzle_cat, root_score):
+        return skipped_solution(fen, puzzle_cat, root_score, root_time), puzzle_cat, time.time() - ts
+
+    solver = create_solver(engine, puzzle_cat, analysis_cache=analysis_cache, solver_class=AsyncSolver, stats=stats)
+    solver.engine_time += root_time
+
+    try:
+        await solver.solve(fen, root_infos=root_infos)
+        solution = make_solution(fen, solver, puzzle_cat, root_score, stats=stats)
+    except CannotSolve as e:
+        solution = make_solution(fen, solver, puzzle_cat, root_score, error=e, stats=stats)
+
+    return solution, puzzle_cat, time.time() - ts
+
+
+def solve_in_event_loop(fens, concurrency, predictor=None):
+    """
+    Solves up to ``concurrency`` puzzles at once in a single event loop, sharing
+    one pool of asyncio engines. Results are yielded in input order.
+    """
+    from morphy.engine import AsyncEnginePool
+
+    analysis_cache = open_analysis_cache()
+    loop = asyncio.new_event_loop()
+    # The child watcher of the engine processes follows the current loop
+    asyncio.set_event_loop(loop)
+
+    async def create_pool():
+        return AsyncEnginePool(size=concurrency * settings.SOLVER_WORKERS, engine_path=settings.ENGINE_PATH)
+
+    async def solve(fen):
+        try:
+            result = await solve_puzzle_async(fen, engine_pool, analysis_cache=analysis_cache, predictor=predictor)
+            return (fen, ) + result + (None, )
+        except Exception:
+            return fen, None, None, None, traceback.format_exc()
+
+    engine_pool = loop.run_until_complete(create_pool())
+    pending = collections.deque()
+
+    try:
+        for fen in fens:
+            pending.append(loop.create_task(solve(fen)))
+
+            # Running the oldest task drives all the other ones as well
+            if len(pending) >= concurrency:
+                yield loop.run_until_complete(pending.popleft())
+
+        while pending:
+            yield loop.run_until_complete(pending.popleft())
+    finally:
+        for t in pending:
+            t.cancel()
+
+        if pending:
+            loop.run_until_complete(asyncio.wait(pending))
+
+        loop.run_until_complete(engine_pool.close())
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def solve_in_process(fens, predictor=None):
+    from morphy.engine import EnginePool
+
+    analysis_cache = open_analysis_cache()
+
+    with EnginePool(size=settings.SOLVER_WORKERS, engine_path=settings.ENGINE_PATH) as engine_pool:
+        for fen in fens:
+            # A crashed engine fails the puzzle only, the pool restarts it at the next checkout
+            try:
+                result = solve_puzzle(fen, engine_pool, analysis_cache=analysis_cache, log_func=click.echo,
+                                      predictor=predictor)
+            except Exception:
+                yield fen, None, None, None, traceback.format_exc()
+                continue
+
+            yield (fen, ) + result + (None, )
+
+
+_worker_engine_pool = None
+_worker_analysis_cache = None
+_worker_predictor = None
+
+
+def init_worker(settings_module, overrides, predictor=None):
+    global _worker_engine_pool, _worker_analysis_cache, _worker_predictor
+    from morphy.engine import EnginePool
+
+    load_settings(settings_module, overrides)
+    _worker_predictor = predictor
+    _worker_analysis_cache = open_analysis_cache()
+    _worker_engine_pool = EnginePool(size=settings.SOLVER_WORKERS, engine_path=settings.ENGINE_PATH)
+    # Engine threads are not daemonic, quit engines before the worker exits
+    multiprocessing.util.Finalize(_worker_engine_pool, _worker_engine_pool.close, exitpriority=10)
+
+
+def solve_in_worker(fen):
+    try:
+        result = solve_puzzle(fen, _worker_engine_pool, analysis_cache=_worker_analysis_cache, predictor=_worker_predictor)
+        return (fen, ) + result + (None, )
+    except Exception:
+        return fen, None, None, None, traceback.format_exc()
+
+
+def solve_in_workers(fens, workers, settings_module, overrides, predictor=None):
+    """
+    Solves puzzles in worker processes, each owning its own settings and engine.
+    Results are yielded in input order, so the caller stays the only writer of
+    the solutions file. Puzzles failed by an error (e.g. crashed engine) are
+    reported and skipped, so they are picked up again by the next run.
+    """
+    initargs = (settings_module, overrides, predictor)
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=initargs) as executor:
+        pending = collections.deque()
+
+        try:
+            for fen in fens:
+                pending.append(executor.submit(solve_in_worker, fen))
+
+                # Keep every worker busy without queueing the whole puzzles file
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for f in pending:
+                f.cancel()
+
+
 @click.command()
 @click.option('--solutions', '-s', required=True, type=str)
 @click.option('--puzzles', '-p', required=True, type=str)
 @click.option('--number', '-n', type=int, default=1, show_default=True)
 @click.option('--engine', '-e', 'engine_path', required=False, type=str)
 @click.option('--settings', '-S', 'settings_module', required=False, type=str)
-def main(solutions, puzzles, number, engine_path, settings_module):
+@click.option('--workers', '-w', type=int, default=1, show_default=True)
+@click.option('--cache', '-c', 'cache_path', required=False, type=str)
+@click.option('--concurrent-puzzles', '-C', 'concurrent_puzzles', type=int, default=0,
+              help='Solve this many puzzles at once in a single asyncio event loop.')
+@click.option('--from-start', 'from_start', is_flag=True,
+              help='Read the puzzles file from the beginning instead of where the last run stopped.')
+@click.option('--stats', 'stats_path', required=False, type=str,
+              help='Append per-puzzle solver stats (timings, engine nodes and depths per ply) as JSON lines.')
+@click.option('--metrics', 'metrics_path', required=False, type=str,
+              help='Write Prometheus metrics to this file (for the node_exporter textfile collector).')
+@click.option('--skip-predicted-failures', 'skip_predicted_failures', is_flag=True,
+              help='Give up puzzles which, judging by the solutions file, would fail after an expensive search. '
+                   'They are not saved, so a run with --from-start solves them.')
+def main(solutions, puzzles, number, engine_path, settings_module, workers, cache_path, concurrent_puzzles, from_start,
+         stats_path, metrics_path, skip_predicted_failures):
     counter = 0
-    solved = already_solved(solutions)
-    stop_solver = False
 
     settings_module = settings_module or os.environ.get('MORPHY_SETTINGS_MODULE')
+    overrides = {
+        'ENGINE_PATH': engine_path or os.environ.get('MORPHY_ENGINE_PATH'),
+        'ANALYSIS_CACHE_PATH': cache_path or os.environ.get('MORPHY_CACHE_PATH'),
+        'SOLVER_STATS': bool(stats_path),
+        'METRICS_PATH': metrics_path or os.environ.get('MORPHY_METRICS_PATH'),
+    }
+    load_settings(settings_module, overrides)
+
+    from morphy.solutions import open_solutions
+    from morphy.metrics import (
+        solver_metrics,
+        record_solution,
+        record_error,
+    )
 
-    if settings_module:
-        settings.load_settings(importlib.import_module(settings_module))
-
-    engine_path = engine_path or os.environ.get('MORPHY_ENGINE_PATH')
-
-    if engine_path:
-        settings['ENGINE_PATH'] = engine_path
+    solved = open_solutions(solutions)
+    metrics = solver_metrics(settings.METRICS_PATH, labels={'job': 'solver'}) if settings.METRICS_PATH else None
 
     click.echo('-' * 100)
     click.secho('Used settings: \n', fg='green')
     click.echo(pprint.pformat(settings))
     click.echo('-' * 100)
-    puzzles_with_solution = [json.loads(p) for p in solved.values()]
-    puzzles_with_solution = [p for p in puzzles_with_solution if p['is_solved']]
-    click.secho('Solved puzzles: {}'.format(len(puzzles_with_solution)), fg='green')
-    click.secho('Unsolved puzzles: {}'.format(len(solved) - len(puzzles_with_solution)), fg='red')
-    click.secho('Total: {}'.format(len(solved)), fg='green')
+    click.secho('Solved puzzles: {}'.format(solved.count(is_solved=True)), fg='green')
+    click.secho('Unsolved puzzles: {}'.format(solved.count(is_solved=False)), fg='red')
+    click.secho('Total: {}'.format(solved.count()), fg='green')
     click.echo('-' * 100)
 
     assert number >= 1
+    assert workers >= 1
     assert settings.ENGINE_PATH
 
-    from morphy.solver import Solver
-    from morphy.utils import CannotSolve
-    from morphy.engine import open_engine
-    from morphy.line import Line
-    from morphy.constant import (
-        MATE_CAT,
-    )
+    predictor = None
 
-    def guess_puzzle_cat(fen, engine):
-        solver = Solver(engine, max_line_length=1)
-        board = Board(fen)
-        line = solver.get_next_comp_line(Line(board))[0]
-        return line.get_line_category()
+    if skip_predicted_failures:
+        from morphy.failure_predictor import FailurePredictor
 
-    with open(puzzles, 'r') as puzzles_file:
-        for puzzle in puzzles_file:
-            fen = normalize_fen(puzzle)
+        predictor = FailurePredictor.from_solutions(solved)
+        click.secho('Failure predictor learnt from {} solutions'.format(sum(predictor.samples.values())), fg='green')
 
-            if fen in solved:
+    # Line ends of scheduled puzzles, the cursor is moved to them as results come in order
+    offsets = {}
+    start_offset = 0 if from_start else load_cursor(solutions, puzzles)
+    offset = start_offset
+    cursor_blocked = False
+
+    if start_offset:
+        click.secho('Resuming puzzles from byte {}'.format(start_offset), fg='green')
+
+    def puzzles_to_solve(puzzles_file):
+        for fen, end_offset in read_puzzles(puzzles_file, start_offset):
+            if fen in solved or fen in offsets:
                 continue
 
-            if number == counter:
+            if len(offsets) == number:
                 break
 
-            try:
-                engine = open_engine(settings.ENGINE_PATH)
-
-                puzzle_cat = guess_puzzle_cat(fen, engine)
-
-                if puzzle_cat == MATE_CAT:
-                    solver = Solver(
-                        engine,
-                        best_moves_search_conf=settings.BEST_MOVES_SEARCH_MATE_CAT_CONF,
-                        max_number_best_moves=settings.MAX_NUMBER_BEST_MOVES_MATE_CAT,
-                        max_lines_number=settings.MAX_LINES_NUMBER_MATE_CAT,
-                        log_func=click.echo,
-                    )
-                else:
-                    solver = Solver(engine, log_func=click.echo)
-
-                ts = time.time()
-                solver.solve(fen)
-                save_solution(solver.to_dict(), solutions)
-            except CannotSolve:
-                save_solution({
-                    'fen': normalize_fen(fen),
-                    "is_solved": False,
-                }, solutions)
-            except KeyboardInterrupt:
-                click.secho('Stopping solver...', fg='red')
-                stop_solver = True
-            finally:
-                engine.quit()
-                if not stop_solver:
-                    counter += 1
-                    click.secho('Solving time: {}'.format(time.time() - ts), fg='green')
-
-                    is_solved_color = 'green'
-
-                    if not solver.is_solved():
-                        is_solved_color = 'red'
-                        solutions_number = 0
-                    else:
-                        solutions_number = get_solutions_number(solver.to_dict())
-
-                    click.secho('Is solved: {}'.format(solver.is_solved()), fg=is_solved_color)
-
-                    if solutions_number:
-                        click.secho('Solutions number: {}'.format(solutions_number), fg='green')
-
-                    click.secho('Puzzle number: {}/{}'.format(counter, number), fg='green')
-                    click.secho('Puzzle cat: {}'.format(puzzle_cat), fg='green')
+            offsets[fen] = end_offset
+            yield fen
+
+    def update_cursor():
+        solved.flush()
+        save_cursor(solutions, puzzles, offset)
+
+    with open(puzzles, 'rb') as puzzles_file:
+        fens = puzzles_to_solve(puzzles_file)
+
+        if concurrent_puzzles:
+            results = solve_in_event_loop(fens, concurrent_puzzles, predictor=predictor)
+        elif workers == 1:
+            results = solve_in_process(fens, predictor=predictor)
+        else:
+            results = solve_in_workers(fens, workers, settings_module, overrides, predictor=predictor)
+
+        try:
+            for result in results:
+                fen, solution, puzzle_cat, solving_time, error = result
+
+                if error:
+                    click.secho('Cannot solve {} due to an error:\n{}'.format(fen, error), fg='red')
+
+                    if metrics is not None:
+                        record_error(metrics)
+                        metrics.write()
+
+                    # Keep the cursor before the failed puzzle, so the next run solves it again
+                    cursor_blocked = True
+                    continue
+
+                stats = solution.pop('stats', None)
+
+                if stats_path and stats is not None:
+                    save_stats(stats_path, solution, puzzle_cat, solving_time, stats)
+
+                if metrics is not None:
+                    record_solution(metrics, solution, puzzle_cat, solving_time, stats)
+                    metrics.write()
+
+                # Skipped puzzles are left out of the solutions file, to be solved by a run without the predictor
+                if solution.get('reason') != PREDICTED_FAILURE:
+                    solved.add(solution)
+
+                counter += 1
+
+                if not cursor_blocked:
+                    offset = offsets[fen]
+
+                    if counter % solved.batch_size == 0:
+                        update_cursor()
+                click.secho('Solving time: {}'.format(solving_time), fg='green')
+
+                is_solved_color = 'green'
+
+                if not solution['is_solved']:
+                    is_solved_color = 'red'
+                    solutions_number = 0
                 else:
-                    break
+                    solutions_number = get_solutions_number(solution)
+
+                click.secho('Is solved: {}'.format(solution['is_solved']), fg=is_solved_color)
+
+                if solutions_number:
+                    click.secho('Solutions number: {}'.format(solutions_number), fg='green')
+
+                click.secho('Puzzle number: {}/{}'.format(counter, number), fg='green')
+                click.secho('Puzzle cat: {}'.format(puzzle_cat), fg='green')
+        except KeyboardInterrupt:
+            click.secho('Stopping solver...', fg='red')
+        finally:
+            results.close()
+            update_cursor()
+            solved.close()
+
+            if metrics is not None:
+                metrics.write(force=True)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
 from morphy.engine import Limit
+from morphy.depth_policy import FixedDepthPolicy
 
 
 BEST_MOVE_SEARCH_CONF = {
@@ -37,3 +38,22 @@ MAX_LINES_NUMBER = 30
 MAX_LINES_NUMBER_MATE_CAT = 300
 SIMILARITY_FACTOR = 5/3
 ENGINE_PATH = ''
+SOLVER_WORKERS = 1
+ANALYSIS_CACHE_PATH = None
+ANALYSIS_CACHE_SIZE = 10**6
+MINING_RESTART_AFTER_GAMES = 1000
+MINING_PAUSE = 0
+MINING_STATIC_PREFILTER = False
+MINING_PREFILTER_NODES = 10**5
+SOLUTIONS_BATCH_SIZE = 20
+SOLVER_STATS = False
+METRICS_PATH = None
+METRICS_INTERVAL = 15
+FAILURE_PREDICTOR_CP_BUCKET = 100
+FAILURE_PREDICTOR_MAX_MATE = 10
+FAILURE_PREDICTOR_MIN_SAMPLES = 20
+FAILURE_PREDICTOR_SKIP_RATE = 0.9
+FAILURE_PREDICTOR_EXPENSIVE_TIME = 60
+SEARCH_DEPTH_POLICY = FixedDepthPolicy()
+MULTIPV_START = 4
+MULTIPV_WIDEN_FACTOR = 2
@@ -1,27 +1,19 @@
 import sys
 sys.path.insert(0, '/Users/majki/Projects/morphy/src')
 
-from morphy.utils import games_reader
+from morphy.pgn_index import PgnIndex
 
+PGN_FILE = '/Users/majki/Projects/morphy_data/caissabase.pgn'
 
-def main(first_game, games_number):
-    pgn = open("/Users/majki/Projects/morphy_data/caissabase.pgn", 'r')
-    counter = 1
 
-    for g in games_reader(pgn):
-        
-        if counter < first_game:
-            continue
-        counter += 1
+def main(first_game, games_number, pgn_file=PGN_FILE):
+    # Built on the first run only, next slices seek straight to the first game
+    index = PgnIndex.open(pgn_file)
 
-        if not games_number:
-            break
-            
-        games_number -= 1
-        
-        print(g)
+    with open(pgn_file, 'rb') as pgn:
+        for g in index.read_games(pgn, first_game - 1, games_number):
+            print('{}\n'.format(g))
 
-    
 
 if __name__ == '__main__':
-    main(int(sys.argv[1]), int(sys.argv[2]))
+    main(int(sys.argv[1]), int(sys.argv[2]), *sys.argv[3:4])
@@ -0,0 +1,235 @@
+import json
+import sqlite3
+import threading
+
+from morphy.config import settings
+from morphy.cn_utils import Puzzle
+
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+class SolutionsStore:
+    """
+    SQLite store of solver results keyed by ``Puzzle.hash_from_fen`` of the
+    normalized FEN. Lookups and counts are indexed queries, new solutions are
+    written in batches of ``batch_size`` (and on ``flush``/``close``).
+    """
+
+    def __init__(self, path, batch_size=settings.SOLUTIONS_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS solutions ('
+            'id TEXT PRIMARY KEY, '
+            'fen TEXT NOT NULL, '
+            'is_solved INTEGER NOT NULL, '
+            'solution TEXT NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS solutions_is_solved ON solutions (is_solved)')
+        self._db.commit()
+
+    @staticmethod
+    def make_key(fen):
+        return Puzzle.hash_from_fen(Puzzle.normalize_fen(fen))
+
+    def __contains__(self, fen):
+        key = self.make_key(fen)
+
+        with self._lock:
+            if key in self._pending:
+                return True
+
+            return self._db.execute('SELECT 1 FROM solutions WHERE id = ?', (key, )).fetchone() is not None
+
+    def get(self, fen):
+        key = self.make_key(fen)
+
+        with self._lock:
+            if key in self._pending:
+                return json.loads(self._pending[key][3])
+
+            row = self._db.execute('SELECT solution FROM solutions WHERE id = ?', (key, )).fetchone()
+
+        return None if row is None else json.loads(row[0])
+
+    def add(self, solution):
+        fen = Puzzle.normalize_fen(solution['fen'])
+        row = (self.make_key(fen), fen, int(bool(solution['is_solved'])), json.dumps(solution))
+
+        with self._lock:
+            self._pending[row[0]] = row
+
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+
+            with self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO solutions (id, fen, is_solved, solution) VALUES (?, ?, ?, ?)',
+                    list(self._pending.values()),
+                )
+
+            self._pending = {}
+
+    def count(self, is_solved=None):
+        self.flush()
+
+        with self._lock:
+            if is_solved is None:
+                return self._db.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+
+            return self._db.execute(
+                'SELECT COUNT(*) FROM solutions WHERE is_solved = ?',
+                (int(is_solved), ),
+            ).fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        self.flush()
+
+        with self._lock:
+            rows = self._db.execute('SELECT solution FROM solutions ORDER BY rowid').fetchall()
+
+        for row in rows:
+            yield json.loads(row[0])
+
+    def import_jsonl(self, path):
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+
+                if line:
+                    self.add(json.loads(line))
+
+        self.flush()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JsonlSolutions:
+    """
+    Solutions kept in a JSON lines file, with the same interface as
+    ``SolutionsStore``. The file is read once, only FENs and the solved flag
+    are kept in memory.
+    """
+
+    def __init__(self, path, batch_size=settings.SOLUTIONS_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._solved = {}
+        self._pending = []
+        self._lock = threading.RLock()
+
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+
+                    if line:
+                        solution = json.loads(line)
+                        self._solved[Puzzle.normalize_fen(solution['fen'])] = bool(solution['is_solved'])
+        except IOError:
+            pass
+
+    def __contains__(self, fen):
+        return Puzzle.normalize_fen(fen) in self._solved
+
+    def add(self, solution):
+        with self._lock:
+            self._solved[Puzzle.normalize_fen(solution['fen'])] = bool(solution['is_solved'])
+            self._pending.append(json.dumps(solution))
+
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+
+            with open(self.path, 'a') as f:
+                f.write(''.join('{}\n'.format(s) for s in self._pending))
+
+            self._pending = []
+
+    def count(self, is_solved=None):
+        if is_solved is None:
+            return len(self._solved)
+
+        return sum(1 for s in self._solved.values() if s == bool(is_solved))
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        self.flush()
+
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+
+                    if line:
+                        yield json.loads(line)
+        except IOError:
+            return
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def is_sqlite_file(path):
+    """
+    Whether ``path`` is an SQLite database, ``None`` if it does not exist or is
+    empty.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(len(SQLITE_HEADER))
+    except FileNotFoundError:
+        return None
+
+    return header == SQLITE_HEADER if header else None
+
+
+def open_solutions(path, batch_size=settings.SOLUTIONS_BATCH_SIZE):
+    """
+    Opens a solutions file in the format it is in: a ``SolutionsStore`` for an
+    SQLite database, JSON lines for any other existing file. New (or empty)
+    files are JSON lines when named ``*.jsonl``, databases otherwise.
+    """
+    is_sqlite = is_sqlite_file(path)
+
+    if is_sqlite is None:
+        is_sqlite = not path.endswith('.jsonl')
+
+    if not is_sqlite:
+        return JsonlSolutions(path, batch_size=batch_size)
+
+    return SolutionsStore(path, batch_size=batch_size)
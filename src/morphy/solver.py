@@ -1,18 +1,34 @@
+import contextlib
 import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from chess import (
     Board,
 )
 
-from morphy.line import Line
+from morphy.line import (
+    Line,
+    AnalysisRecord,
+)
+from morphy.cache import TranspositionTable
 from morphy.utils import (
     extract_best_winning_moves,
     close_score_threshold,
     score,
+    move,
     cannot_solve,
     flatten,
 )
-from morphy.constant import MATERIAL_CAT
+from morphy.constant import (
+    MATERIAL_CAT,
+    MATE_CAT,
+    BROKEN_LINE,
+    TOO_MANY_GOOD_MOVES,
+    SOLUTION_TOO_LONG,
+    TOO_MANY_SOLUTIONS,
+)
 from morphy.config import settings
 
 
@@ -22,7 +38,9 @@ class Solver:
                  best_moves_search_conf=settings.BEST_MOVES_SEARCH_CONF, max_number_best_moves=settings.MAX_NUMBER_BEST_MOVES,
                  max_line_length=settings.MAX_LINE_LENGTH, max_lines_number=settings.MAX_LINES_NUMBER,
                  cp_close_score=settings.CP_CLOSE_SCORE, mate_close_score=settings.MATE_CLOSE_SCORE,
-                 similarity_factor=settings.SIMILARITY_FACTOR, log_func=None):
+                 similarity_factor=settings.SIMILARITY_FACTOR, max_workers=settings.SOLVER_WORKERS,
+                 analysis_cache=None, log_func=None, stats=None, depth_policy=settings.SEARCH_DEPTH_POLICY,
+                 multipv_start=settings.MULTIPV_START, multipv_widen_factor=settings.MULTIPV_WIDEN_FACTOR):
         self._closed_lines = []
         self._open_lines = []
         self._fen = None
@@ -37,67 +55,107 @@ class Solver:
         self.cp_close_score = cp_close_score
         self.mate_close_score = mate_close_score
         self.similarity_factor = similarity_factor
+        # With more than one worker the engine has to handle concurrent searches (see EnginePool)
+        self.max_workers = max_workers
+        self._stop_event = None
+        self.analysis_cache = analysis_cache
+        self.transposition_table = TranspositionTable()
+        # SolverStats collecting timings and analyses of the solve, if any
+        self.stats = stats
+        self.engine_time = 0
+        self._engine_time_lock = threading.Lock()
+        # Which depths positions are searched at (see morphy.depth_policy)
+        self.depth_policy = depth_policy
+        # Player moves are searched with multipv_start lines first, widened while all of them are best moves
+        self.multipv_start = multipv_start
+        self.multipv_widen_factor = multipv_widen_factor
 
     def reset(self):
         self._closed_lines = []
         self._open_lines = []
         self._fen = None
         self._depth = 0
+        self.engine_time = 0
+        self.transposition_table.clear()
            
-    def solve(self, fen):
+    def analyse_root(self, fen):
+        # The root search picks the puzzle category and is reused as the first step of solve()
+        return self.search_best_moves(Line(Board(fen)))
+
+    def solve(self, fen, root_infos=None):
+        self._start(fen, root_infos)
+
+        while self._open_lines:
+            # Calculate new lines
+            lines = self._go_deeper()
+            self._update_lines(lines)
+
+    def _start(self, fen, root_infos):
         self.log('-' * 100)
         self.log('{}'.format(fen))
         self.log('\n')
         self.print_board(fen)
         self.log('\n')
         self._fen = fen
+        self.transposition_table.clear()
         board = Board(fen)
         assert not board.is_game_over()
+
+        if root_infos is not None:
+            self.transposition_table.put(board, root_infos, **self.best_moves_search_conf)
+
         self._open_lines.append(Line(board))
 
-        while self._open_lines:
-            # Calculate new lines
-            lines = self._go_deeper()
-            # Evaluate lines
-            self._evaluate_lines(flatten(lines))
-            # Should solver stop searching
-            self.should_terminate(lines)
-            # Remove already checked lines
-            lines = self.remove_repetitions(flatten(lines))
-            self._move_to_closed_lines(lines)
-            self._replace_open_lines(lines)
-            self.log('Open lines: {}'.format(len(self._open_lines)))
-            self.log('Closed lines: {}'.format(len(self._closed_lines)))
+    def _update_lines(self, lines):
+        expanded_lines = self._open_lines
+        new_lines = flatten(lines)
+        # Evaluate lines
+        self._evaluate_lines(new_lines)
+        # Should solver stop searching
+        self.should_terminate(lines)
+        # Remove already checked lines
+        lines = self.remove_repetitions(new_lines)
+        self._move_to_closed_lines(lines)
+        self._replace_open_lines(lines)
+        # Only open lines need boards, the other ones are rebuilt from the move tree on demand
+        self._release_boards(expanded_lines + [l for l in new_lines if l.is_closed() or l.has_repetition()])
+        self.log('Open lines: {}'.format(len(self._open_lines)))
+        self.log('Closed lines: {}'.format(len(self._closed_lines)))
+        self.log('Transposition table hits: {}/{}'.format(
+            self.transposition_table.hits,
+            self.transposition_table.hits + self.transposition_table.misses,
+        ))
     
     def remove_repetitions(self, lines):
         return [l for l in lines if not l.has_repetition()]
 
     def _evaluate_lines(self, lines):
-        for l in lines:
-            l.evaluate()
+        with self._measure('evaluate_lines'):
+            for l in lines:
+                l.evaluate()
     
     def stop_if_broken_line(self, lines):
         if [] in lines:
             self.log('Broken line!')
-            cannot_solve()
+            cannot_solve('Broken line', reason=BROKEN_LINE)
     
     def stop_if_solution_too_long(self, lines):
         for l in flatten(lines):
             if l.length() > self.max_line_length:
-                self.log('Solution too long: {}!'.format(l.length))
-                cannot_solve()
+                self.log('Solution too long: {}!'.format(l.length()))
+                cannot_solve('Solution too long: {}'.format(l.length()), reason=SOLUTION_TOO_LONG)
     
     def stop_if_too_many_solutions(self):
         solutions_number = len(self._open_lines) + len(self._closed_lines)
         if solutions_number > self.max_lines_number:
             self.log('Too many solutions: {}!'.format(solutions_number))
-            cannot_solve()
+            cannot_solve('Too many solutions: {}'.format(solutions_number), reason=TOO_MANY_SOLUTIONS)
     
     def stop_if_too_many_good_moves(self, lines):
         for l in lines:
             if len(l) > self.max_number_best_moves:
                 self.log('Too many good moves: {}!'.format(len(l)))
-                cannot_solve()
+                cannot_solve('Too many good moves: {}'.format(len(l)), reason=TOO_MANY_GOOD_MOVES)
 
     def filter_winning_material_solutions(self, lines):
         _lines = []
@@ -109,27 +167,49 @@ class Solver:
         return _lines
 
     def should_terminate(self, lines):
-        # Broken line
-        self.stop_if_broken_line(lines)
-        
-        # Too many good moves
-        self.stop_if_too_many_good_moves(self.filter_winning_material_solutions(lines))
-        
-        # Solution too long
-        self.stop_if_solution_too_long(lines)
+        with self._measure('should_terminate'):
+            # Broken line
+            self.stop_if_broken_line(lines)
+
+            # Too many good moves
+            self.stop_if_too_many_good_moves(self.filter_winning_material_solutions(lines))
+
+            # Solution too long
+            self.stop_if_solution_too_long(lines)
+
+            # Too many solutions
+            self.stop_if_too_many_solutions()
+
+    def _measure(self, name):
+        return self.stats.measure(name) if self.stats is not None else contextlib.nullcontext()
+
+    def _measure_ply(self):
+        if self.stats is None:
+            return contextlib.nullcontext()
+
+        return self.stats.measure_ply(self._depth, len(self._open_lines))
+
+    def _record_analysis(self, kwargs, infos, ts, cached):
+        elapsed = time.perf_counter() - ts
+
+        if not cached:
+            with self._engine_time_lock:
+                self.engine_time += elapsed
+
+        if self.stats is not None:
+            self.stats.record_analysis(self._depth, kwargs, infos, elapsed, cached)
 
-        # Too many solutions
-        self.stop_if_too_many_solutions()
-    
     def _go_deeper(self):
+        with self._measure('go_deeper'), self._measure_ply():
+            if self.max_workers > 1:
+                return self._go_deeper_parallel()
+
+            return self._go_deeper_serial()
+
+    def _go_deeper_serial(self):
         lines = []
         for line in self._open_lines:
-            if line.is_player_move():
-                next_lines = self.get_next_player_lines(line)
-            else:
-                next_lines = self.get_next_comp_line(line)
-
-            lines.append(next_lines)
+            lines.append(self._expand_line(line))
             # Does this make solver faster?
             # Evaluate lines
             self._evaluate_lines(flatten(lines))
@@ -138,6 +218,40 @@ class Solver:
 
         self._depth += 1
         return lines
+
+    def _go_deeper_parallel(self):
+        lines = [None] * len(self._open_lines)
+        self._stop_event = threading.Event()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self._expand_line, l): i for i, l in enumerate(self._open_lines)}
+
+                try:
+                    for f in as_completed(futures):
+                        lines[futures[f]] = f.result()
+                        expanded_lines = [l for l in lines if l is not None]
+                        self._evaluate_lines(flatten(expanded_lines))
+                        self.should_terminate(expanded_lines)
+                except BaseException:
+                    # Abort queued and in-flight searches, one broken line is enough
+                    self._stop_event.set()
+
+                    for f in futures:
+                        f.cancel()
+
+                    raise
+        finally:
+            self._stop_event = None
+
+        self._depth += 1
+        return lines
+
+    def _expand_line(self, line):
+        if line.is_player_move():
+            return self.get_next_player_lines(line)
+
+        return self.get_next_comp_line(line)
             
     def _move_to_closed_lines(self, lines):
         for l in lines:
@@ -146,9 +260,54 @@ class Solver:
 
     def _replace_open_lines(self, lines):
         self._open_lines = [l for l in lines if l.is_open()]
+
+    def _release_boards(self, lines):
+        for l in lines:
+            l.release_board()
     
     def analyse(self, line, **kwargs):
-        return self.engine.analyse(line.board, **kwargs)
+        ts = time.perf_counter()
+        infos = self._cached_analysis(line, **kwargs)
+
+        if infos is not None:
+            self._record_analysis(kwargs, infos, ts, cached=True)
+            return infos
+
+        if self._stop_event is not None:
+            infos = self.engine.analyse(line.board, stop_event=self._stop_event, **kwargs)
+        else:
+            infos = self.engine.analyse(line.board, **kwargs)
+
+        self._cache_analysis(line, infos, **kwargs)
+        self._record_analysis(kwargs, infos, ts, cached=False)
+        return infos
+
+    def _cached_analysis(self, line, **kwargs):
+        infos = self.transposition_table.get(line.board, **kwargs)
+
+        if infos is not None:
+            return infos
+
+        if self.analysis_cache is not None:
+            infos = self.analysis_cache.get(line.board, **kwargs)
+
+        if infos is not None:
+            self.transposition_table.put(line.board, infos, **kwargs)
+
+        return infos
+
+    def _peek_cached_analysis(self, line, persistent=True, **kwargs):
+        # Whether an analysis is cached, without counting it as a hit or a miss
+        if self.transposition_table.contains(line.board, **kwargs):
+            return True
+
+        return persistent and self.analysis_cache is not None and self.analysis_cache.contains(line.board, **kwargs)
+
+    def _cache_analysis(self, line, infos, **kwargs):
+        if self.analysis_cache is not None:
+            self.analysis_cache.put(line.board, infos, **kwargs)
+
+        self.transposition_table.put(line.board, infos, **kwargs)
 
     def calc_cp_threshold(self, infos, line):
         scores = [score(i) for i in infos]
@@ -171,26 +330,110 @@ class Solver:
         return [i for i in infos if score(i) in best_scores and i.get('pv')]
     
     def get_next_player_lines(self, line):
-        infos = list(self.search_best_moves(line))
-        best_moves = self.extract_best_winning_moves(infos, line)
-        
-        return [line.make_move(i['pv'][0], i) for i in best_moves]
+        return self._make_player_lines(line, self.search_best_moves(line))
 
     def get_next_comp_line(self, line):
-        info = self.search_best_move(line)
-        return [line.make_move(info['pv'][0], info)]
+        return self._make_comp_line(line, self.search_best_move(line))
+
+    def _make_player_lines(self, line, infos):
+        best_moves = self.extract_best_winning_moves(list(infos), line)
+        
+        return [line.make_move(move(i), AnalysisRecord.from_info(i)) for i in best_moves]
+
+    def _make_comp_line(self, line, info):
+        return [line.make_move(move(info), AnalysisRecord.from_info(info))]
 
     def search_best_move(self, line, **kwargs):
+        return self._search(line, self._best_move_search_kwargs(**kwargs), move)
+
+    def search_best_moves(self, line, **kwargs):
+        return self._search(line, self._best_moves_search_kwargs(**kwargs), self._winning_moves_key(line), widen=True)
+
+    def _winning_moves_key(self, line):
+        return lambda infos: frozenset(move(i) for i in self.extract_best_winning_moves(list(infos), line))
+
+    def _search_limits(self, line, kwargs):
+        limits = list(self.depth_policy.limits(kwargs['limit']))
+
+        # A search with the limit of the conf (e.g. the root analysis) is used as it is. Deeper results of the
+        # analysis cache answer the shallower searches as well, only the transposition table is worth a lookup.
+        if len(limits) > 1 and self._peek_cached_analysis(line, persistent=False, **kwargs):
+            return [kwargs['limit']]
+
+        return limits
+
+    def _multipv_widths(self, kwargs):
+        multipv = kwargs['multipv']
+        widths = []
+        width = self.multipv_start
+
+        while width and width < multipv:
+            widths.append(width)
+            width *= self.multipv_widen_factor
+
+        return widths + [multipv]
+
+    def _needs_wider_search(self, infos, line, multipv):
+        # Lines left out score lower, they can be best moves only if all the returned ones are
+        return len(infos) == multipv and len(self.extract_best_winning_moves(list(infos), line)) == multipv
+
+    def _search_steps(self, line, kwargs, result_key, widen=False):
+        """
+        Analyses of one search: deeper ones until the depth policy is settled
+        and, with ``widen``, wider ones while best moves could be left out.
+        Yields ``(peek, kwargs)`` and is sent whether that analysis is cached
+        (``peek``) or its infos, so the sync and async solvers run the same
+        steps. Returns the infos of the search.
+        """
+        limits = self._search_limits(line, kwargs)
+        results = []
+
+        for limit in limits:
+            limit_kwargs = dict(kwargs, limit=limit)
+            widths = self._multipv_widths(limit_kwargs) if widen else [None]
+
+            # A search with all the lines (e.g. the root analysis) is used as it is
+            if len(widths) > 1 and (yield True, limit_kwargs):
+                widths = widths[-1:]
+
+            for multipv in widths:
+                infos = yield False, limit_kwargs if multipv is None else dict(limit_kwargs, multipv=multipv)
+
+                if multipv == widths[-1] or not self._needs_wider_search(infos, line, multipv):
+                    break
+
+            if len(limits) == 1:
+                break
+
+            results.append(result_key(infos))
+
+            if self.depth_policy.is_settled(results):
+                break
+
+        return infos
+
+    def _search(self, line, kwargs, result_key, widen=False):
+        steps = self._search_steps(line, kwargs, result_key, widen=widen)
+        result = None
+
+        try:
+            while True:
+                peek, step_kwargs = steps.send(result)
+                result = self._peek_cached_analysis(line, **step_kwargs) if peek else self.analyse(line, **step_kwargs)
+        except StopIteration as e:
+            return e.value
+
+    def _best_move_search_kwargs(self, **kwargs):
         kw = copy.deepcopy(self.best_move_search_conf)
         kw.update(kwargs)
         assert 'multipv' not in kw
-        return self.analyse(line, **kw)
-    
-    def search_best_moves(self, line, **kwargs):
+        return kw
+
+    def _best_moves_search_kwargs(self, **kwargs):
         kw = copy.deepcopy(self.best_moves_search_conf)
         kw.update(kwargs)
         assert kw.get('multipv', 0) > 1
-        return self.analyse(line, **kw)
+        return kw
     
     def log(self, msg, *args, **kwargs):
         if self.log_func:
@@ -199,6 +442,15 @@ class Solver:
     def is_solved(self):
         return not self._open_lines
 
+    def search_summary(self):
+        # Where the search is (or stopped), e.g. for unsolved puzzles
+        return {
+            'depth': self._depth,
+            'open_lines': len(self._open_lines),
+            'closed_lines': len(self._closed_lines),
+            'engine_time': self.engine_time,
+        }
+
     def to_dict(self):
         return {
             'is_solved': self.is_solved(),
@@ -207,4 +459,11 @@ class Solver:
         }
 
     def print_board(self, fen):
-        self.log(Board(fen))
\ No newline at end of file
+        self.log(Board(fen))
+
+
+def guess_puzzle_cat(root_infos):
+    if score(root_infos[0]).is_mate():
+        return MATE_CAT
+
+    return MATERIAL_CAT
@@ -0,0 +1,99 @@
+import collections
+import contextlib
+import threading
+import time
+
+
+def _first_info(infos):
+    return infos[0] if isinstance(infos, list) else infos
+
+
+class SolverStats:
+    """
+    Instrumentation of one puzzle solve: wall time and calls of the solver
+    steps, and every analysis with the ply it was made at, its multipv width
+    and the depth, nodes and speed the engine reached. Shared by the threads
+    of a parallel solver.
+    """
+
+    def __init__(self):
+        self.analyses = []
+        self.functions = collections.defaultdict(lambda: {'calls': 0, 'time': 0})
+        self.plies = collections.defaultdict(lambda: {'time': 0, 'open_lines': 0})
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        ts = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - ts
+
+            with self._lock:
+                self.functions[name]['calls'] += 1
+                self.functions[name]['time'] += elapsed
+
+    @contextlib.contextmanager
+    def measure_ply(self, ply, open_lines):
+        ts = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - ts
+
+            with self._lock:
+                self.plies[ply]['time'] += elapsed
+                self.plies[ply]['open_lines'] = open_lines
+
+    def record_analysis(self, ply, kwargs, infos, elapsed, cached):
+        info = _first_info(infos)
+        limit = kwargs.get('limit')
+        record = {
+            'ply': ply,
+            'time': elapsed,
+            'cached': cached,
+            'multipv': kwargs.get('multipv') or 1,
+            'limit_depth': getattr(limit, 'depth', None),
+            'limit_nodes': getattr(limit, 'nodes', None),
+            'depth': info.get('depth'),
+            'seldepth': info.get('seldepth'),
+            'nodes': info.get('nodes'),
+            'nps': info.get('nps'),
+        }
+
+        with self._lock:
+            self.analyses.append(record)
+
+    def _summary(self, analyses):
+        engine_analyses = [a for a in analyses if not a['cached']]
+        return {
+            'analyses': len(analyses),
+            'cached': len(analyses) - len(engine_analyses),
+            'engine_time': sum(a['time'] for a in engine_analyses),
+            'nodes': sum(a['nodes'] or 0 for a in engine_analyses),
+            'max_depth': max((a['depth'] or 0 for a in engine_analyses), default=None),
+            'max_multipv': max((a['multipv'] for a in analyses), default=None),
+        }
+
+    def to_dict(self):
+        with self._lock:
+            analyses = list(self.analyses)
+            functions = {name: dict(f) for name, f in self.functions.items()}
+            plies = {ply: dict(p) for ply, p in self.plies.items()}
+
+        by_ply = collections.defaultdict(list)
+
+        for a in analyses:
+            by_ply[a['ply']].append(a)
+
+        summary = self._summary(analyses)
+        summary['functions'] = functions
+        summary['plies'] = [
+            dict(ply=ply, **plies.get(ply, {'time': 0, 'open_lines': 0}), **self._summary(by_ply[ply]))
+            for ply in sorted(set(plies) | set(by_ply))
+        ]
+        summary['analysis_calls'] = analyses
+        return summary
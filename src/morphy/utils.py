@@ -123,11 +123,15 @@ def move(info):
 
 
 class CannotSolve(Exception):
-    pass
 
+    def __init__(self, msg='', reason=None):
+        super().__init__(msg)
+        # One of the reasons in morphy.constant, None if unknown
+        self.reason = reason
 
-def cannot_solve(msg=''):
-    raise CannotSolve
+
+def cannot_solve(msg='', reason=None):
+    raise CannotSolve(msg, reason)
 
 
 def flatten(l):
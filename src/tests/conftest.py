@@ -29,6 +29,11 @@ def games_pgn(request):
         return StringIO(f.read())
 
 
+@pytest.fixture
+def games_pgn_path(request):
+    return os.path.join(os.path.dirname(request.module.__file__), GAMES_PATH)
+
+
 @pytest.fixture
 def game(games_pgn):
     return chess.pgn.read_game(games_pgn)
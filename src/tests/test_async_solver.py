@@ -0,0 +1,147 @@
+import asyncio
+import threading
+
+import pytest
+from chess import Board
+
+from morphy.async_solver import AsyncSolver
+from morphy.cache import trim_infos
+from morphy.depth_policy import AdaptiveDepthPolicy
+from morphy.line import Line
+from morphy.utils import (
+    CannotSolve,
+    flatten,
+)
+
+
+FEN = 'r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'
+
+
+class Engine:
+
+    def __init__(self, analyse):
+        self._analyse = analyse
+        self.calls = []
+
+    async def analyse(self, board, **kwargs):
+        self.calls.append((board, kwargs))
+        return await self._analyse(board, **kwargs)
+
+
+def test_search_best_moves(infos):
+    async def analyse(board, **kwargs):
+        return infos
+
+    engine = Engine(analyse)
+    solver = AsyncSolver(engine)
+    line = Line(Board(FEN))
+    assert asyncio.run(solver.search_best_moves(line)) == infos
+    assert engine.calls == [(line.board, solver.best_moves_search_conf)]
+
+    # Second search is served by the transposition table
+    assert asyncio.run(solver.search_best_moves(line)) == trim_infos(infos)
+    assert len(engine.calls) == 1
+
+    with pytest.raises(AssertionError):
+        asyncio.run(solver.search_best_moves(line, multipv=1))
+
+
+def test_search_best_moves_with_adaptive_depth(infos):
+    async def analyse(board, **kwargs):
+        return infos
+
+    engine = Engine(analyse)
+    solver = AsyncSolver(engine, depth_policy=AdaptiveDepthPolicy(start_depth=16, step=4))
+    assert asyncio.run(solver.search_best_moves(Line(Board(FEN)))) == infos
+    assert [kwargs['limit'].depth for _, kwargs in engine.calls] == [16, 20]
+
+
+def test_analysis_cache_off_the_loop(infos):
+    threads = []
+
+    class AnalysisCache:
+
+        def get(self, board, **kwargs):
+            threads.append(threading.current_thread())
+
+        def put(self, board, infos, **kwargs):
+            threads.append(threading.current_thread())
+
+    async def analyse(board, **kwargs):
+        return infos
+
+    solver = AsyncSolver(Engine(analyse), analysis_cache=AnalysisCache())
+    assert asyncio.run(solver.search_best_moves(Line(Board(FEN)))) == infos
+    assert threads
+    assert threading.main_thread() not in threads
+
+
+def test_analyse_root(infos):
+    async def analyse(board, **kwargs):
+        return infos
+
+    solver = AsyncSolver(Engine(analyse))
+    assert asyncio.run(solver.analyse_root(FEN)) == infos
+
+
+def test_go_deeper(infos):
+    running = []
+    max_running = []
+
+    async def analyse(board, **kwargs):
+        running.append(board)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(board)
+        return infos
+
+    solver = AsyncSolver(Engine(analyse), max_number_best_moves=len(infos))
+    solver.extract_best_winning_moves = lambda i, l: i
+    solver._open_lines = [Line(Board(FEN)), Line(Board(FEN)), Line(Board(FEN))]
+    lines = asyncio.run(solver._go_deeper())
+    assert [len(l) for l in lines] == [5, 5, 5]
+    assert len(flatten(lines)) == 15
+    assert max(max_running) == 3
+    assert solver._depth == 1
+
+
+def test_go_deeper_cancels_searches(infos):
+    broken_line = Line(Board(FEN))
+    cancelled = []
+
+    async def analyse(board, **kwargs):
+        if board is broken_line.board:
+            return []
+
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(board)
+            raise
+
+    solver = AsyncSolver(Engine(analyse))
+    solver.extract_best_winning_moves = lambda i, l: i
+    solver._open_lines = [Line(Board(FEN)), broken_line, Line(Board(FEN))]
+
+    with pytest.raises(CannotSolve):
+        asyncio.run(solver._go_deeper())
+
+    # The last line might have been cancelled before it started
+    assert len(cancelled) in (1, 2)
+    assert solver._depth == 0
+
+
+def test_solve(infos):
+    async def analyse(board, **kwargs):
+        raise CannotSolve
+
+    engine = Engine(analyse)
+    solver = AsyncSolver(engine)
+
+    with pytest.raises(CannotSolve):
+        asyncio.run(solver.solve(FEN, root_infos=infos))
+
+    # The root search came from root_infos
+    assert len(engine.calls) == 1
+    assert engine.calls[0][0].fen() == 'r2b1r1k/pppqN1pn/2npb1Q1/5N1p/2B1PP1P/8/PPP5/2K3RR b - - 1 1'
+    assert solver.to_dict()['fen'] == FEN
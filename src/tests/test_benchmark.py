@@ -0,0 +1,61 @@
+import pytest
+from chess import Board
+from chess.engine import Limit
+
+from morphy.benchmark import (
+    MissingRecording,
+    RecordingEngine,
+    ReplayEngine,
+    ScriptedEngine,
+    benchmark_puzzle,
+    measure_memory,
+)
+from morphy.run_solver import solve_puzzle
+
+
+FEN = '6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1'
+
+
+@pytest.fixture
+def analyses():
+    engine = RecordingEngine(ScriptedEngine())
+    solve_puzzle(FEN, engine)
+    return engine.analyses
+
+
+def test_replay_engine(analyses):
+    board = Board(FEN)
+    engine = ReplayEngine(analyses)
+    recorded_solution, _, _ = solve_puzzle(FEN, ScriptedEngine())
+    solution, _, _ = solve_puzzle(FEN, engine)
+    assert solution['lines'] == recorded_solution['lines']
+    assert engine.calls == len(analyses)
+
+    with pytest.raises(MissingRecording):
+        engine.analyse(board, Limit(depth=1), multipv=3)
+
+
+def test_benchmark_puzzle(analyses):
+    result = benchmark_puzzle(FEN, analyses, repeat=2)
+    assert result['is_solved']
+    assert result['repeat'] == 2
+    assert result['engine_calls'] == len(analyses)
+    assert result['time'] > 0
+    assert list(result['plies']) == list(range(len(result['plies'])))
+    assert result['functions']['Solver.solve']['calls'] == 1
+    assert result['functions']['Solver.should_terminate']['calls'] > 0
+    assert result['functions']['morphy.solver.flatten']['calls'] > 0
+
+
+def test_benchmark_restores_functions(analyses):
+    from morphy.solver import Solver
+
+    go_deeper = Solver._go_deeper
+    benchmark_puzzle(FEN, analyses)
+    assert Solver._go_deeper is go_deeper
+
+
+def test_measure_memory(analyses):
+    memory = measure_memory(FEN, analyses)
+    assert memory['peak'] > 0
+    assert memory['allocations']
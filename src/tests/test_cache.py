@@ -0,0 +1,184 @@
+import copy
+
+import pytest
+from chess import (
+    Board,
+    Move,
+    WHITE,
+    BLACK,
+)
+from chess.engine import (
+    PovScore,
+    Cp,
+    Mate,
+    MateGiven,
+)
+
+from morphy.cache import (
+    AnalysisCache,
+    TranspositionTable,
+    serialize_info,
+    deserialize_info,
+    position_key,
+    trim_info,
+    trim_infos,
+)
+from morphy.engine import Limit
+
+
+FEN = 'r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = AnalysisCache(str(tmp_path / 'cache.db'))
+    yield cache
+    cache.close()
+
+
+def test_position_key():
+    assert position_key(Board(FEN)) == position_key(Board(FEN.replace('0 1', '12 42')))
+    assert position_key(Board(FEN)) != position_key(Board(FEN.replace(' w ', ' b ')))
+
+
+def test_serialize_info(infos):
+    for info in infos:
+        assert deserialize_info(serialize_info(info)) == info
+
+    for s in [Mate(3), Mate(-2), MateGiven, Cp(-42)]:
+        for color in [WHITE, BLACK]:
+            info = {'score': PovScore(s, color)}
+            assert deserialize_info(serialize_info(info)) == info
+
+
+def test_get_put(cache, infos):
+    board = Board(FEN)
+    options = {'Threads': 8, 'Hash': 1024}
+    assert cache.get(board, Limit(depth=20), multipv=3, options=options) is None
+    cache.put(board, infos[:3], Limit(depth=20), multipv=3, options=options)
+    assert cache.get(board, Limit(depth=20), multipv=3, options=options) == infos[:3]
+    assert cache.get(board, Limit(depth=20), multipv=3, options={'Threads': 4, 'Hash': 1024}) is None
+    assert cache.get(board, Limit(depth=20), multipv=2, options=options) is None
+    assert cache.get(board, Limit(depth=20), options=options) is None
+    assert cache.get(Board(), Limit(depth=20), multipv=3, options=options) is None
+    assert cache.hits == 1
+    assert cache.misses == 5
+
+    cache.put(board, infos[0], Limit(depth=20), options=options)
+    assert cache.get(board, Limit(depth=20), options=options) == infos[0]
+    assert len(cache) == 2
+
+    # Looking a result up without getting it is not counted
+    assert cache.contains(board, Limit(depth=18), options=options)
+    assert not cache.contains(board, Limit(depth=21), options=options)
+    assert (cache.hits, cache.misses) == (2, 5)
+
+
+def test_deeper_result_answers_shallower_request(cache, infos):
+    board = Board(FEN)
+    cache.put(board, infos[0], Limit(depth=20))
+    assert cache.get(board, Limit(depth=18)) == infos[0]
+    assert cache.get(board, Limit(depth=21)) is None
+    assert cache.get(board, Limit(nodes=10)) is None
+
+    deeper_info = copy.deepcopy(infos[1])
+    cache.put(board, deeper_info, Limit(depth=29))
+    assert cache.get(board, Limit(depth=18)) == deeper_info
+    assert cache.get(board, Limit(depth=21)) == deeper_info
+
+    cache.put(board, infos[2], Limit(nodes=10**6))
+    assert cache.get(board, Limit(nodes=10**5)) == infos[2]
+    assert cache.get(board, Limit(nodes=10**7)) is None
+    assert cache.get(board, Limit(time=1)) is None
+
+
+def test_eviction(tmp_path, infos):
+    cache = AnalysisCache(str(tmp_path / 'cache.db'), max_size=2)
+    boards = [Board(FEN), Board(), Board(FEN.replace(' w ', ' b '))]
+    cache.put(boards[0], infos[0], Limit(depth=20))
+    cache.put(boards[1], infos[0], Limit(depth=20))
+    # Make the first position the most recently used one
+    assert cache.get(boards[0], Limit(depth=20)) is not None
+    cache.put(boards[2], infos[0], Limit(depth=20))
+    assert len(cache) == 2
+    assert cache.get(boards[0], Limit(depth=20)) is not None
+    assert cache.get(boards[1], Limit(depth=20)) is None
+    assert cache.get(boards[2], Limit(depth=20)) is not None
+    cache.close()
+
+
+def test_replace_keeps_size(tmp_path, infos):
+    cache = AnalysisCache(str(tmp_path / 'cache.db'), max_size=2)
+    boards = [Board(FEN), Board()]
+    cache.put(boards[0], infos[0], Limit(depth=20))
+    cache.put(boards[0], infos[1], Limit(depth=20))
+    cache.put(boards[1], infos[0], Limit(depth=20))
+    assert len(cache) == 2
+    assert cache.get(boards[0], Limit(depth=20)) == infos[1]
+    assert cache.get(boards[1], Limit(depth=20)) == infos[0]
+    cache.close()
+
+
+def test_get_does_not_write(tmp_path, infos):
+    path = str(tmp_path / 'cache.db')
+    cache = AnalysisCache(path)
+    cache.put(Board(FEN), infos[0], Limit(depth=20))
+    changes = cache._db.total_changes
+    assert cache.get(Board(FEN), Limit(depth=20)) == infos[0]
+    assert cache._db.total_changes == changes
+    cache.close()
+
+
+def test_persistence(tmp_path, infos):
+    path = str(tmp_path / 'cache.db')
+    cache = AnalysisCache(path)
+    cache.put(Board(FEN), infos, Limit(depth=20), multipv=5)
+    cache.close()
+    cache = AnalysisCache(path)
+    assert len(cache) == 1
+    assert cache.get(Board(FEN), Limit(depth=20), multipv=5) == infos
+    cache.close()
+
+
+def test_transposition_table(infos):
+    table = TranspositionTable()
+    board = Board(FEN)
+    assert table.get(board, Limit(depth=20), multipv=3) is None
+    table.put(board, infos, Limit(depth=20), multipv=3)
+    assert table.get(board, Limit(depth=20), multipv=3) == trim_infos(infos)
+    assert table.get(board, Limit(depth=21), multipv=3) is None
+    assert table.get(board, Limit(depth=20), multipv=2) is None
+    assert table.get(board, Limit(depth=20), multipv=3, options={'Threads': 1}) is None
+
+    transposed_board = Board(FEN)
+
+    for m in ['c1b1', 'a7a6', 'b2b3']:
+        transposed_board.push(Move.from_uci(m))
+
+    for m in ['b2b3', 'a7a6', 'c1b1']:
+        board.push(Move.from_uci(m))
+
+    table.put(board, infos[0], Limit(depth=20))
+    assert table.get(transposed_board, Limit(depth=20)) == trim_info(infos[0])
+    assert table.contains(transposed_board, Limit(depth=20))
+    assert not table.contains(transposed_board, Limit(depth=21))
+    assert table.hits == 2
+    assert table.misses == 4
+    assert len(table) == 2
+
+    table.clear()
+    assert len(table) == 0
+    assert table.hits == table.misses == 0
+
+
+def test_trim_info(infos):
+    info = trim_info(infos[0])
+    assert info == {
+        'score': infos[0]['score'],
+        'depth': infos[0]['depth'],
+        'nodes': infos[0]['nodes'],
+        'pv': infos[0]['pv'][:1],
+    }
+    assert trim_info({'score': infos[0]['score']}) == {'score': infos[0]['score']}
+    assert trim_infos(infos) == [trim_info(i) for i in infos]
+    assert trim_infos(infos[0]) == info
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Minimal deterministic UCI engine for tests: legal moves in generation order,
+the first one +500cp, every next one 400cp worse. Exits while searching the
+position given by the FAKE_UCI_CRASH_FEN environment variable.
+"""
+import os
+import sys
+
+import chess
+
+
+def main():
+    board = chess.Board()
+    multipv = 1
+
+    for line in sys.stdin:
+        parts = line.split()
+
+        if not parts:
+            continue
+
+        if parts[0] == 'uci':
+            print('id name Fake')
+            print('option name Threads type spin default 1 min 1 max 512')
+            print('option name Hash type spin default 16 min 1 max 4096')
+            print('option name MultiPV type spin default 1 min 1 max 500')
+            print('uciok')
+        elif parts[0] == 'isready':
+            print('readyok')
+        elif parts[0] == 'setoption' and parts[2] == 'MultiPV':
+            multipv = int(parts[4])
+        elif parts[0] == 'position':
+            moves = parts.index('moves') if 'moves' in parts else len(parts)
+            board = chess.Board(' '.join(parts[2:moves])) if parts[1] == 'fen' else chess.Board()
+
+            for m in parts[moves + 1:]:
+                board.push_uci(m)
+        elif parts[0] == 'go':
+            if board.fen() == os.environ.get('FAKE_UCI_CRASH_FEN'):
+                sys.exit(1)
+
+            moves = list(board.legal_moves)
+
+            for i, m in enumerate(moves[:multipv]):
+                print('info depth 10 multipv {} score cp {} nodes 1000 nps 1000 pv {}'.format(
+                    i + 1, 500 - 400 * i, m.uci()))
+
+            print('bestmove {}'.format(moves[0].uci() if moves else '0000'))
+        elif parts[0] == 'quit':
+            break
+
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+from morphy.engine import Limit
+from morphy.depth_policy import (
+    FixedDepthPolicy,
+    AdaptiveDepthPolicy,
+)
+
+
+def test_fixed_depth_policy():
+    policy = FixedDepthPolicy()
+    assert list(policy.limits(Limit(depth=29))) == [Limit(depth=29)]
+    assert not policy.is_settled(['e2e4', 'e2e4', 'e2e4'])
+
+
+def test_adaptive_depth_policy_limits():
+    policy = AdaptiveDepthPolicy(start_depth=16, step=4)
+    assert [l.depth for l in policy.limits(Limit(depth=29))] == [16, 20, 24, 28, 29]
+    assert [l.depth for l in policy.limits(Limit(depth=20))] == [16, 20]
+    assert [l.depth for l in policy.limits(Limit(depth=12))] == [12]
+    # Only depth limits are deepened
+    assert list(policy.limits(Limit(nodes=10**6))) == [Limit(nodes=10**6)]
+    assert list(policy.limits(Limit(depth=29, time=10))) == [Limit(depth=29, time=10)]
+
+
+def test_adaptive_depth_policy_is_settled():
+    policy = AdaptiveDepthPolicy(stable_iterations=3)
+    assert not policy.is_settled([])
+    assert not policy.is_settled(['e2e4', 'e2e4'])
+    assert not policy.is_settled(['e2e4', 'd2d4', 'e2e4'])
+    assert policy.is_settled(['d2d4', 'e2e4', 'e2e4', 'e2e4'])
@@ -1,6 +1,18 @@
+import asyncio
+import queue
+import threading
 from unittest import mock
 
-from morphy.engine import open_engine
+import pytest
+from chess.engine import EngineTerminatedError
+
+from morphy.engine import (
+    open_engine,
+    EnginePool,
+    AsyncEnginePool,
+    AnalysisStopped,
+    analyse_until,
+)
 from morphy.settings.default_settings import ENGINE_PATH
 
 
@@ -13,3 +25,150 @@ def test_open_engine(mocked_SimpleEngine):
     e = open_engine(ep)
     mocked_SimpleEngine.popen_uci.assert_called_with(ep)
     assert e == mocked_SimpleEngine.popen_uci.return_value
+
+
+@mock.patch('morphy.engine.SimpleEngine')
+def test_engine_pool_reuses_engines(mocked_SimpleEngine):
+    pool = EnginePool(size=2, engine_path='path_to_stockfish')
+    e1 = pool.checkout()
+    pool.checkin(e1)
+    e2 = pool.checkout()
+    assert e1 is e2
+    mocked_SimpleEngine.popen_uci.assert_called_once_with('path_to_stockfish')
+    e1.ping.assert_called_once()
+
+
+@mock.patch('morphy.engine.SimpleEngine')
+def test_engine_pool_size(mocked_SimpleEngine):
+    mocked_SimpleEngine.popen_uci.side_effect = lambda path: mock.Mock()
+    pool = EnginePool(size=2)
+    e1 = pool.checkout()
+    e2 = pool.checkout()
+    assert e1 is not e2
+    assert mocked_SimpleEngine.popen_uci.call_count == 2
+
+    with pytest.raises(queue.Empty):
+        pool.checkout(timeout=0.01)
+
+    pool.checkin(e2)
+    assert pool.checkout() is e2
+
+
+@mock.patch('morphy.engine.SimpleEngine')
+def test_engine_pool_restarts_crashed_engine(mocked_SimpleEngine):
+    mocked_SimpleEngine.popen_uci.side_effect = lambda path: mock.Mock()
+    pool = EnginePool()
+
+    with pool.engine() as engine:
+        pass
+
+    engine.ping.side_effect = EngineTerminatedError('engine process died')
+
+    with pool.engine() as new_engine:
+        assert new_engine is not engine
+
+    engine.quit.assert_called_once()
+    assert mocked_SimpleEngine.popen_uci.call_count == 2
+    assert pool.checkout() is new_engine
+
+
+@mock.patch('morphy.engine.SimpleEngine')
+def test_engine_pool_analyse(mocked_SimpleEngine):
+    pool = EnginePool()
+    info = pool.analyse('board', limit='limit', multipv=2)
+    engine = mocked_SimpleEngine.popen_uci.return_value
+    engine.analyse.assert_called_once_with('board', limit='limit', multipv=2)
+    assert info == engine.analyse.return_value
+
+
+@mock.patch('morphy.engine.SimpleEngine')
+def test_engine_pool_close(mocked_SimpleEngine):
+    with EnginePool() as pool:
+        engine = pool.checkout()
+
+    engine.quit.assert_called_once()
+
+    with pytest.raises(AssertionError):
+        pool.checkout()
+
+
+def test_analyse_until():
+    engine = mock.MagicMock()
+    analysis = engine.analysis.return_value.__enter__.return_value
+    analysis.__iter__.return_value = iter([1, 2, 3])
+    stop_event = threading.Event()
+    assert analyse_until(engine, stop_event, 'board', 'limit') == analysis.info
+    engine.analysis.assert_called_once_with('board', 'limit', multipv=None)
+    analysis.__iter__.return_value = iter([1, 2, 3])
+    assert analyse_until(engine, stop_event, 'board', 'limit', multipv=2) == analysis.multipv
+
+    def infos():
+        yield 1
+        stop_event.set()
+        yield 2
+
+    analysis.__iter__.return_value = infos()
+
+    with pytest.raises(AnalysisStopped):
+        analyse_until(engine, stop_event, 'board', 'limit')
+
+    engine.analysis.reset_mock()
+
+    with pytest.raises(AnalysisStopped):
+        analyse_until(engine, stop_event, 'board', 'limit')
+
+    engine.analysis.assert_not_called()
+
+
+@mock.patch('morphy.engine.SimpleEngine')
+def test_engine_pool_analyse_until(mocked_SimpleEngine):
+    pool = EnginePool()
+    stop_event = threading.Event()
+    stop_event.set()
+
+    with pytest.raises(AnalysisStopped):
+        pool.analyse('board', limit='limit', stop_event=stop_event)
+
+    mocked_SimpleEngine.popen_uci.return_value.analyse.assert_not_called()
+
+
+def _async_engine():
+    engine = mock.Mock()
+    engine.ping = mock.AsyncMock()
+    engine.quit = mock.AsyncMock()
+    engine.analyse = mock.AsyncMock()
+    return engine
+
+
+@mock.patch('morphy.engine.popen_uci')
+def test_async_engine_pool(mocked_popen_uci):
+    mocked_popen_uci.side_effect = lambda path: ('transport', _async_engine())
+
+    async def run():
+        async with AsyncEnginePool(size=2, engine_path='path_to_stockfish') as pool:
+            e1 = await pool.checkout()
+            e2 = await pool.checkout()
+            assert e1 is not e2
+            checkout = asyncio.ensure_future(pool.checkout())
+            await asyncio.sleep(0)
+            assert not checkout.done()
+            await pool.checkin(e2)
+            assert await checkout is e2
+            await pool.checkin(e2)
+
+            e2.ping.side_effect = EngineTerminatedError('engine process died')
+
+            async with pool.engine() as e3:
+                assert e3 is not e2
+
+            e2.quit.assert_awaited_once()
+            info = await pool.analyse('board', limit='limit')
+            e3.analyse.assert_awaited_once_with('board', limit='limit')
+            assert info == e3.analyse.return_value
+
+        e1.quit.assert_awaited_once()
+        e3.quit.assert_awaited_once()
+
+    asyncio.run(run())
+    assert mocked_popen_uci.call_count == 3
+    mocked_popen_uci.assert_called_with('path_to_stockfish')
@@ -0,0 +1,63 @@
+from chess import WHITE
+from chess.engine import (
+    PovScore,
+    Cp,
+    Mate,
+)
+
+from morphy.cache import serialize_score
+from morphy.constant import (
+    MATE_CAT,
+    MATERIAL_CAT,
+    PREDICTED_FAILURE,
+    TOO_MANY_SOLUTIONS,
+)
+from morphy.failure_predictor import (
+    FailurePredictor,
+    root_bucket,
+)
+
+
+def root_score(s):
+    return serialize_score(PovScore(s, WHITE))
+
+
+def solution(is_solved, puzzle_cat, score, engine_time, reason=None):
+    return {
+        'fen': '8/8/8/8/8/8/8/K1k5 w - - 0 1',
+        'is_solved': is_solved,
+        'search': {
+            'puzzle_cat': puzzle_cat,
+            'root_score': root_score(score),
+            'engine_time': engine_time,
+            'reason': reason,
+        },
+    }
+
+
+def test_root_bucket():
+    assert root_bucket(MATERIAL_CAT, root_score(Cp(350))) == (MATERIAL_CAT, 'cp', 3)
+    assert root_bucket(MATERIAL_CAT, root_score(Cp(399))) == (MATERIAL_CAT, 'cp', 3)
+    assert root_bucket(MATE_CAT, root_score(Mate(3))) == (MATE_CAT, 'mate', 3)
+    assert root_bucket(MATE_CAT, root_score(Mate(30))) == (MATE_CAT, 'mate', 10)
+
+
+def test_failure_predictor():
+    solutions = (
+        [solution(False, MATE_CAT, Mate(7), 100, reason=TOO_MANY_SOLUTIONS)] * 9 +
+        [solution(True, MATE_CAT, Mate(7), 100)] +
+        # Cheap failures are not worth predicting
+        [solution(False, MATE_CAT, Mate(2), 1, reason=TOO_MANY_SOLUTIONS)] * 10 +
+        [solution(False, MATERIAL_CAT, Cp(500), 100, reason=TOO_MANY_SOLUTIONS)] * 5 +
+        # Skipped puzzles and records without search summary teach nothing
+        [solution(False, MATE_CAT, Mate(2), 0, reason=PREDICTED_FAILURE)] * 10 +
+        [{'fen': '8/8/8/8/8/8/8/K1k5 w - - 0 1', 'is_solved': False}]
+    )
+    predictor = FailurePredictor.from_solutions(solutions, min_samples=10, skip_rate=0.9, expensive_time=60)
+    assert predictor.failure_rate(MATE_CAT, root_score(Mate(7))) == 0.9
+    assert predictor.should_skip(MATE_CAT, root_score(Mate(7)))
+    assert predictor.failure_rate(MATE_CAT, root_score(Mate(2))) == 0
+    assert not predictor.should_skip(MATE_CAT, root_score(Mate(2)))
+    # Not enough samples
+    assert predictor.failure_rate(MATERIAL_CAT, root_score(Cp(500))) is None
+    assert not predictor.should_skip(MATERIAL_CAT, root_score(Cp(500)))
@@ -1,4 +1,5 @@
 import random 
+from unittest import mock
 
 import pytest
 from chess import (
@@ -14,7 +15,10 @@ from chess.engine import (
     Mate,
 )
 
-from morphy.line import Line
+from morphy.line import (
+    Line,
+    AnalysisRecord,
+)
 from morphy.utils import (
     move,
     CannotSolve,
@@ -57,7 +61,7 @@ def test_copy(fen):
     line._closed = True
     line._initial_comp_material = 222
     line._initial_player_material = 522
-    line._analysis_result.append(42)
+    line._node.info = 42
     line._repeated_position = True
     c_line = line.copy()
     assert isinstance(c_line, Line)
@@ -68,9 +72,11 @@ def test_copy(fen):
     assert id(c_line.board) != id(line.board)
     assert c_line._closed == line._closed
     assert c_line._player_color == line._player_color
-    assert c_line._analysis_result == line._analysis_result
+    assert c_line._node is line._node
     assert c_line._initial_player_material == line._initial_player_material
     assert c_line._initial_comp_material == line._initial_comp_material
+    assert c_line._material == line._material
+    assert id(c_line._material) != id(line._material)
     assert id(c_line._parent) == id(line)
     assert [id(c) for c in line._children] == [id(c_line)]
     assert c_line._repeated_position == line._repeated_position
@@ -97,8 +103,61 @@ def test_make_move(game):
     assert id(new_line) != id(line)
     assert next_move == new_line.board.move_stack[-1]
     assert next_move != line.board.move_stack[-1]
-    assert new_line._analysis_result[-1] == 42
-    assert line._analysis_result == []
+    assert new_line._node.info == 42
+    assert new_line._node.parent is line._node
+    assert line._node.info is None
+
+
+def test_release_board(game):
+    board = game.board()
+    moves = list(game.mainline_moves())
+
+    for m in moves[:5]:
+        board.push(m)
+
+    line = Line(board)
+    
+    for m in moves[5:15]:
+        line = line.make_move(m)
+
+    fen = line.board.fen()
+    move_stack = line.board.move_stack[:]
+    line.release_board()
+    assert line._board is None
+    assert line.board.fen() == fen
+    assert line.board.move_stack == move_stack
+    assert line.moves() == moves[:15]
+    assert line.length() == 15
+
+    # Reading a released line does not rebuild its board
+    line.release_board()
+    line.to_dict()
+    assert line._board is None
+
+
+def test_make_move_builds_board_lazily(game):
+    board = game.board()
+    moves = list(game.mainline_moves())
+    line = Line(board)
+    child = line.make_move(moves[0])
+    assert child._board is None
+    assert child.get_comp_material() == line.get_comp_material()
+    # Built from the board of the parent
+    assert child.board.move_stack == moves[:1]
+    assert line.board.move_stack == []
+
+    # Rebuilt from the root once the parents are released
+    grandchild = child.make_move(moves[1]).make_move(moves[2])
+    line.release_board()
+    child.release_board()
+    assert grandchild.board.move_stack == moves[:3]
+    assert grandchild.copy().board.move_stack == moves[:3]
+
+    # The parent moved on, the child does not follow it
+    child = line.make_move(moves[0])
+    line._make_move(moves[0])
+    line._make_move(moves[1])
+    assert child.board.move_stack == moves[:1]
 
 
 def test_close(fen):
@@ -155,6 +214,35 @@ def test_get_comp_material():
     assert line.get_comp_material() == 30.5
 
 
+def test_material_is_tracked_incrementally(game):
+    board = game.board()
+    line = Line(board)
+    moves = list(game.mainline_moves())
+
+    for m in moves:
+        line._make_move(m)
+        assert line._material == [black_material(line.board), white_material(line.board)]
+
+    # En passant
+    line = Line(Board('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 2'))
+    line = line.make_move(Move.from_uci('e5d6'))
+    assert line.get_player_material() == 1
+    assert line.get_comp_material() == 0
+
+    # Promotion with capture
+    line = Line(Board('1n2k3/P7/8/8/8/8/8/4K3 w - - 0 1'))
+    c_line = line.make_move(Move.from_uci('a7b8q'))
+    assert c_line.get_player_material() == 9.5
+    assert c_line.get_comp_material() == 0
+    assert line.get_player_material() == 1
+    assert line.get_comp_material() == 3
+
+    # Castling
+    line = Line(Board('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1'))
+    line = line.make_move(Move.from_uci('e1g1')).make_move(Move.from_uci('e8c8'))
+    assert line.get_player_material() == line.get_comp_material() == 10
+
+
 def test_player_gained_material(analysis_result):
     board = Board('4r1k1/8/3R1Qpp/2p5/2P1p1q1/P3P3/1P2PK2/8 b - - 0 1')
     line = Line(board)
@@ -174,14 +262,19 @@ def test_can_close_material_line(analysis_result):
         line = line.make_move(move(i), i)
     
     parent = line._parent
-    parent.player_gained_material = lambda: True
     parent._children = [1, 2]
-    assert line.can_close_material_line()
-    parent.player_gained_material = lambda: False
-    assert line.can_close_material_line() is False
-    parent.player_gained_material = lambda: True
+
+    with mock.patch.object(Line, 'player_gained_material', return_value=True):
+        assert line.can_close_material_line()
+
+    with mock.patch.object(Line, 'player_gained_material', return_value=False):
+        assert line.can_close_material_line() is False
+
     parent._children = [1]
-    assert line.can_close_material_line() is False
+
+    with mock.patch.object(Line, 'player_gained_material', return_value=True):
+        assert line.can_close_material_line() is False
+
     line._parent = None
     assert line.can_close_material_line() is False
 
@@ -195,10 +288,27 @@ def test_get_line_category(analysis_result):
         line = line.make_move(move(i), i)
         
     assert line.get_line_category() == MATERIAL_CAT
-    line._analysis_result.append({
+    line._node.info = {
         'score': PovScore(Mate(11), BLACK)
-    })
+    }
     assert line.get_line_category() == MATE_CAT
+    line._node.info = AnalysisRecord(PovScore(Cp(300), BLACK))
+    assert line.get_line_category() == MATERIAL_CAT
+
+
+def test_analysis_record(analysis_result):
+    info = analysis_result[0]
+    record = AnalysisRecord.from_info(info)
+    assert record['score'] == record.score == info['score']
+    assert record.depth == info.get('depth')
+    assert record.nodes == info.get('nodes')
+    assert record == AnalysisRecord(info['score'], depth=info.get('depth'), nodes=info.get('nodes'))
+
+    with pytest.raises(KeyError):
+        record['pv']
+
+    with pytest.raises(AttributeError):
+        record.pv = info['pv']
 
 
 def test_moves(analysis_result):
@@ -261,15 +371,20 @@ def test_evaluate():
     line = Line(board)
     line.evaluate()
     assert not line.is_closed()
-    line.player_won_game = lambda: True
-    line.evaluate()
+
+    with mock.patch.object(Line, 'player_won_game', return_value=True):
+        line.evaluate()
+
     assert line.is_closed()
-    line.player_won_game = lambda: False
     line._closed = False
-    line.evaluate()
-    assert not line.is_closed()
-    line.can_close_material_line = lambda: True
-    line.evaluate()
+
+    with mock.patch.object(Line, 'player_won_game', return_value=False):
+        line.evaluate()
+        assert not line.is_closed()
+
+        with mock.patch.object(Line, 'can_close_material_line', return_value=True):
+            line.evaluate()
+
     assert line.is_closed()
     
     # raise CannotSolve
@@ -302,7 +417,6 @@ def test_to_dict():
     line = line.make_move(Move.from_uci('d1c2'))
     line = line.make_move(Move.from_uci('f2g1'))
     line = line.make_move(Move.from_uci('c2d1'))
-    line.get_line_category = lambda: MATERIAL_CAT
     line.close()
     expected = {
         'category': MATERIAL_CAT,
@@ -320,4 +434,6 @@ def test_to_dict():
         'player_material': black_material(line.board),
         'comp_material': white_material(line.board),
     }
-    assert expected == line.to_dict()
+
+    with mock.patch.object(Line, 'get_line_category', return_value=MATERIAL_CAT):
+        assert expected == line.to_dict()
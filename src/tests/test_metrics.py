@@ -0,0 +1,58 @@
+from morphy.metrics import (
+    Metrics,
+    solver_metrics,
+    record_solution,
+)
+
+
+def test_metrics_render():
+    metrics = Metrics('metrics.prom', labels={'job': 'solver'})
+    metrics.counter('morphy_puzzles_total', 'Puzzles.')
+    metrics.gauge('morphy_queue_size', 'Queue size.')
+    metrics.inc('morphy_puzzles_total', result='solved')
+    metrics.inc('morphy_puzzles_total', 2, result='solved')
+    metrics.inc('morphy_puzzles_total', result='unsolved')
+    metrics.set('morphy_queue_size', 4, stage='solve "1"')
+    assert metrics.get('morphy_puzzles_total', result='solved') == 3
+    assert metrics.total('morphy_puzzles_total') == 4
+    assert metrics.render() == (
+        '# HELP morphy_puzzles_total Puzzles.\n'
+        '# TYPE morphy_puzzles_total counter\n'
+        'morphy_puzzles_total{job="solver",result="solved"} 3\n'
+        'morphy_puzzles_total{job="solver",result="unsolved"} 1\n'
+        '# HELP morphy_queue_size Queue size.\n'
+        '# TYPE morphy_queue_size gauge\n'
+        'morphy_queue_size{job="solver",stage="solve \\"1\\""} 4\n'
+    )
+
+
+def test_metrics_write(tmp_path):
+    path = tmp_path / 'metrics.prom'
+    metrics = Metrics(str(path), interval=60)
+    metrics.counter('morphy_games_total', 'Games.')
+    metrics.inc('morphy_games_total')
+    metrics.write()
+    assert 'morphy_games_total 1\n' in path.read_text()
+    metrics.inc('morphy_games_total')
+    # Written at most once per interval
+    metrics.write()
+    assert 'morphy_games_total 1\n' in path.read_text()
+    metrics.write(force=True)
+    assert 'morphy_games_total 2\n' in path.read_text()
+    assert [p.name for p in tmp_path.iterdir()] == ['metrics.prom']
+
+
+def test_record_solution():
+    metrics = solver_metrics('metrics.prom')
+    stats = {'engine_time': 3, 'analyses': 4, 'cached': 1}
+    record_solution(metrics, {'is_solved': True}, 'MATE_CAT', 5, stats)
+    record_solution(metrics, {'is_solved': False, 'reason': 'broken_line'}, 'MATE_CAT', 2, stats)
+    record_solution(metrics, {'is_solved': False}, 'MATERIAL_CAT', 1)
+    assert metrics.get('morphy_puzzles_total', result='solved', category='MATE_CAT') == 1
+    assert metrics.get('morphy_puzzles_total', result='unsolved', category='MATE_CAT') == 1
+    assert metrics.get('morphy_cannot_solve_total', reason='broken_line') == 1
+    assert metrics.get('morphy_cannot_solve_total', reason='unknown') == 1
+    assert metrics.get('morphy_solving_seconds_total') == 8
+    assert metrics.get('morphy_engine_seconds_per_puzzle') == 2
+    assert metrics.get('morphy_analysis_cache_hit_ratio') == 0.25
+    assert metrics.get('morphy_puzzles_per_hour') > 0
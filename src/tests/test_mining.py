@@ -0,0 +1,355 @@
+import functools
+import shutil
+from unittest import mock
+
+import pytest
+from chess import (
+    WHITE,
+    Board,
+    Move,
+)
+from chess.engine import (
+    EngineTerminatedError,
+    Limit,
+    PovScore,
+    Cp,
+)
+
+from morphy.mining import (
+    MiningSession,
+    mine_game,
+    is_forcing_position,
+    has_piece_en_prise,
+    low_nodes_search,
+    StagedFilter,
+    candidate_search,
+    make_puzzle_filter,
+    node_thresholds,
+    analysis_snapshots,
+    holds_at_every_threshold,
+    mine_games,
+    mine_shard,
+    merge_shards,
+    shard_ranges,
+    shard_path,
+    checkpoint_path,
+    load_checkpoint,
+    save_checkpoint,
+)
+
+
+class FakeAnalysis:
+
+    def __init__(self, infos):
+        self.infos = infos
+        self.multipv = []
+        self.stopped = False
+        self.consumed = 0
+
+    @property
+    def info(self):
+        return self.multipv[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stopped = True
+
+    def __iter__(self):
+        for info in self.infos:
+            i = info.get('multipv', 1) - 1
+            self.multipv[i:i + 1] = [info]
+            self.consumed += 1
+            yield info
+
+
+def make_infos(nodes, multipv=2):
+    return [
+        {'multipv': pv, 'nodes': n, 'score': PovScore(Cp(100 * pv), WHITE), 'pv': [Move.from_uci('e2e4')]}
+        for n in nodes for pv in range(1, multipv + 1)
+    ]
+
+
+def test_node_thresholds():
+    thresholds = node_thresholds()
+    assert thresholds[:3] == [10**6, 1400000, 1959999]
+    assert len(thresholds) == 11
+    assert thresholds[-1] < 40 * 10**6
+    assert node_thresholds(10, 40, 2) == [10, 20]
+
+
+def test_analysis_snapshots():
+    analysis = FakeAnalysis(make_infos([5, 10, 15, 30, 35]))
+    engine = mock.Mock()
+    engine.analysis.return_value = analysis
+    snapshots = list(analysis_snapshots(engine, Board(), thresholds=[10, 20, 30, 40], multipv=2))
+    assert engine.analysis.call_args[0][1].nodes == 40
+    # Thresholds 10 and 30 passed, 40 never reached by the search
+    assert [[i['nodes'] for i in s] for s in snapshots] == [[10, 10], [30, 30], [35, 35]]
+    assert analysis.stopped
+
+    analysis = FakeAnalysis(make_infos([5, 20, 40], multipv=1))
+    engine.analysis.return_value = analysis
+    snapshots = list(analysis_snapshots(engine, Board(), thresholds=[10, 20, 30, 40]))
+    assert [s['nodes'] for s in snapshots] == [20, 40]
+
+
+def test_holds_at_every_threshold():
+    engine = mock.Mock()
+    analysis = FakeAnalysis(make_infos([10, 20, 30, 40]))
+    engine.analysis.return_value = analysis
+    assert holds_at_every_threshold(engine, Board(), lambda i: True, thresholds=[10, 20, 30], multipv=2) is True
+    assert analysis.stopped
+
+    # Search is stopped as soon as the condition breaks
+    analysis = FakeAnalysis(make_infos([10, 20, 30, 40]))
+    engine.analysis.return_value = analysis
+    condition = mock.Mock(side_effect=[True, False])
+    assert holds_at_every_threshold(engine, Board(), condition, thresholds=[10, 20, 30], multipv=2) is False
+    assert condition.call_count == 2
+    assert analysis.consumed == 4
+    assert analysis.stopped
+
+
+@pytest.fixture
+def without_prefilter():
+    def make_puzzle_filter(candidate_filter, is_good_puzzle):
+        return StagedFilter([
+            ('search', functools.partial(candidate_search, candidate_filter=candidate_filter)),
+            ('is_good_puzzle', is_good_puzzle),
+        ])
+
+    with mock.patch('morphy.mining.make_puzzle_filter', make_puzzle_filter):
+        yield
+
+
+def test_is_forcing_position():
+    # Quiet position
+    board = Board('r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3')
+    assert is_forcing_position(board, None, None, [board]) is False
+    # The only check (Bxf7+) loses the bishop to the king
+    board = Board('r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4')
+    assert is_forcing_position(board, None, None, [board]) is False
+    # Safe check (Bb5+)
+    board = Board('rnbqkbnr/ppp2ppp/3p4/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 0 3')
+    assert is_forcing_position(board, None, None, [board]) is True
+    # Winning capture
+    board = Board('rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2')
+    assert is_forcing_position(board, None, None, [board]) is True
+    # Piece of the side to move attacked by a pawn
+    board = Board('rnbqkb1r/ppp2ppp/3p1n2/4p1N1/4P3/2N5/PPPP1PPP/R1BQKB1R w KQkq - 0 4')
+    assert has_piece_en_prise(board, WHITE) is False
+    board = Board('rnbqkb1r/ppp2p1p/3p1np1/4p1N1/4P3/2N5/PPPP1PPP/R1BQKB1R w KQkq - 0 5')
+    assert has_piece_en_prise(board, WHITE) is False
+    # The knight can simply retreat
+    board = Board('rnbqkb1r/ppp2pp1/3p1n1p/4p1N1/4P3/2N5/PPPP1PPP/R1BQKB1R w KQkq - 0 5')
+    assert has_piece_en_prise(board, WHITE) is False
+    # but not when the other side is to move
+    board = Board('rnbqkb1r/ppp2pp1/3p1n1p/4p1N1/4P3/2N5/PPPP1PPP/R1BQKB1R b KQkq - 0 5')
+    assert has_piece_en_prise(board, WHITE) is True
+    # Material swing
+    prev_board = Board('rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2')
+    board = Board('rnbqkbnr/ppp1pppp/8/3P4/8/8/PPPP1PPP/RNBQKBNR b KQkq - 0 2')
+    assert is_forcing_position(board, None, None, [prev_board, board]) is True
+    # Even trade completed by the recapture
+    recaptured_board = Board('rnb1kbnr/ppp1pppp/8/3q4/8/8/PPPP1PPP/RNBQKBNR w KQkq - 0 3')
+    assert is_forcing_position(recaptured_board, None, None, [prev_board, board, recaptured_board]) is False
+
+
+@pytest.mark.parametrize('fen', [
+    # Mates in one and two
+    '6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1',
+    'r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 0 1',
+    'r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1',
+    # Quiet move setting up a mate (Qd3)
+    'r4rk1/5ppp/8/8/8/8/2B2PPP/3Q2K1 w - - 0 1',
+    # Defences: Black has to stop Qxh7# and Qxf7#
+    '5rk1/5ppp/8/8/8/3Q4/2B2PPP/6K1 b - - 0 1',
+    'r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR b KQkq - 0 1',
+])
+def test_is_forcing_position_keeps_puzzles(fen):
+    board = Board(fen)
+    assert is_forcing_position(board, None, None, [board]) is True
+
+
+def test_low_nodes_search(infos):
+    engine = mock.Mock()
+    engine.analyse.return_value = infos
+    candidate_filter = mock.Mock(return_value=False)
+    board = Board()
+    assert low_nodes_search(board, engine, None, [board], candidate_filter=candidate_filter, nodes=100) is False
+    engine.analyse.assert_called_once()
+    assert engine.analyse.call_args[0][1].nodes == 100
+    candidate_filter.assert_called_once_with(infos)
+
+
+def test_staged_filter():
+    static = mock.Mock(side_effect=[False, True, True])
+    search = mock.Mock(side_effect=[False, True])
+    staged_filter = StagedFilter([('static', static), ('search', search)])
+    assert [staged_filter(Board(), None, None, []) for _ in range(3)] == [False, False, True]
+    assert staged_filter.positions == 3
+    assert staged_filter.rejected == {'static': 1, 'search': 1}
+    assert static.call_count == 3
+    assert search.call_count == 2
+    assert staged_filter.report() == 'Positions: 3, rejected by static: 1, search: 1'
+
+
+def test_make_puzzle_filter(infos):
+    candidate_filter = mock.Mock(return_value=True)
+    is_good_puzzle = mock.Mock(return_value=True)
+    # The static stage is opt-in
+    puzzle_filter = make_puzzle_filter(candidate_filter, is_good_puzzle, prefilter_nodes=100)
+    assert [name for name, _ in puzzle_filter.stages] == ['low_nodes', 'search', 'is_good_puzzle']
+    puzzle_filter = make_puzzle_filter(candidate_filter, is_good_puzzle, static_prefilter=True, prefilter_nodes=100)
+    assert [name for name, _ in puzzle_filter.stages] == ['static', 'low_nodes', 'search', 'is_good_puzzle']
+    engine = mock.Mock()
+    engine.analyse.return_value = infos
+    board = Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1')
+    assert puzzle_filter(board, engine, None, [board]) is True
+    assert [c[0][1].nodes for c in engine.analyse.call_args_list] == [100, 10**6]
+    assert candidate_filter.call_args_list == [mock.call(infos)] * 2
+
+    puzzle_filter = make_puzzle_filter(candidate_filter, is_good_puzzle, static_prefilter=False, prefilter_nodes=None)
+    assert [name for name, _ in puzzle_filter.stages] == ['search', 'is_good_puzzle']
+
+
+def test_mine_game():
+    board = Board()
+    moves = [Move.from_uci(m) for m in ['e2e4', 'e7e5', 'g1f3', 'b8c6']]
+    is_puzzle = mock.Mock(side_effect=[False, False, True, False])
+    fens = list(mine_game(board, moves, 'engine', is_puzzle))
+    assert fens == ['rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2']
+    assert is_puzzle.call_count == 4
+    assert is_puzzle.call_args[0][1] == 'engine'
+    assert is_puzzle.call_args[0][2] == Move.from_uci('b8c6')
+
+
+def test_mine_games(tmp_path, without_prefilter):
+    out_file = str(tmp_path / 'fens.txt')
+    session = mock.MagicMock()
+    games = [b'1. e4 e5 2. Nf3', b'1. e5', b'1. d4 d5 2. c4']
+    done = []
+    logs = []
+
+    def is_good_puzzle(board, engine, move, prev_boards):
+        return board.fullmove_number == 2
+
+    mine_games(games, session, out_file, lambda i: True, is_good_puzzle, first_game=10,
+               on_game_done=done.append, log=logs.append)
+    assert done == [10, 11, 12]
+    assert 'Game number: 11' in logs[0]
+    assert any('Skipping broken game' in l for l in logs)
+    assert logs[-1] == 'Positions: 6, rejected by search: 0, is_good_puzzle: 4'
+
+    with open(out_file) as f:
+        assert f.read().split('\n') == [
+            'rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+            'rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 0 2',
+            '',
+        ]
+
+
+def test_mining_session():
+    engine_pool = mock.Mock()
+    engines = [mock.Mock(name='engine_{}'.format(i)) for i in range(3)]
+    engine_pool.checkout.return_value = engines[0]
+    engine_pool.restart.side_effect = engines[1:]
+    session = MiningSession(engine_pool, restart_after=2)
+    games = []
+
+    for _ in range(3):
+        with session.game() as engine:
+            engine.analyse(Board(), Limit(nodes=1))
+            engine.analyse(Board(), Limit(nodes=1), multipv=2)
+            games.append(engine.engine.analyse.call_args[1]['game'])
+
+    # The same engine for the first two games, each of them announced as a new game
+    assert engine_pool.checkout.call_count == 1
+    assert engines[0].analyse.call_count == 4
+    assert games[0] is not games[1]
+    assert [c[1]['game'] for c in engines[0].analyse.call_args_list] == [games[0]] * 2 + [games[1]] * 2
+    engine_pool.restart.assert_called_once_with(engines[0])
+    assert engines[1].analyse.call_count == 2
+
+    # Restarted when it fails
+    with pytest.raises(EngineTerminatedError):
+        with session.game() as engine:
+            raise EngineTerminatedError()
+
+    engine_pool.restart.assert_called_with(engines[1])
+
+    with session.game() as engine:
+        assert engine.engine is engines[2]
+
+    session.close()
+    engine_pool.checkin.assert_called_once_with(engines[2])
+
+
+def test_mine_games_engine_failure(tmp_path, without_prefilter):
+    session = mock.MagicMock()
+    session.game.return_value.__enter__.return_value.analyse.side_effect = EngineTerminatedError()
+    logs = []
+    done = []
+    mine_games([b'1. e4 e5', b'1. d4'], session, str(tmp_path / 'fens.txt'), lambda i: True, None,
+               on_game_done=done.append, log=logs.append)
+    assert done == [0, 1]
+    assert sum('Engine failed' in l for l in logs) == 2
+
+
+def test_shard_ranges():
+    assert shard_ranges(10, 3) == [(0, 3), (3, 6), (6, 10)]
+    assert shard_ranges(2, 4) == [(0, 0), (0, 1), (1, 1), (1, 2)]
+
+
+def test_checkpoint(tmp_path):
+    path = str(tmp_path / 'checkpoint')
+    assert load_checkpoint(path, 5, 10) == 5
+    save_checkpoint(path, 5, 10, 7)
+    assert load_checkpoint(path, 5, 10) == 7
+    # Database split differently
+    assert load_checkpoint(path, 0, 10) == 0
+
+
+def test_mine_shard(games_pgn_path, tmp_path, without_prefilter):
+    # The index is saved next to the PGN file
+    pgn_path = str(tmp_path / 'games.pgn')
+    shutil.copy(games_pgn_path, pgn_path)
+    out_file = str(tmp_path / 'fens.txt')
+    save_checkpoint(checkpoint_path(out_file, 1), 10, 20, 18)
+    mined_games = []
+
+    def is_good_puzzle(board, engine, move, prev_boards):
+        return False
+
+    def candidate_filter(infos):
+        mined_games.append(infos)
+        return False
+
+    with mock.patch('morphy.mining.EnginePool') as engine_pool_mock:
+        engine = engine_pool_mock.return_value.__enter__.return_value.checkout.return_value
+        engine.analyse.side_effect = lambda board, *args, **kwargs: board.fen()
+        mine_shard(pgn_path, out_file, 1, (10, 20), 'engine', candidate_filter, is_good_puzzle)
+
+    # Games 18 and 19 (both from the starting position) are mined
+    assert mined_games.count('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1') == 2
+    assert load_checkpoint(checkpoint_path(out_file, 1), 10, 20) == 20
+
+
+def test_merge_shards(tmp_path):
+    out_file = str(tmp_path / 'fens.txt')
+
+    with open(out_file, 'w') as f:
+        f.write('fen 1\n')
+
+    with open(shard_path(out_file, 0), 'w') as f:
+        f.write('fen 2\nfen 1\n\n')
+
+    with open(shard_path(out_file, 2), 'w') as f:
+        f.write('fen 3\nfen 2\n')
+
+    assert merge_shards(out_file, 3) == 3
+
+    with open(out_file) as f:
+        assert f.read() == 'fen 1\nfen 2\nfen 3\n'
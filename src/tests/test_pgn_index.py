@@ -0,0 +1,80 @@
+import os
+import shutil
+from io import (
+    BytesIO,
+    StringIO,
+)
+
+import pytest
+import chess.pgn
+
+from morphy.pgn_index import (
+    PgnIndex,
+    scan_game_offsets,
+)
+from morphy.utils import games_reader
+
+
+@pytest.fixture
+def pgn_path(games_pgn_path, tmp_path):
+    path = str(tmp_path / 'games.pgn')
+    shutil.copy(games_pgn_path, path)
+    return path
+
+
+def test_scan_game_offsets():
+    pgn = (
+        b'[Event "A"]\n[Result "1-0"]\n\n1. e4 { comment\n[not a header] } e5 1-0\n\n\n'
+        b'[Event "B"]\n\n1. d4 0-1\n'
+    )
+    offsets = list(scan_game_offsets(BytesIO(pgn)))
+    assert len(offsets) == 2
+    assert pgn[offsets[0][0]:offsets[0][1]] == b'[Event "A"]\n[Result "1-0"]\n\n1. e4 { comment\n[not a header] } e5 1-0'
+    assert pgn[offsets[1][0]:offsets[1][1]] == b'[Event "B"]\n\n1. d4 0-1'
+
+
+def test_build(pgn_path, games_pgn):
+    index = PgnIndex.build(pgn_path)
+    games = [g.strip().lstrip('﻿') for g in games_reader(games_pgn)]
+    assert len(index) == 36
+
+    with open(pgn_path, 'rb') as f:
+        assert list(index.read_games(f)) == games
+        assert index.read_game(f, 5) == games[5]
+        assert index.read_game(f, 0) == games[0]
+        assert index.read_game(f, 35) == games[35]
+        assert chess.pgn.read_game(StringIO(index.read_game(f, 26))).headers['Result'] == '1-0'
+
+    with pytest.raises(IndexError):
+        index[36]
+
+
+def test_read_games(pgn_path):
+    index = PgnIndex.build(pgn_path)
+
+    with open(pgn_path, 'rb') as f:
+        games = list(index.read_games(f))
+        assert list(index.read_games(f, 10, 5)) == games[10:15]
+        assert list(index.read_games(f, 30, 10)) == games[30:]
+        assert list(index.read_games(f, 36)) == []
+
+
+def test_open(pgn_path):
+    index_path = PgnIndex.index_path(pgn_path)
+    assert not os.path.exists(index_path)
+    index = PgnIndex.open(pgn_path)
+    assert os.path.exists(index_path)
+    loaded_index = PgnIndex.load(index_path)
+    assert [loaded_index[n] for n in range(len(loaded_index))] == [index[n] for n in range(len(index))]
+    assert not loaded_index.is_stale(pgn_path)
+
+    # Index is rebuilt when the PGN file changes
+    with open(pgn_path, 'ab') as f:
+        f.write(b'\n[Event "New"]\n\n1. e4 1-0\n')
+
+    assert loaded_index.is_stale(pgn_path)
+    index = PgnIndex.open(pgn_path)
+    assert len(index) == 37
+
+    with open(pgn_path, 'rb') as f:
+        assert index.read_game(f, 36) == '[Event "New"]\n\n1. e4 1-0'
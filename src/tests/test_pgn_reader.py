@@ -0,0 +1,69 @@
+import pytest
+import chess.pgn
+from chess import (
+    STARTING_FEN,
+    Move,
+)
+
+from morphy.pgn_index import PgnIndex
+from morphy.pgn_reader import (
+    mmap_games,
+    parse_mainline,
+    read_mainline,
+)
+
+
+def test_mmap_games(games_pgn_path, games_pgn):
+    n = 0
+
+    for g in mmap_games(games_pgn_path):
+        assert isinstance(g, memoryview)
+        game = chess.pgn.read_game(games_pgn)
+        board, moves = read_mainline(g)
+        assert board.fen() == game.board().fen()
+        assert moves == list(game.mainline_moves())
+        n += 1
+
+    assert n == 36
+
+
+def test_mmap_games_releases_slices(games_pgn_path):
+    games = mmap_games(games_pgn_path)
+    first = next(games)
+    assert bytes(first)
+    assert bytes(next(games))
+
+    with pytest.raises(ValueError):
+        bytes(first)
+
+    games.close()
+
+
+def test_mmap_games_with_index(games_pgn_path, tmp_path):
+    index = PgnIndex.build(games_pgn_path)
+    assert [bytes(g) for g in mmap_games(games_pgn_path, index=index)] == [bytes(g) for g in mmap_games(games_pgn_path)]
+    empty_pgn = tmp_path / 'empty.pgn'
+    empty_pgn.write_bytes(b'')
+    assert list(mmap_games(str(empty_pgn))) == []
+
+
+def test_parse_mainline():
+    headers, sans = parse_mainline(
+        b'[Event "Test \\"quoted\\""]\n[Result "1-0"]\n\n'
+        b'1.e4 {best by test} e5 (1...c5 2. Nf3 (2. c3)) 2. Nf3!? $1 Nc6 ; comment\n'
+        b'3. Bb5 a6?! 4. O-O 1-0'
+    )
+    assert headers == {'Event': 'Test \\"quoted\\"', 'Result': '1-0'}
+    assert sans == ['e4', 'e5', 'Nf3', 'Nc6', 'Bb5', 'a6', 'O-O']
+
+
+def test_read_mainline():
+    board, moves = read_mainline(b'[FEN "4k3/8/8/8/8/8/4P3/4K3 w - - 0 1"]\n\n1. e4 Kd7 2. e5 *')
+    assert board.fen() == '4k3/8/8/8/8/8/4P3/4K3 w - - 0 1'
+    assert moves == [Move.from_uci(m) for m in ['e2e4', 'e8d7', 'e4e5']]
+    board, moves = read_mainline(b'1. d4 d5')
+    assert board.fen() == STARTING_FEN
+    assert len(moves) == 2
+
+    with pytest.raises(ValueError):
+        read_mainline(b'1. e5')
@@ -0,0 +1,70 @@
+import contextlib
+import threading
+import time
+
+from morphy.pipeline import (
+    Pipeline,
+    Stage,
+    simple_worker,
+)
+
+
+def test_pipeline():
+    entered = []
+    exited = []
+
+    @contextlib.contextmanager
+    def worker():
+        entered.append(threading.current_thread().name)
+
+        try:
+            yield lambda i: [i, i + 100] if i % 2 else []
+        finally:
+            exited.append(threading.current_thread().name)
+
+    pipeline = Pipeline([
+        Stage('odd', worker, workers=3),
+        Stage('square', simple_worker(lambda i: [i * i]), workers=2),
+    ], poll_interval=0.01)
+    results = list(pipeline.run(range(10)))
+    assert sorted(results) == sorted([i * i for i in [1, 3, 5, 7, 9, 101, 103, 105, 107, 109]])
+    assert sorted(entered) == sorted(exited) == ['odd-0', 'odd-1', 'odd-2']
+    assert pipeline.stages[0].processed == 10
+    assert pipeline.stages[1].processed == 10
+    assert pipeline.errors == []
+
+
+def test_pipeline_backpressure():
+    read = []
+
+    def source():
+        for i in range(100):
+            read.append(i)
+            yield i
+
+    pipeline = Pipeline([
+        Stage('slow', simple_worker(lambda i: [i]), queue_size=2),
+        Stage('out', simple_worker(lambda i: [i]), queue_size=2),
+    ], poll_interval=0.01)
+    results = pipeline.run(source())
+    assert next(results) == 0
+    time.sleep(0.1)
+    # Only the queues (and the items in the workers' hands) are filled ahead of the consumer
+    assert len(read) < 12
+    results.close()
+    assert len(read) < 100
+
+
+def test_pipeline_error():
+    def fail(i):
+        if i == 3:
+            raise ValueError('broken')
+
+        return [i]
+
+    pipeline = Pipeline([Stage('fail', simple_worker(fail))], poll_interval=0.01)
+    results = list(pipeline.run(range(1000)))
+    assert results == [0, 1, 2][:len(results)]
+    assert len(pipeline.errors) == 1
+    assert pipeline.errors[0][0] == 'fail'
+    assert 'ValueError: broken' in pipeline.errors[0][1]
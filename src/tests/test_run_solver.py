@@ -0,0 +1,246 @@
+import os
+from io import BytesIO
+from unittest import mock
+
+import pytest
+from chess.engine import (
+    PovScore,
+    Mate,
+)
+from click.testing import CliRunner
+
+from morphy.benchmark import ScriptedEngine
+from morphy.constant import (
+    MATE_CAT,
+    MATERIAL_CAT,
+    PREDICTED_FAILURE,
+    TOO_MANY_SOLUTIONS,
+)
+from morphy.config import settings
+from morphy.solutions import open_solutions
+from morphy.utils import CannotSolve
+from morphy.run_solver import (
+    read_puzzles,
+    load_cursor,
+    save_cursor,
+    solve_puzzle,
+    solve_in_process,
+    solve_in_workers,
+    solve_in_event_loop,
+    main,
+)
+
+
+FEN = '6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1'
+FENS = [
+    '6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1',
+    'r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 0 1',
+    '8/8/8/8/8/5k2/6q1/4K3 b - - 0 1',
+    'r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 0 1',
+]
+
+
+@pytest.fixture
+def engine_path(request):
+    return os.path.join(os.path.dirname(request.module.__file__), 'test_data', 'fake_uci.py')
+
+
+@pytest.fixture
+def restore_settings():
+    saved = dict(settings)
+    yield
+    settings.clear()
+    settings.update(saved)
+
+
+@pytest.fixture
+def puzzles_path(tmp_path):
+    path = tmp_path / 'puzzles.txt'
+    path.write_text(''.join('{}\n'.format(f) for f in FENS))
+    return str(path)
+
+
+def test_read_puzzles():
+    puzzles = b'8/8/8/8/8/8/8/K1k5 w - - 0 1\n\n  8/8/8/8/8/8/8/K1k5   b - - 0 1 \n8/8/8/8/8/8/8/K2k4 w - - 0 1'
+    fens = list(read_puzzles(BytesIO(puzzles)))
+    assert fens == [
+        ('8/8/8/8/8/8/8/K1k5 w - - 0 1', 29),
+        ('8/8/8/8/8/8/8/K1k5 b - - 0 1', 64),
+        ('8/8/8/8/8/8/8/K2k4 w - - 0 1', 92),
+    ]
+    assert list(read_puzzles(BytesIO(puzzles), 29)) == fens[1:]
+    assert list(read_puzzles(BytesIO(puzzles), 92)) == []
+
+
+def test_cursor(tmp_path):
+    solutions = str(tmp_path / 'solutions.db')
+    puzzles = tmp_path / 'puzzles.txt'
+    other_puzzles = tmp_path / 'other_puzzles.txt'
+    puzzles.write_bytes(b'x' * 100)
+    other_puzzles.write_bytes(b'x' * 100)
+    assert load_cursor(solutions, str(puzzles)) == 0
+    save_cursor(solutions, str(puzzles), 42)
+    save_cursor(solutions, str(other_puzzles), 7)
+    assert load_cursor(solutions, str(puzzles)) == 42
+    assert load_cursor(solutions, str(other_puzzles)) == 7
+    # Puzzles file replaced by a shorter one
+    puzzles.write_bytes(b'x' * 10)
+    assert load_cursor(solutions, str(puzzles)) == 0
+
+
+def test_solve_puzzle_search_summary():
+    solution, puzzle_cat, _ = solve_puzzle(FEN, ScriptedEngine())
+    assert solution['is_solved']
+    assert solution['search']['puzzle_cat'] == puzzle_cat
+    assert solution['search']['depth'] > 0
+    assert 'reason' not in solution['search']
+
+    error = CannotSolve('Too many', TOO_MANY_SOLUTIONS)
+
+    with mock.patch('morphy.solver.Solver.stop_if_too_many_solutions', side_effect=error):
+        solution, _, _ = solve_puzzle(FEN, ScriptedEngine())
+
+    assert not solution['is_solved']
+    assert solution['reason'] == TOO_MANY_SOLUTIONS
+    assert solution['search']['reason'] == TOO_MANY_SOLUTIONS
+    assert solution['search']['message'] == 'Too many'
+    assert solution['search']['depth'] == 0
+    assert solution['search']['open_lines'] == 1
+
+
+def test_solve_puzzle_skips_predicted_failures():
+    predictor = mock.Mock()
+    predictor.should_skip.return_value = True
+    engine = mock.Mock(wraps=ScriptedEngine())
+    solution, puzzle_cat, _ = solve_puzzle(FEN, engine, predictor=predictor)
+    assert solution['reason'] == PREDICTED_FAILURE
+    assert not solution['is_solved']
+    predictor.should_skip.assert_called_once_with(puzzle_cat, solution['search']['root_score'])
+    # Only the root position is analysed
+    assert {c[0][0].fen() for c in engine.analyse.call_args_list} == {FEN}
+    assert solution['search']['engine_time'] > 0
+
+
+class MateEngine(ScriptedEngine):
+    """
+    ScriptedEngine finding a mate in the root position at ``mate_depth`` and deeper.
+    """
+
+    def __init__(self, mate_depth):
+        self.mate_depth = mate_depth
+
+    def analyse(self, board, limit, multipv=None, options=None, **kwargs):
+        infos = super().analyse(board, limit, multipv=multipv, options=options, **kwargs)
+
+        if board.fen() == FEN and limit.depth >= self.mate_depth:
+            infos[0]['score'] = PovScore(Mate(3), board.turn)
+
+        return infos
+
+
+@pytest.mark.parametrize('mate_depth, root_searches', [
+    # Mate found by the search with the mate category conf, which seeds the solve
+    (1, [(20, 4)]),
+    # Only the deeper search finds the mate, the solve is seeded by the first search all the same
+    (25, [(20, 4), (29, 3)]),
+    # Material puzzle, seeded by the search with the material category conf
+    (100, [(20, 4), (29, 3)]),
+])
+def test_solve_puzzle_searches_root_once_per_conf(mate_depth, root_searches):
+    engine = mock.Mock(wraps=MateEngine(mate_depth))
+    solution, puzzle_cat, _ = solve_puzzle(FEN, engine)
+    assert puzzle_cat == (MATE_CAT if mate_depth < 100 else MATERIAL_CAT)
+    assert solution['search']['puzzle_cat'] == puzzle_cat
+    assert ('mate' in solution['search']['root_score']) == (puzzle_cat == MATE_CAT)
+    assert [(c[1]['limit'].depth, c[1]['multipv']) for c in engine.analyse.call_args_list
+            if c[0][0].fen() == FEN] == root_searches
+
+
+def test_solve_puzzle_engine_time_includes_root_search():
+    solution, _, _ = solve_puzzle(FEN, ScriptedEngine(), with_stats=True)
+    assert solution['search']['engine_time'] == pytest.approx(solution['stats']['engine_time'])
+
+
+def test_solve_in_process_survives_engine_crash(engine_path, restore_settings, monkeypatch):
+    settings['ENGINE_PATH'] = engine_path
+    monkeypatch.setenv('FAKE_UCI_CRASH_FEN', FENS[1])
+    results = list(solve_in_process(iter(FENS)))
+    assert [r[0] for r in results] == FENS
+    assert results[1][1] is None
+    assert 'EngineTerminatedError' in results[1][4]
+    # The engine is restarted for the next puzzles
+    assert all(r[1]['is_solved'] and r[4] is None for r in results[:1] + results[2:])
+
+
+def test_solve_in_workers(engine_path, restore_settings):
+    results = list(solve_in_workers(iter(FENS), 2, None, {'ENGINE_PATH': engine_path}))
+    # Results come in input order
+    assert [r[0] for r in results] == FENS
+    assert all(r[1]['is_solved'] and r[4] is None for r in results)
+
+
+def test_solve_in_event_loop(engine_path, restore_settings):
+    settings['ENGINE_PATH'] = engine_path
+    results = list(solve_in_event_loop(iter(FENS), 3))
+    assert [r[0] for r in results] == FENS
+    assert all(r[1]['is_solved'] and r[4] is None for r in results)
+
+
+@pytest.mark.parametrize('args', [[], ['-w', '2'], ['-C', '2']])
+def test_main(tmp_path, puzzles_path, engine_path, restore_settings, args):
+    solutions = str(tmp_path / 'solutions.db')
+    run = ['-s', solutions, '-p', puzzles_path, '-e', engine_path] + args
+    result = CliRunner().invoke(main, run + ['-n', '3'])
+    assert result.exit_code == 0, result.output
+
+    with open_solutions(solutions) as store:
+        assert [s['fen'] for s in store] == FENS[:3], result.output
+
+    # The cursor is after the third puzzle
+    assert load_cursor(solutions, puzzles_path) == sum(len(f) + 1 for f in FENS[:3])
+    result = CliRunner().invoke(main, run + ['-n', '3'])
+    assert result.exit_code == 0, result.output
+
+    with open_solutions(solutions) as store:
+        assert [s['fen'] for s in store] == FENS
+
+    assert load_cursor(solutions, puzzles_path) == sum(len(f) + 1 for f in FENS)
+
+
+@pytest.mark.parametrize('args, mode', [
+    ([], 'solve_in_process'),
+    (['-w', '2'], 'solve_in_workers'),
+    (['-w', '2', '-C', '2'], 'solve_in_event_loop'),
+])
+def test_main_mode(tmp_path, puzzles_path, restore_settings, args, mode):
+    solutions = str(tmp_path / 'solutions.db')
+
+    # Results are a generator closed by main
+    no_results = lambda *args, **kwargs: (r for r in [])
+
+    with mock.patch('morphy.run_solver.{}'.format(mode), side_effect=no_results) as solve_mock:
+        result = CliRunner().invoke(main, ['-s', solutions, '-p', puzzles_path, '-e', 'engine'] + args)
+
+    assert result.exit_code == 0, result.output
+    solve_mock.assert_called_once()
+
+
+def test_main_does_not_save_skipped_puzzles(tmp_path, puzzles_path, engine_path, restore_settings):
+    solutions = str(tmp_path / 'solutions.db')
+    run = ['-s', solutions, '-p', puzzles_path, '-e', engine_path, '-n', '2', '--skip-predicted-failures']
+
+    with mock.patch('morphy.failure_predictor.FailurePredictor.should_skip', return_value=True):
+        result = CliRunner().invoke(main, run)
+
+    assert result.exit_code == 0, result.output
+
+    with open_solutions(solutions) as store:
+        assert store.count() == 0
+
+    # A run with --from-start and without the predictor solves them
+    result = CliRunner().invoke(main, ['-s', solutions, '-p', puzzles_path, '-e', engine_path, '-n', '2',
+                                       '--from-start'])
+    assert result.exit_code == 0, result.output
+
+    with open_solutions(solutions) as store:
+        assert [s['fen'] for s in store] == FENS[:2]
@@ -0,0 +1,131 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from morphy.cn_utils import Puzzle
+from morphy.import_solutions import main as import_solutions
+from morphy.solutions import (
+    SolutionsStore,
+    JsonlSolutions,
+    open_solutions,
+)
+
+
+FEN_1 = 'r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'
+FEN_2 = '4r1k1/8/3R1Qpp/2p5/2P1p1q1/P3P3/1P2PK2/8 b - - 0 1'
+FEN_3 = 'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3'
+
+
+def solution(fen, is_solved=True):
+    return {'fen': fen, 'is_solved': is_solved, 'lines': []}
+
+
+@pytest.fixture(params=['solutions.db', 'solutions.jsonl'])
+def solutions_path(request, tmp_path):
+    return str(tmp_path / request.param)
+
+
+def test_store(solutions_path):
+    store = open_solutions(solutions_path, batch_size=2)
+    assert isinstance(store, JsonlSolutions if solutions_path.endswith('.jsonl') else SolutionsStore)
+    assert FEN_1 not in store
+    assert store.count() == 0
+    store.add(solution(FEN_1))
+    # Pending solutions are visible before they are written
+    assert FEN_1 in store
+    assert ' {} '.format(FEN_1.replace(' ', '  ')) in store
+    store.add(solution(FEN_2, is_solved=False))
+    store.add(solution(FEN_3))
+    assert store.count() == 3
+    assert store.count(is_solved=True) == 2
+    assert store.count(is_solved=False) == 1
+    assert len(store) == 3
+    store.close()
+
+    with open_solutions(solutions_path) as store:
+        assert FEN_1 in store
+        assert FEN_2 in store
+        assert FEN_3 in store
+        assert store.count(is_solved=True) == 2
+        assert [s['fen'] for s in store] == [FEN_1, FEN_2, FEN_3]
+
+
+def test_sqlite_store(tmp_path):
+    path = str(tmp_path / 'solutions.db')
+
+    with SolutionsStore(path, batch_size=10) as store:
+        store.add(solution(FEN_1))
+        assert store.get(FEN_1) == solution(FEN_1)
+        # A solution of the same position replaces the previous one
+        store.add(solution(FEN_1, is_solved=False))
+        store.flush()
+        assert store.get(FEN_1) == solution(FEN_1, is_solved=False)
+        assert store.get(FEN_2) is None
+        assert store.count() == 1
+        assert store._db.execute('SELECT id FROM solutions').fetchone()[0] == Puzzle.hash_from_fen(FEN_1)
+
+    with SolutionsStore(path) as store:
+        assert list(store) == [solution(FEN_1, is_solved=False)]
+
+
+def test_import_jsonl(tmp_path):
+    jsonl_path = str(tmp_path / 'solutions.jsonl')
+
+    with open(jsonl_path, 'w') as f:
+        for s in [solution(FEN_1), solution(FEN_2, is_solved=False), solution(FEN_3)]:
+            f.write('{}\n\n'.format(json.dumps(s)))
+
+    with SolutionsStore(str(tmp_path / 'solutions.db')) as store:
+        store.import_jsonl(jsonl_path)
+        assert store.count() == 3
+        assert store.count(is_solved=False) == 1
+        assert [s['fen'] for s in store] == [FEN_1, FEN_2, FEN_3]
+
+
+def test_open_solutions_detects_format(tmp_path):
+    jsonl_path = str(tmp_path / 'solutions.txt')
+
+    with open(jsonl_path, 'w') as f:
+        f.write('{}\n'.format(json.dumps(solution(FEN_1))))
+
+    with open_solutions(jsonl_path) as store:
+        assert isinstance(store, JsonlSolutions)
+        assert FEN_1 in store
+
+    db_path = str(tmp_path / 'solutions.jsonl.bak')
+    empty_path = tmp_path / 'empty.jsonl.bak'
+    empty_path.write_bytes(b'')
+
+    for path in [db_path, str(empty_path)]:
+        with open_solutions(path) as store:
+            assert isinstance(store, SolutionsStore)
+            store.add(solution(FEN_2))
+
+    # Named like JSON lines, but already a database
+    renamed_path = str(tmp_path / 'renamed.jsonl')
+    (tmp_path / 'solutions.jsonl.bak').rename(renamed_path)
+
+    with open_solutions(renamed_path) as store:
+        assert isinstance(store, SolutionsStore)
+        assert FEN_2 in store
+
+
+def test_import_solutions(tmp_path):
+    jsonl_path = str(tmp_path / 'solutions.jsonl')
+    db_path = str(tmp_path / 'solutions.db')
+
+    with open(jsonl_path, 'w') as f:
+        for s in [solution(FEN_1), solution(FEN_2, is_solved=False)]:
+            f.write('{}\n'.format(json.dumps(s)))
+
+    result = CliRunner().invoke(import_solutions, [jsonl_path, db_path])
+    assert result.exit_code == 0, result.output
+
+    with open_solutions(db_path) as store:
+        assert isinstance(store, SolutionsStore)
+        assert [s['fen'] for s in store] == [FEN_1, FEN_2]
+
+    # A JSON lines file is not a store to import into
+    result = CliRunner().invoke(import_solutions, [jsonl_path, jsonl_path])
+    assert result.exit_code != 0
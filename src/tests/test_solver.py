@@ -4,6 +4,7 @@ from unittest import mock
 import pytest
 from chess import (
     Board,
+    Move,
     BLACK,
     WHITE,
 )
@@ -12,13 +13,22 @@ from chess.engine import (
     Cp,
     Mate,
 )
+from morphy.cache import (
+    trim_info,
+    trim_infos,
+)
 from morphy.engine import (
     Limit,
+    AnalysisStopped,
+)
+from morphy.line import (
+    Line,
+    AnalysisRecord,
 )
-from morphy.line import Line
 
 from morphy.solver import (
     Solver,
+    guess_puzzle_cat,
 )
 from morphy.settings.default_settings import (
     BEST_MOVE_SEARCH_CONF,
@@ -26,6 +36,16 @@ from morphy.settings.default_settings import (
     CP_CLOSE_SCORE,
     MATE_CLOSE_SCORE,
 )
+from morphy.stats import SolverStats
+from morphy.depth_policy import AdaptiveDepthPolicy
+from morphy.constant import (
+    MATE_CAT,
+    MATERIAL_CAT,
+    BROKEN_LINE,
+    TOO_MANY_GOOD_MOVES,
+    SOLUTION_TOO_LONG,
+    TOO_MANY_SOLUTIONS,
+)
 from morphy.utils import (
     close_score_threshold,
     CannotSolve,
@@ -39,11 +59,13 @@ def test_reset():
     solver._closed_lines = [4, 5, 6]
     solver._fen = 'aneczka'
     solver._depth = 42
+    solver.transposition_table.put(Board(), {'depth': 1}, Limit(depth=1))
     solver.reset()
     assert solver._closed_lines == []
     assert solver._open_lines == []
     assert solver._fen is None
     assert solver._depth == 0
+    assert len(solver.transposition_table) == 0
 
 
 def test_best_move_search_conf_should_be_copied():
@@ -74,8 +96,9 @@ def test_best_moves_search_conf_should_be_copied():
     assert solver.best_moves_search_conf['options'] != best_moves_search_conf['options']
     
     
-def test_search_best_move(line):
+def test_search_best_move(line, infos):
     engine = mock.Mock()
+    engine.analyse.return_value = infos[0]
     limit = Limit(nodes=10**7)
     solver = Solver(engine)
     info = solver.search_best_move(line, limit=limit)
@@ -89,8 +112,9 @@ def test_search_best_move(line):
     assert info == engine.analyse.return_value
     
     
-def test_search_best_moves(line):
+def test_search_best_moves(line, infos):
     engine = mock.Mock()
+    engine.analyse.return_value = infos
     solver = Solver(engine)
     multipv = 2
     info = solver.search_best_moves(line, multipv=multipv)
@@ -104,6 +128,186 @@ def test_search_best_moves(line):
     assert info == engine.analyse.return_value
     
     
+def test_search_with_adaptive_depth(line, infos):
+    engine = mock.Mock()
+    engine.analyse.return_value = infos[0]
+    solver = Solver(engine, depth_policy=AdaptiveDepthPolicy(start_depth=16, step=4))
+    assert solver.search_best_move(line) == infos[0]
+    # Same best move at depths 16 and 20
+    assert [c[1]['limit'].depth for c in engine.analyse.call_args_list] == [16, 20]
+
+    engine.reset_mock()
+    engine.analyse.side_effect = [infos[0], infos[1], infos[2], infos[2]]
+    line = line.make_move(infos[0]['pv'][0])
+    assert solver.search_best_move(line) == infos[2]
+    assert [c[1]['limit'].depth for c in engine.analyse.call_args_list] == [16, 20, 24, 28]
+
+
+def test_search_with_adaptive_depth_reuses_full_search(line, infos):
+    engine = mock.Mock()
+    solver = Solver(engine, depth_policy=AdaptiveDepthPolicy())
+    solver.transposition_table.put(line.board, infos, **solver.best_moves_search_conf)
+    assert solver.search_best_moves(line) == trim_infos(infos)
+    engine.analyse.assert_not_called()
+    assert (solver.transposition_table.hits, solver.transposition_table.misses) == (1, 0)
+
+
+def test_search_limits_probe_is_not_counted(line, infos):
+    engine = mock.Mock()
+    engine.analyse.return_value = infos[0]
+    analysis_cache = mock.Mock()
+    analysis_cache.get.return_value = None
+    solver = Solver(engine, analysis_cache=analysis_cache, depth_policy=AdaptiveDepthPolicy(start_depth=16, step=4))
+    assert solver.search_best_move(line) == infos[0]
+    # One lookup per searched depth
+    assert solver.transposition_table.misses == 2
+    assert analysis_cache.get.call_count == 2
+    analysis_cache.contains.assert_not_called()
+
+
+def test_search_best_moves_widens_multipv(line):
+    moves = list(line.board.legal_moves)
+
+    def engine_infos(scores):
+        def analyse(board, multipv=None, **kwargs):
+            return [
+                {'score': PovScore(Cp(s), board.turn), 'pv': [m], 'multipv': i + 1}
+                for i, (s, m) in enumerate(list(zip(scores, moves))[:multipv])
+            ]
+
+        return analyse
+
+    def searched_widths(scores):
+        engine = mock.Mock()
+        engine.analyse.side_effect = engine_infos(scores)
+        solver = Solver(engine, best_moves_search_conf=dict(BEST_MOVES_SEARCH_CONF, multipv=16), multipv_start=4)
+        best_moves = solver.extract_best_winning_moves(solver.search_best_moves(line), line)
+        return [c[1]['multipv'] for c in engine.analyse.call_args_list], len(best_moves)
+
+    # All lines are best moves, more could be
+    assert searched_widths([1000] * 6 + [100] * 10) == ([4, 8], 6)
+    assert searched_widths([1000] * 16) == ([4, 8, 16], 16)
+    assert searched_widths([1000, 100, 100, 100, 100]) == ([4], 1)
+    # Position with fewer moves than lines asked for
+    assert searched_widths([1000] * 3) == ([4], 3)
+
+
+def test_search_best_moves_reuses_full_multipv_search(line, infos):
+    engine = mock.Mock()
+    solver = Solver(engine, best_moves_search_conf=dict(BEST_MOVES_SEARCH_CONF, multipv=16), multipv_start=4)
+    solver.transposition_table.put(line.board, infos, **solver.best_moves_search_conf)
+    assert solver.search_best_moves(line) == trim_infos(infos)
+    engine.analyse.assert_not_called()
+    assert (solver.transposition_table.hits, solver.transposition_table.misses) == (1, 0)
+
+    # Full search in the analysis cache
+    analysis_cache = mock.Mock()
+    analysis_cache.contains.return_value = True
+    analysis_cache.get.return_value = infos
+    solver = Solver(engine, best_moves_search_conf=dict(BEST_MOVES_SEARCH_CONF, multipv=16), multipv_start=4,
+                    analysis_cache=analysis_cache)
+    assert solver.search_best_moves(line) == infos
+    engine.analyse.assert_not_called()
+    analysis_cache.contains.assert_called_once_with(line.board, **solver.best_moves_search_conf)
+    analysis_cache.get.assert_called_once_with(line.board, **solver.best_moves_search_conf)
+
+
+def test_analyse_with_cache(line, infos):
+    engine = mock.Mock()
+    engine.analyse.return_value = infos
+    analysis_cache = mock.Mock()
+    analysis_cache.get.return_value = None
+    solver = Solver(engine, analysis_cache=analysis_cache)
+    assert solver.search_best_moves(line) == infos
+    engine.analyse.assert_called_once_with(line.board, **solver.best_moves_search_conf)
+    analysis_cache.get.assert_called_once_with(line.board, **solver.best_moves_search_conf)
+    analysis_cache.put.assert_called_once_with(line.board, infos, **solver.best_moves_search_conf)
+
+    engine.reset_mock()
+    solver.transposition_table.clear()
+    analysis_cache.get.return_value = infos[:1]
+    assert solver.search_best_moves(line) == infos[:1]
+    engine.analyse.assert_not_called()
+
+
+def test_analyse_transpositions(infos):
+    engine = mock.Mock()
+    engine.analyse.return_value = infos[0]
+    solver = Solver(engine)
+    line = Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'))
+    line_a = line.make_move(Move.from_uci('c1b1')).make_move(Move.from_uci('a7a6')).make_move(Move.from_uci('b2b3'))
+    line_b = line.make_move(Move.from_uci('b2b3')).make_move(Move.from_uci('a7a6')).make_move(Move.from_uci('c1b1'))
+    assert solver.search_best_move(line_a) == infos[0]
+    assert solver.search_best_move(line_b) == trim_info(infos[0])
+    engine.analyse.assert_called_once_with(line_a.board, **solver.best_move_search_conf)
+    assert solver.transposition_table.hits == 1
+
+    engine.analyse.return_value = infos
+    assert solver.search_best_moves(line_b) == infos
+    assert engine.analyse.call_count == 2
+
+
+def test_update_lines_releases_boards():
+    solver = Solver('engine')
+    root_line = Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'))
+    solver._open_lines = [root_line]
+    lines = [[root_line.make_move(Move.from_uci(m)) for m in ['c1b1', 'd5e7', 'b2b3']]]
+    lines[0][1].close()
+    lines[0][2]._repeated_position = True
+    # Evaluating the lines builds their boards
+    for l in lines[0]:
+        l.board
+    solver._evaluate_lines = mock.Mock()
+    solver.should_terminate = mock.Mock()
+    solver._update_lines(lines)
+    assert solver._open_lines == [lines[0][0]]
+    assert solver._closed_lines == [lines[0][1]]
+    assert lines[0][0]._board is not None
+    assert root_line._board is None
+    assert lines[0][1]._board is None
+    assert lines[0][2]._board is None
+    # Boards are rebuilt on demand
+    assert lines[0][1].board.fen() == 'r2b1r1k/pppqN1pn/2npb1Q1/5N1p/2B1PP1P/8/PPP5/2K3RR b - - 1 1'
+    assert lines[0][1].board.move_stack == [Move.from_uci('d5e7')]
+
+
+def test_analyse_root(infos):
+    fen = 'r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'
+    engine = mock.Mock()
+    engine.analyse.return_value = infos
+    solver = Solver(engine)
+    assert solver.analyse_root(fen) == infos
+    engine.analyse.assert_called_once_with(Board(fen), **solver.best_moves_search_conf)
+
+
+def test_guess_puzzle_cat(infos):
+    assert guess_puzzle_cat(infos) == MATERIAL_CAT
+    infos[0]['score'] = PovScore(Mate(3), WHITE)
+    assert guess_puzzle_cat(infos) == MATE_CAT
+
+
+def test_solve_reuses_root_infos(infos):
+    fen = 'r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'
+    engine = mock.Mock()
+    engine.analyse.side_effect = CannotSolve
+    solver = Solver(engine)
+
+    with pytest.raises(CannotSolve):
+        solver.solve(fen, root_infos=infos)
+
+    # Only the computer reply has been searched, the root came from root_infos
+    engine.analyse.assert_called_once()
+    assert engine.analyse.call_args[0][0].fen() == 'r2b1r1k/pppqN1pn/2npb1Q1/5N1p/2B1PP1P/8/PPP5/2K3RR b - - 1 1'
+
+    engine.reset_mock()
+    solver = Solver(engine)
+
+    with pytest.raises(CannotSolve):
+        solver.solve(fen)
+
+    engine.analyse.assert_called_once_with(Board(fen), **solver.best_moves_search_conf)
+
+
 def test_move_to_closed_lines():
     solver = Solver('engine')
     solver._closed_lines.append(Line(Board()))
@@ -170,6 +374,8 @@ def test_get_next_player_lines(infos):
     solver = Solver(engine)
     assert solver.get_next_player_lines(line)[0].board.fen() == 'r2b1r1k/pppqN1pn/2npb1Q1/5N1p/2B1PP1P/8/PPP5/2K3RR b - - 1 1'
     assert len(solver.get_next_player_lines(line)) == 1
+    # Only the compact record of the engine info is kept
+    assert solver.get_next_player_lines(line)[0]._node.info == AnalysisRecord.from_info(infos[0])
 
 
 def test_get_next_comp_line(infos):
@@ -218,16 +424,78 @@ def test_go_deeper(infos):
     assert solver._depth == 1
 
 
+def test_go_deeper_stats(infos):
+    line = Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'))
+    engine = mock.Mock()
+    engine.analyse.return_value = infos
+    stats = SolverStats()
+    solver = Solver(engine, max_number_best_moves=len(infos), stats=stats)
+    solver.extract_best_winning_moves = lambda i, l: i
+    solver._open_lines = [line, line]
+    solver._go_deeper()
+    summary = stats.to_dict()
+    # The second line is a transposition of the first one
+    assert [(a['ply'], a['cached'], a['multipv'], a['depth']) for a in summary['analysis_calls']] == [
+        (0, False, BEST_MOVES_SEARCH_CONF['multipv'], infos[0]['depth']),
+        (0, True, BEST_MOVES_SEARCH_CONF['multipv'], infos[0]['depth']),
+    ]
+    assert summary['analyses'] == 2
+    assert summary['cached'] == 1
+    assert summary['functions']['go_deeper']['calls'] == 1
+    assert summary['functions']['should_terminate']['calls'] == 2
+    assert summary['functions']['evaluate_lines']['calls'] == 2
+    assert [(p['ply'], p['open_lines'], p['analyses']) for p in summary['plies']] == [(0, 2, 2)]
+
+
+def test_go_deeper_parallel(infos):
+    line = Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'))
+    engine = mock.Mock()
+    engine.analyse.return_value = infos
+    solver = Solver(engine, max_number_best_moves=len(infos), max_workers=3)
+    solver.extract_best_winning_moves = lambda i, l: i
+    solver._open_lines = [line, line, line]
+    lines = solver._go_deeper()
+    assert len(lines) == 3
+    assert [len(l) for l in lines] == [5, 5, 5]
+    assert solver._depth == 1
+    assert solver._stop_event is None
+
+    for c in engine.analyse.call_args_list:
+        assert c[1]['stop_event'] is not None
+
+
+def test_go_deeper_parallel_stops_searches(infos):
+    broken_line = Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'))
+    line = Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1'))
+    stopped = []
+
+    def analyse(board, stop_event=None, **kwargs):
+        if board is broken_line.board:
+            return []
+
+        assert stop_event.wait(timeout=5)
+        stopped.append(board)
+        raise AnalysisStopped
+
+    engine = mock.Mock()
+    engine.analyse.side_effect = analyse
+    solver = Solver(engine, max_workers=3)
+    solver.extract_best_winning_moves = lambda i, l: i
+    solver._open_lines = [line, broken_line, line]
+
+    with pytest.raises(CannotSolve):
+        solver._go_deeper()
+
+    # The last line might have been cancelled before it started
+    assert stopped in ([line.board], [line.board, line.board])
+    assert solver._depth == 0
+    assert solver._stop_event is None
+
+
 def test_evaluate_lines():
     engine = mock.Mock()
     solver = Solver(engine)
-    lines = [
-        Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1')),
-        Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1')),
-        Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1')),
-    ]
-    for l in lines:
-        l.evaluate = mock.Mock()
+    lines = [mock.Mock(spec=Line) for _ in range(3)]
 
     solver._evaluate_lines(lines)
 
@@ -243,7 +511,7 @@ def test_remove_repetitions():
         Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1')),
         Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1')),
     ]
-    lines[1].has_repetition = lambda: True
+    lines[1]._repeated_position = True
     assert solver.remove_repetitions(lines) == [lines[0], lines[2]]
     
 
@@ -255,8 +523,10 @@ def test_stop_if_broken_line():
     assert solver.stop_if_broken_line(lines) is None
     lines.append([])
     
-    with pytest.raises(CannotSolve):
+    with pytest.raises(CannotSolve) as e:
         solver.stop_if_broken_line(lines)
+
+    assert e.value.reason == BROKEN_LINE
         
     
 def test_stop_if_solution_too_long():
@@ -272,13 +542,17 @@ def test_stop_if_solution_too_long():
             Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1')),
         ],
     ]
-    lines[0][0].length = lambda: solver.max_line_length 
+    lines[0][0] = mock.Mock(spec=Line)
+    lines[0][0].length.return_value = solver.max_line_length
     assert solver.stop_if_solution_too_long(lines) is None
-    lines[1][0].length = lambda: solver.max_line_length + 1
+    lines[1][0] = mock.Mock(spec=Line)
+    lines[1][0].length.return_value = solver.max_line_length + 1
     
-    with pytest.raises(CannotSolve):
+    with pytest.raises(CannotSolve) as e:
         solver.stop_if_solution_too_long(lines)
 
+    assert e.value.reason == SOLUTION_TOO_LONG
+
 
 def test_stop_if_too_many_solutions():
     engine = mock.Mock()
@@ -290,8 +564,10 @@ def test_stop_if_too_many_solutions():
     assert solver.stop_if_too_many_solutions() is None
     solver._closed_lines.extend([1])
 
-    with pytest.raises(CannotSolve):
+    with pytest.raises(CannotSolve) as e:
         solver.stop_if_too_many_solutions()
+
+    assert e.value.reason == TOO_MANY_SOLUTIONS
         
 
 def test_stop_if_too_many_good_moves():
@@ -310,8 +586,10 @@ def test_stop_if_too_many_good_moves():
     assert solver.stop_if_too_many_good_moves(lines) is None
     solver.max_number_best_moves = 1
     
-    with pytest.raises(CannotSolve):
+    with pytest.raises(CannotSolve) as e:
         solver.stop_if_too_many_good_moves(lines)
+
+    assert e.value.reason == TOO_MANY_GOOD_MOVES
         
 
 def test_filter_winning_material_solutions():
@@ -337,34 +615,34 @@ def test_filter_winning_material_solutions():
             Line(Board('r2b1r1k/pppq2pn/2npb1Q1/3N1N1p/2B1PP1P/8/PPP5/2K3RR w - - 0 1')),
         ],
     ]
-    lines[1][0]._analysis_result.append({
+    lines[1][0]._node.info = {
         'score': PovScore(Cp(11), BLACK)
-    })
+    }
     lines[1][0].close()
-    lines[1][1]._analysis_result.append({
+    lines[1][1]._node.info = {
         'score': PovScore(Cp(11), BLACK)
-    })
+    }
     lines[1][1].close()
     
-    lines[2][0]._analysis_result.append({
+    lines[2][0]._node.info = {
         'score': PovScore(Cp(11), BLACK)
-    })
+    }
     lines[2][0].close()
-    lines[2][1]._analysis_result.append({
+    lines[2][1]._node.info = {
         'score': PovScore(Cp(11), BLACK)
-    })
+    }
 
-    lines[3][0]._analysis_result.append({
+    lines[3][0]._node.info = {
         'score': PovScore(Cp(11), BLACK)
-    })
+    }
     lines[3][0].close()
-    lines[3][1]._analysis_result.append({
+    lines[3][1]._node.info = {
         'score': PovScore(Cp(11), BLACK)
-    })
+    }
     lines[3][1].close()
-    lines[3][2]._analysis_result.append({
+    lines[3][2]._node.info = {
         'score': PovScore(Mate(11), BLACK)
-    })
+    }
     lines[3][2].close()
     
     assert solver.filter_winning_material_solutions(lines) == [lines[0], lines[2], lines[3]]